@@ -0,0 +1,215 @@
+""" asyncio counterpart to executor.call(), for running many commands at once
+
+Both pipes of every command are read by the event loop (no threads), so dozens of commands
+can run concurrently (as many as the jobpool admits, the rest wait on the loop).  Requires
+python 3.5+, which is why it lives apart from executor (which hatchery imports everywhere,
+python 2 included).
+"""
+
+import os
+import sys
+import time
+import shlex
+import signal
+import codecs
+import asyncio
+import logging
+import funcy
+from . import executor
+from . import jobpool
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+async def _read_stream(stream, stream_name, suppress_output, tail):
+    """ Read stream to the end, keeping the last of it in tail (an executor.OutputTail) and
+    echoing it to the sys stream of the same name unless suppress_output is set
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    while True:
+        data = await stream.read(READ_CHUNK_SIZE)
+        tail.add(data)
+        if not suppress_output:
+            text = decoder.decode(data, final=not data)
+            if text:
+                getattr(sys, stream_name).write(text)
+                getattr(sys, stream_name).flush()
+        if not data:
+            return
+
+
+def _signal(process, signum):
+    """ Send signum to process's group (it leads its own), return False if there was nothing
+    left to send it to
+    """
+    try:
+        if 'posix' in sys.builtin_module_names:
+            os.killpg(process.pid, signum)
+        elif signum == signal.SIGTERM:
+            process.terminate()
+        elif signum:
+            process.kill()
+        else:
+            return process.returncode is None
+    except OSError:
+        # exited in the meantime
+        return False
+    return True
+
+
+async def _terminate(process, cmd_args):
+    """ Terminate process, and with it anything it started, killing whatever is still running
+    executor.TERMINATE_GRACE_SECONDS later
+    """
+    if not _signal(process, signal.SIGTERM):
+        return
+    deadline = time.time() + executor.TERMINATE_GRACE_SECONDS
+    while time.time() < deadline:
+        if not _signal(process, 0):
+            return
+        await asyncio.sleep(0.1)
+    logger.warning('`{}` ignored SIGTERM, killing it'.format(' '.join(cmd_args)))
+    _signal(process, signal.SIGKILL if hasattr(signal, 'SIGKILL') else signal.SIGTERM)
+
+
+async def async_call(cmd_args, suppress_output=False, cwd=None, env=None):
+    """ Like executor.call(), as a coroutine
+
+    Cancelling the task running it terminates the command (and anything it started), and
+    the CallResult it returns is marked as cancelled rather than CancelledError being raised
+    """
+    if not funcy.is_list(cmd_args) and not funcy.is_tuple(cmd_args):
+        cmd_args = shlex.split(cmd_args)
+    logger.info('executing `{}`'.format(' '.join(cmd_args)))
+    pool = jobpool.get_pool()
+    waiter = await _admitted(pool, executor.command_name(cmd_args))
+    if waiter is None:
+        logger.info('`{}` was cancelled'.format(' '.join(cmd_args)))
+        return executor.CallResult(-signal.SIGTERM, '', '', cancelled=True)
+    try:
+        return await _run(cmd_args, suppress_output, cwd, env)
+    finally:
+        pool.release(waiter)
+
+
+async def _admitted(pool, job_name):
+    """ Wait (without blocking the loop) for job_name to be admitted through pool, returning
+    the handle to release it with, or None if the wait was cancelled
+    """
+    loop = asyncio.get_event_loop()
+    admission = loop.create_future()
+
+    def set_admitted():
+        if not admission.done():
+            admission.set_result(None)
+
+    start_time = time.time()
+    waiter = pool.enqueue(
+        jobpool.get_weight(job_name), lambda: loop.call_soon_threadsafe(set_admitted)
+    )
+    try:
+        await admission
+    except asyncio.CancelledError:
+        pool.cancel(waiter)
+        return None
+    jobpool.log_queue_wait(job_name, time.time() - start_time)
+    return waiter
+
+
+async def _run(cmd_args, suppress_output, cwd, env):
+    start_time = time.time()
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *cmd_args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, cwd=cwd,
+            env=env, start_new_session='posix' in sys.builtin_module_names
+        )
+    except asyncio.CancelledError:
+        # asyncio kills whatever was spawned itself
+        logger.info('`{}` was cancelled'.format(' '.join(cmd_args)))
+        return executor.CallResult(-signal.SIGTERM, '', '', cancelled=True)
+    stdout_tail, stderr_tail = executor.OutputTail(), executor.OutputTail()
+    cancelled = False
+    try:
+        await asyncio.gather(
+            _read_stream(process.stdout, 'stdout', suppress_output, stdout_tail),
+            _read_stream(process.stderr, 'stderr', suppress_output, stderr_tail),
+        )
+        await process.wait()
+    except asyncio.CancelledError:
+        cancelled = True
+        await _terminate(process, cmd_args)
+        await process.wait()
+    call_result = executor.CallResult(
+        process.returncode, stdout_tail.decode(), stderr_tail.decode(), cancelled
+    )
+    metrics.record(
+        metrics.COMMAND, executor.command_name(cmd_args), time.time() - start_time,
+        call_result.exitval
+    )
+    if call_result.cancelled:
+        logger.info('`{}` was cancelled'.format(' '.join(cmd_args)))
+    elif call_result.exitval:
+        logger.error('`{}` returned error code {}'.format(
+            ' '.join(cmd_args), call_result.exitval
+        ))
+    return call_result
+
+
+async def gather_calls(cmd_args_list, suppress_output=False, cwd=None, env=None, limit=None,
+                       fail_fast=False):
+    """ Run all of the commands in cmd_args_list concurrently (at most limit of them at a time,
+    if it is set) and return their CallResults, in the same order
+
+    With fail_fast, the first command to fail (or raise) cancels all of the others (commands
+    which never got to start are returned as cancelled, without having been run).  If any of
+    the commands raised, the first of their exceptions is raised once none are running.
+    """
+    semaphore = asyncio.Semaphore(limit) if limit else None
+
+    async def run(cmd_args):
+        if semaphore is None:
+            return await async_call(cmd_args, suppress_output, cwd, env)
+        try:
+            await semaphore.acquire()
+        except asyncio.CancelledError:
+            return executor.CallResult(-signal.SIGTERM, '', '', cancelled=True)
+        try:
+            return await async_call(cmd_args, suppress_output, cwd, env)
+        finally:
+            semaphore.release()
+
+    tasks = [asyncio.ensure_future(run(cmd_args)) for cmd_args in cmd_args_list]
+    pending = set(tasks)
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        if fail_fast and any(_failed(t) for t in done):
+            for task in pending:
+                task.cancel()
+    return [_task_result(task) for task in tasks]
+
+
+def _failed(task):
+    if task.cancelled():
+        return False
+    if task.exception() is not None:
+        return True
+    return task.result().exitval and not task.result().cancelled
+
+
+def _task_result(task):
+    if task.cancelled():
+        # cancelled before it got to start
+        return executor.CallResult(-signal.SIGTERM, '', '', cancelled=True)
+    return task.result()
+
+
+def call_all(cmd_args_list, **kwargs):
+    """ Run gather_calls() to completion from synchronous code, in a new event loop """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(gather_calls(cmd_args_list, **kwargs))
+    finally:
+        loop.close()
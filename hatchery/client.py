@@ -0,0 +1,68 @@
+""" Thin client for a running `hatchery daemon`
+
+This module is imported on every client invocation, so it must only depend on the standard
+library (importing the rest of hatchery is exactly the startup cost the daemon avoids).
+"""
+
+import os
+import sys
+import json
+import socket
+import hashlib
+
+SOCKET_DIR = '~/.hatchery/run'
+
+
+def socket_path(project_dir):
+    """ Get the path of the unix socket the daemon for project_dir listens on """
+    project_dir = os.path.abspath(project_dir)
+    digest = hashlib.sha1(project_dir.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(os.path.expanduser(SOCKET_DIR), digest + '.sock')
+
+
+def connect(project_dir):
+    """ Connect to the daemon for project_dir, return None if there isn't one running """
+    path = socket_path(project_dir)
+    if not os.path.exists(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        sock.close()
+        return None
+    return sock
+
+
+def run(argv, project_dir=None):
+    """ Have the daemon run hatchery with argv, streaming its output to stdout and stderr
+
+    Returns the exitval, or None if no daemon is running for project_dir
+    """
+    project_dir = os.path.abspath(project_dir or os.getcwd())
+    sock = connect(project_dir)
+    if sock is None:
+        return None
+    try:
+        request = json.dumps({'argv': list(argv), 'cwd': project_dir}) + '\n'
+        sock.sendall(request.encode('utf-8'))
+        for line in sock.makefile('rb'):
+            message = json.loads(line.decode('utf-8'))
+            if 'exitval' in message:
+                return message['exitval']
+            stream = getattr(sys, message['stream'])
+            stream.write(message['data'])
+            stream.flush()
+    finally:
+        sock.close()
+    sys.stderr.write('lost connection to hatchery daemon' + os.linesep)
+    return 1
+
+
+def main():
+    """ Entry point for hatchery-client, which falls back to running in-process """
+    exitval = run(sys.argv[1:])
+    if exitval is None:
+        from .main import hatchery
+        return hatchery(sys.argv[1:])
+    return exitval
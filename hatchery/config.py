@@ -1,9 +1,14 @@
 import os
+import json
+import hashlib
+import logging
 import microcache
 import tempfile
-import ruamel.yaml as yaml
+from . import helpers
 from . import snippets
 
+logger = logging.getLogger(__name__)
+
 try:
     import ConfigParser as configparser
 except ImportError:
@@ -19,24 +24,129 @@ CONFIG_LOCATIONS = [
 ]
 
 
+COMPILED_CONFIG_CACHE_DIR = 'config'
+# compiled configs (one per project directory) kept in the cache, the least recently written
+# ones are removed first
+COMPILED_CONFIG_CACHE_SIZE = 64
+
+
+def import_yaml():
+    """ Import ruamel.yaml, which is slow to import and only needed when the compiled config
+    cache can't be used
+    """
+    import ruamel.yaml
+    return ruamel.yaml
+
+
+def _load_yaml(yaml_str, round_trip=False):
+    """ Parse yaml_str, keeping comments and ordering if round_trip is set (for writing it back
+    out) or as fast as possible otherwise
+    """
+    yaml = import_yaml()
+    if round_trip:
+        loader = yaml.RoundTripLoader
+    else:
+        loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    return yaml.load(yaml_str, Loader=loader)
+
+
 @microcache.this
-def from_yaml():
-    """ Load configuration from yaml source(s), cached to only run once """
+def _load_config_file(config_path, round_trip=False):
+    """ Parse a single config file, cached by its absolute path """
+    with open(config_path) as config_file:
+        return _load_yaml(config_file.read(), round_trip)
+
+
+def _config_paths():
+    return [os.path.abspath(os.path.expanduser(p)) for p in CONFIG_LOCATIONS]
+
+
+def _config_files_key(config_paths):
+    """ Identify the current content of the default config and config_paths by their mtimes
+    and sizes (None for files which don't exist)
+    """
+    ret = []
+    for config_path in [snippets.get_snippet_path('hatchery.yml')] + config_paths:
+        try:
+            stat = os.stat(config_path)
+        except OSError:
+            ret.append([config_path, None])
+            continue
+        ret.append([config_path, getattr(stat, 'st_mtime_ns', stat.st_mtime), stat.st_size])
+    return ret
+
+
+def _compiled_config_path(config_paths):
+    digest = hashlib.sha1(json.dumps(config_paths).encode('utf-8')).hexdigest()[:16]
+    return helpers.cache_file_path(COMPILED_CONFIG_CACHE_DIR, digest + '.json')
+
+
+def _prune_compiled_configs(cache_dir):
+    """ Remove the least recently written compiled configs beyond COMPILED_CONFIG_CACHE_SIZE """
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith('.json'):
+            continue
+        try:
+            entries.append((os.path.getmtime(os.path.join(cache_dir, name)), name))
+        except OSError:
+            # removed by somebody else meanwhile
+            pass
+    for _, name in sorted(entries, reverse=True)[COMPILED_CONFIG_CACHE_SIZE:]:
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except OSError:
+            pass
+
+
+def _merge_config(config_paths, round_trip=False):
+    """ Load the default config and override it with config_paths, in order """
     default_yaml_str = snippets.get_snippet_content('hatchery.yml')
-    ret = yaml.load(default_yaml_str, Loader=yaml.RoundTripLoader)
-    for config_path in CONFIG_LOCATIONS:
-        config_path = os.path.expanduser(config_path)
+    ret = _load_yaml(default_yaml_str, round_trip)
+    for config_path in config_paths:
         if os.path.isfile(config_path):
-            with open(config_path) as config_file:
-                config_dict = yaml.load(config_file, Loader=yaml.RoundTripLoader)
-                if config_dict is None:
-                    continue
-                for k, v in config_dict.items():
-                    if k not in ret.keys():
-                        raise ConfigError(
-                            'found garbage key "{}" in {}'.format(k, config_path)
-                        )
-                    ret[k] = v
+            config_dict = _load_config_file(config_path, round_trip)
+            if config_dict is None:
+                continue
+            for k, v in config_dict.items():
+                if k not in ret.keys():
+                    raise ConfigError(
+                        'found garbage key "{}" in {}'.format(k, config_path)
+                    )
+                ret[k] = v
+    return ret
+
+
+@microcache.this
+def from_yaml(round_trip=False):
+    """ Load configuration from yaml source(s), cached to only run once
+
+    The merged config is also kept in the hatchery cache (as json) until any of the files it
+    came from changes, so that parsing yaml is only needed after they do.  With round_trip,
+    the files are always parsed, keeping their comments and ordering (for writing them back
+    out)
+    """
+    config_paths = _config_paths()
+    if round_trip:
+        return _merge_config(config_paths, round_trip=True)
+    files_key = _config_files_key(config_paths)
+    compiled_path = _compiled_config_path(config_paths)
+    try:
+        with open(compiled_path) as compiled_file:
+            compiled = json.load(compiled_file)
+        if compiled['files'] == files_key:
+            return compiled['config']
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+    ret = _merge_config(config_paths)
+    try:
+        helpers.atomic_write(compiled_path, json.dumps({'files': files_key, 'config': ret}))
+        _prune_compiled_configs(os.path.dirname(compiled_path))
+    except (TypeError, ValueError):
+        # something yaml can express but json can't (like a date), parse it every time
+        pass
+    except (IOError, OSError) as e:
+        logger.debug('could not write compiled config: ' + str(e))
     return ret
 
 
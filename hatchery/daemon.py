@@ -0,0 +1,179 @@
+import os
+import sys
+import json
+import socket
+import signal
+import logging
+import traceback
+import contextlib
+from . import client
+from . import config
+from . import helpers
+from . import watcher
+
+logger = logging.getLogger(__name__)
+
+# cached results which stay valid when project files change
+PERSISTENT_CACHES = ['from_pypirc', 'pypirc_temp']
+# cached results which are looked up again for every request, since the index can change
+# (an upload from CI or another machine) without any project file changing
+PER_REQUEST_CACHES = ['_get_uploaded_versions']
+
+
+class DaemonError(RuntimeError):
+    pass
+
+
+class _SocketStream(object):
+    """ File-like object which forwards writes to a client as framed json messages """
+
+    def __init__(self, conn, stream_name):
+        self.conn = conn
+        self.stream_name = stream_name
+
+    def write(self, data):
+        if not data:
+            return
+        if isinstance(data, bytes):
+            data = data.decode('utf-8', 'replace')
+        message = json.dumps({'stream': self.stream_name, 'data': data}) + '\n'
+        try:
+            self.conn.sendall(message.encode('utf-8'))
+        except socket.error:
+            # the client went away, let the request finish regardless
+            pass
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+@contextlib.contextmanager
+def _redirected_output(conn):
+    """ Send stdout, stderr and all logging to the client on the other end of conn """
+    stdout, stderr = _SocketStream(conn, 'stdout'), _SocketStream(conn, 'stderr')
+    root_logger = logging.getLogger()
+    original_handlers = root_logger.handlers[:]
+    handler = logging.StreamHandler(stderr)
+    if original_handlers and original_handlers[0].formatter:
+        handler.setFormatter(original_handlers[0].formatter)
+    root_logger.handlers = [handler]
+    original_stdout, original_stderr = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = stdout, stderr
+    try:
+        yield
+    finally:
+        sys.stdout, sys.stderr = original_stdout, original_stderr
+        root_logger.handlers = original_handlers
+
+
+def _raise_keyboard_interrupt(signum, frame):
+    raise KeyboardInterrupt()
+
+
+class Daemon(object):
+    """ Serve hatchery runs for one project over a unix socket, keeping caches warm
+
+    run_argv is called with each request's argv, and should return an exitval
+    """
+
+    def __init__(self, run_argv, project_dir='.'):
+        self.run_argv = run_argv
+        self.project_dir = os.path.abspath(project_dir)
+        self.socket_path = client.socket_path(self.project_dir)
+        self.sock = None
+        self.watcher = None
+
+    def start(self):
+        if client.connect(self.project_dir) is not None:
+            raise DaemonError('a daemon is already running for ' + self.project_dir)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        socket_dir = os.path.dirname(self.socket_path)
+        if not os.path.isdir(socket_dir):
+            os.makedirs(socket_dir)
+        os.chdir(self.project_dir)
+        self.watcher = watcher.get_watcher(self.project_dir, extra_paths=config.CONFIG_LOCATIONS)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        self.sock.listen(5)
+        logger.info('hatchery daemon for {} listening on {}'.format(
+            self.project_dir, self.socket_path
+        ))
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+        if self.watcher is not None:
+            self.watcher.close()
+            self.watcher = None
+
+    def _invalidate_caches(self):
+        changed_paths = self.watcher.poll()
+        if changed_paths:
+            logger.info('{} changed paths, invalidating project caches'.format(
+                len(changed_paths)
+            ))
+            helpers.clear_cache_except(PERSISTENT_CACHES)
+        helpers.clear_cache_of(PER_REQUEST_CACHES)
+
+    def _run_request(self, request):
+        if os.path.abspath(request['cwd']) != self.project_dir:
+            logger.error('this daemon only serves ' + self.project_dir)
+            return 1
+        argv = request['argv']
+        if argv and argv[0] in ('daemon', 'batch'):
+            logger.error('cannot run "{}" through the daemon'.format(argv[0]))
+            return 1
+        if '--watch' in argv or '-w' in argv:
+            logger.error('cannot watch for changes through the daemon')
+            return 1
+        try:
+            exitval = self.run_argv(argv)
+        except SystemExit as e:
+            if e.code is not None and not isinstance(e.code, int):
+                sys.stderr.write(str(e.code) + os.linesep)
+                exitval = 1
+            else:
+                exitval = e.code or 0
+        except Exception:
+            sys.stderr.write(traceback.format_exc())
+            exitval = 1
+        finally:
+            os.chdir(self.project_dir)
+        return exitval
+
+    def handle_one(self):
+        """ Accept a single connection and run the request it sends """
+        conn, _ = self.sock.accept()
+        try:
+            request_line = conn.makefile('rb').readline()
+            if not request_line:
+                return
+            request = json.loads(request_line.decode('utf-8'))
+            self._invalidate_caches()
+            with _redirected_output(conn):
+                exitval = self._run_request(request)
+            response = json.dumps({'exitval': exitval}) + '\n'
+            conn.sendall(response.encode('utf-8'))
+        except (socket.error, ValueError) as e:
+            logger.error('failed to handle request: ' + str(e))
+        finally:
+            conn.close()
+
+    def serve_forever(self):
+        self.start()
+        signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+        try:
+            while True:
+                self.handle_one()
+        except KeyboardInterrupt:
+            logger.info('hatchery daemon shutting down')
+        finally:
+            self.close()
@@ -0,0 +1,220 @@
+""" Import dependency graph of a project's python modules, for working out which tests a
+change can affect
+
+The imports found in each file are cached on disk (keyed by the file's size and mtime), so
+only files which changed since the last time have to be parsed again.
+"""
+
+import os
+import ast
+import json
+import fnmatch
+import hashlib
+import logging
+from . import helpers
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+DEPGRAPH_CACHE_DIR = 'depgraph'
+TEST_FILE_PATTERNS = ['test_*.py', '*_test.py']
+# changes to these never affect the outcome of the tests
+DOCUMENTATION_PATTERNS = ['*.md', '*.rst', 'docs/*', 'LICENSE*', '.gitignore']
+# changes to these can affect any test, so they call for running all of them
+FULL_RUN_FILE_NAMES = ['setup.py', 'conftest.py', '__main__.py']
+
+
+def _module_name(rel_path):
+    """ Get the dotted module name for a .py file path relative to the directory it is
+    imported from
+
+    >>> _module_name('package/sub/__init__.py')
+    'package.sub'
+    >>> _module_name('tests/test_thing.py')
+    'tests.test_thing'
+    """
+    parts = rel_path[:-len('.py')].split('/')
+    if parts[-1] == '__init__':
+        parts = parts[:-1]
+    return '.'.join(parts)
+
+
+def _package_dirs(root):
+    """ Get the (package name prefix, directory) pairs a literal package_dir in root's setup.py
+    maps, e.g. [('', 'src')] for package_dir={'': 'src'}
+    """
+    setup_py_path = os.path.join(root, 'setup.py')
+    if not os.path.isfile(setup_py_path):
+        return []
+    with open(setup_py_path) as setup_py:
+        try:
+            package_dir = helpers.literal_argument_in_function(
+                'package_dir', 'setup', setup_py.read(), default={}
+            )
+        except (ValueError, SyntaxError):
+            return []
+    if not isinstance(package_dir, dict):
+        return []
+    return [(name, rel_dir.strip('/')) for name, rel_dir in package_dir.items() if rel_dir]
+
+
+def _module_names(rel_path, root, package_dirs):
+    """ Get the names rel_path can be imported by: relative to the directories package_dir
+    maps, relative to the first directory above it which isn't a package (which is how `src`
+    layouts are installed, and where pytest puts test files which aren't in packages on
+    sys.path), and relative to the project root
+
+    The first name is the one relative imports in the file are resolved against
+    """
+    parts = rel_path.split('/')
+    base = len(parts) - 1
+    while base > 0 and os.path.isfile(os.path.join(root, *(parts[:base] + ['__init__.py']))):
+        base -= 1
+    ret = []
+    for name, rel_dir in package_dirs:
+        if rel_path.startswith(rel_dir + '/'):
+            module_name = _module_name(rel_path[len(rel_dir) + 1:])
+            ret.append('.'.join(n for n in (name, module_name) if n))
+    ret += [_module_name('/'.join(parts[base:])), _module_name(rel_path)]
+    return [n for i, n in enumerate(ret) if n and n not in ret[:i]]
+
+
+def _find_python_files(root):
+    """ Get the paths (relative to root, / separated) of all of the python files in a project,
+    skipping the directories package discovery skips
+    """
+    patterns = helpers.gitignore_patterns(root)
+    ret = []
+    for dir_path, dir_names, file_names in os.walk(root):
+        rel_dir = os.path.relpath(dir_path, root).replace(os.sep, '/')
+        rel_dir = '' if rel_dir == os.curdir else rel_dir + '/'
+        dir_names[:] = [
+            d for d in dir_names
+            if not helpers.pruned_from_package_discovery(d, rel_dir + d, patterns)
+        ]
+        ret += [rel_dir + f for f in file_names if f.endswith('.py')]
+    return sorted(ret)
+
+
+def _parse_imports(file_path, module_name, is_package):
+    """ Get the absolute names of everything file_path imports (for `from a import b`, both a
+    and a.b, since b may be a module or just a name in a)
+    """
+    with open(file_path, 'rb') as fh:
+        try:
+            tree = ast.parse(fh.read(), filename=file_path)
+        except (SyntaxError, ValueError) as e:
+            logger.debug('could not parse {}: {}'.format(file_path, e))
+            return []
+    package_parts = module_name.split('.') if is_package else module_name.split('.')[:-1]
+    ret = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            ret.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            if node.level:
+                base_parts = package_parts[:len(package_parts) - node.level + 1]
+                base = '.'.join(base_parts + ([node.module] if node.module else []))
+            else:
+                base = node.module
+            if not base:
+                continue
+            ret.add(base)
+            ret.update(base + '.' + alias.name for alias in node.names if alias.name != '*')
+    return sorted(ret)
+
+
+def _cache_path(root):
+    digest = hashlib.sha1(os.path.abspath(root).encode('utf-8')).hexdigest()[:16]
+    return helpers.cache_file_path(DEPGRAPH_CACHE_DIR, digest + '.json')
+
+
+def build(root='.'):
+    """ Get a dict mapping each python file in the project to the set of project files it
+    imports (directly)
+    """
+    cache_path = _cache_path(root)
+    try:
+        with open(cache_path) as cache_file:
+            cache = json.load(cache_file)
+    except (IOError, OSError, ValueError):
+        cache = {}
+    rel_paths = _find_python_files(root)
+    package_dirs = _package_dirs(root)
+    module_names = dict(
+        (rel_path, _module_names(rel_path, root, package_dirs)) for rel_path in rel_paths
+    )
+    new_cache = {}
+    for rel_path in rel_paths:
+        stat = os.stat(os.path.join(root, rel_path))
+        stat_key = [getattr(stat, 'st_mtime_ns', stat.st_mtime), stat.st_size]
+        # relative imports are resolved against the module name, which changes when an
+        # __init__.py is added or removed above the file
+        module_name = module_names[rel_path][0]
+        hit = rel_path in cache and cache[rel_path]['stat'] == stat_key and \
+            cache[rel_path].get('module') == module_name
+        metrics.cache_lookup('depgraph', hit)
+        if hit:
+            new_cache[rel_path] = cache[rel_path]
+            continue
+        imports = _parse_imports(
+            os.path.join(root, rel_path), module_name, rel_path.endswith('/__init__.py')
+        )
+        new_cache[rel_path] = {'stat': stat_key, 'module': module_name, 'imports': imports}
+    if new_cache != cache:
+        helpers.atomic_write(cache_path, json.dumps(new_cache))
+    module_paths = {}
+    for rel_path in rel_paths:
+        for module_name in module_names[rel_path]:
+            module_paths.setdefault(module_name, rel_path)
+    ret = {}
+    for rel_path in rel_paths:
+        dependencies = set()
+        for imported_name in new_cache[rel_path]['imports']:
+            # importing a.b.c runs a/__init__.py and a/b/__init__.py too
+            parts = imported_name.split('.')
+            for i in range(1, len(parts) + 1):
+                dependency = module_paths.get('.'.join(parts[:i]))
+                if dependency and dependency != rel_path:
+                    dependencies.add(dependency)
+        ret[rel_path] = dependencies
+    return ret
+
+
+def is_test_file(rel_path):
+    return any(fnmatch.fnmatch(os.path.basename(rel_path), p) for p in TEST_FILE_PATTERNS)
+
+
+def affected_tests(changed_paths, root='.'):
+    """ Get the test files which import (directly or indirectly) any of changed_paths, or None
+    if a change could affect any test (such as a change to setup.py, a deleted module, a
+    non-python file or a module nothing is found to import) and the whole suite should be run
+    """
+    graph = build(root)
+    dependents = {}
+    for rel_path, dependencies in graph.items():
+        for dependency in dependencies:
+            dependents.setdefault(dependency, set()).add(rel_path)
+    affected = set()
+    pending = []
+    for changed_path in changed_paths:
+        if any(fnmatch.fnmatch(changed_path, p) for p in DOCUMENTATION_PATTERNS):
+            continue
+        if changed_path not in graph or os.path.basename(changed_path) in FULL_RUN_FILE_NAMES:
+            logger.info('{} changed, all tests are affected'.format(changed_path))
+            return None
+        if not is_test_file(changed_path) and not dependents.get(changed_path):
+            # imported some way the graph can't follow (or run directly), so rather than
+            # running none of the tests, run all of them
+            logger.info('nothing is found to import {}, all tests are affected'.format(
+                changed_path
+            ))
+            return None
+        pending.append(changed_path)
+    while pending:
+        rel_path = pending.pop()
+        if rel_path in affected:
+            continue
+        affected.add(rel_path)
+        pending.extend(dependents.get(rel_path, ()))
+    return sorted(p for p in affected if is_test_file(p))
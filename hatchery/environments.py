@@ -0,0 +1,224 @@
+""" Virtualenvs for running tests in, cached by a fingerprint of the project's dependencies """
+
+import os
+import re
+import sys
+import glob
+import json
+import shutil
+import hashlib
+import logging
+import subprocess
+import contextlib
+import microcache
+from . import executor
+from . import helpers
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+ENVIRONMENT_CACHE_DIR = 'environments'
+# written once an environment is completely set up, its mtime records when it was last used
+COMPLETE_MARKER = '.hatchery-environment.json'
+REQUIREMENTS_FILE_PATTERN = 'requirements*.txt'
+
+
+class TestEnvironmentError(RuntimeError):
+    pass
+
+
+def get_install_requires(setup_py_path):
+    """ Get install_requires out of a setup.py without running it, it has to be a literal (or
+    a variable which is set to one at the top of the file)
+    """
+    with open(setup_py_path) as setup_py:
+        try:
+            return list(helpers.literal_argument_in_function(
+                'install_requires', 'setup', setup_py.read(), default=[]
+            ))
+        except ValueError:
+            raise TestEnvironmentError(
+                'install_requires in {} is not a literal list, move the requirements to '
+                'a requirements.txt file to use cached test environments'.format(setup_py_path)
+            )
+
+
+@microcache.this
+def describe_interpreter(interpreter):
+    """ Get the absolute path and full version string of a python interpreter """
+    try:
+        output = subprocess.check_output([
+            interpreter, '-c', 'import sys; print(sys.executable); print(sys.version)'
+        ])
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise TestEnvironmentError('could not run interpreter {}: {}'.format(interpreter, e))
+    executable, version = output.decode('utf-8').strip().split('\n', 1)
+    return {'executable': executable, 'version': version}
+
+
+def is_relative_path_requirement(line):
+    """ See if a requirement (a line of a requirements file) installs something from a path
+    relative to the directory pip runs in
+
+    >>> is_relative_path_requirement('-e .')
+    True
+    >>> is_relative_path_requirement('../libs/common  # shared code')
+    True
+    >>> is_relative_path_requirement('requests>=2; python_version < "3"')
+    False
+    >>> is_relative_path_requirement('-e git+https://github.com/a/b.git#egg=b')
+    False
+    """
+    line = re.split(r'(?:^|\s)#', line, 1)[0].strip()
+    line = re.sub(r'^(-e|--editable)[\s=]*', '', line)
+    if not line or line.startswith('-') or '://' in line or os.path.isabs(line):
+        return False
+    return line.startswith('.') or '/' in line or os.sep in line
+
+
+def _has_relative_path_requirements(requirement_files, install_requires):
+    requirements = list(install_requires)
+    for requirement_file in requirement_files:
+        with open(requirement_file) as fh:
+            requirements += fh.readlines()
+    return any(is_relative_path_requirement(r) for r in requirements)
+
+
+def fingerprint(interpreter, requirement_files, install_requires, project_dir=None):
+    """ Hash everything that goes into an environment, including project_dir if it is set (for
+    requirements which are installed from paths relative to it)
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps(describe_interpreter(interpreter), sort_keys=True).encode('utf-8'))
+    digest.update(json.dumps(install_requires).encode('utf-8'))
+    if project_dir is not None:
+        digest.update(os.path.realpath(project_dir).encode('utf-8'))
+    for requirement_file in requirement_files:
+        digest.update(os.path.basename(requirement_file).encode('utf-8'))
+        with open(requirement_file, 'rb') as fh:
+            digest.update(fh.read())
+    return digest.hexdigest()[:32]
+
+
+def _bin_dir(env_path):
+    return os.path.join(env_path, 'Scripts' if os.name == 'nt' else 'bin')
+
+
+def _call_or_die(cmd_args, error_msg, cwd=None):
+    result = executor.call(cmd_args, suppress_output=True, cwd=cwd)
+    if result.exitval:
+        raise TestEnvironmentError(error_msg + ':' + os.linesep + result.format_error_msg())
+
+
+def _create(env_path, interpreter, requirement_files, install_requires, project_dir):
+    logger.info('creating test environment in ' + env_path)
+    result = executor.call([interpreter, '-m', 'venv', env_path], suppress_output=True)
+    if result.exitval:
+        # interpreters without venv (python 2)
+        shutil.rmtree(env_path, ignore_errors=True)
+        _call_or_die(
+            ['virtualenv', '--python', interpreter, env_path],
+            'could not create a virtualenv for ' + interpreter
+        )
+    pip_install = [
+        os.path.join(_bin_dir(env_path), 'python'), '-m', 'pip', 'install',
+        '--disable-pip-version-check'
+    ]
+    # run in the project, so that requirements like `-e .` install the project and not
+    # whatever hatchery's cwd happens to be
+    for requirement_file in requirement_files:
+        _call_or_die(
+            pip_install + ['-r', requirement_file],
+            'could not install requirements from ' + requirement_file, cwd=project_dir
+        )
+    if install_requires:
+        _call_or_die(
+            pip_install + install_requires, 'could not install install_requires', cwd=project_dir
+        )
+
+
+def _evict(cache_size, keep):
+    """ Remove the least recently used environments beyond cache_size, skipping any that are
+    in use (by other runs, which hold a shared lock on them)
+    """
+    cache_root = os.path.dirname(keep)
+    entries = []
+    for name in os.listdir(cache_root):
+        marker_path = os.path.join(cache_root, name, COMPLETE_MARKER)
+        if os.path.isfile(marker_path):
+            entries.append((os.path.getmtime(marker_path), os.path.join(cache_root, name)))
+    for _, env_path in sorted(entries, reverse=True)[cache_size:]:
+        if env_path == keep:
+            continue
+        try:
+            with helpers.file_lock(env_path + '.lock', blocking=False):
+                logger.info('evicting least recently used test environment ' + env_path)
+                os.remove(os.path.join(env_path, COMPLETE_MARKER))
+                shutil.rmtree(env_path)
+        except (IOError, OSError) as e:
+            logger.debug('could not evict {}: {}'.format(env_path, e))
+
+
+@contextlib.contextmanager
+def use(project_dir, interpreter=None, cache_size=5):
+    """ Yield the path to a virtualenv for interpreter (default: the one running hatchery) with
+    the project's requirements*.txt files and install_requires installed
+
+    Environments are created the first time they're needed, and then reused by every run with
+    the same fingerprint until they're evicted to keep the cache at cache_size environments.
+    Environments with requirements installed from relative paths (such as `-e .`) are only
+    reused for the same project_dir.
+    """
+    interpreter = interpreter or sys.executable
+    project_dir = os.path.abspath(project_dir)
+    requirement_files = sorted(glob.glob(os.path.join(project_dir, REQUIREMENTS_FILE_PATTERN)))
+    install_requires = []
+    setup_py_path = os.path.join(project_dir, 'setup.py')
+    if os.path.isfile(setup_py_path):
+        install_requires = get_install_requires(setup_py_path)
+    fingerprinted_dir = None
+    if _has_relative_path_requirements(requirement_files, install_requires):
+        fingerprinted_dir = project_dir
+    env_name = fingerprint(interpreter, requirement_files, install_requires, fingerprinted_dir)
+    env_path = helpers.cache_file_path(ENVIRONMENT_CACHE_DIR, env_name)
+    marker_path = os.path.join(env_path, COMPLETE_MARKER)
+    while True:
+        with helpers.file_lock(env_path + '.lock'):
+            hit = os.path.isfile(marker_path)
+            metrics.cache_lookup('test_environment', hit)
+            if not hit:
+                # clear out anything left behind by an attempt that died part way through
+                shutil.rmtree(env_path, ignore_errors=True)
+                try:
+                    _create(
+                        env_path, interpreter, requirement_files, install_requires, project_dir
+                    )
+                except BaseException:
+                    shutil.rmtree(env_path, ignore_errors=True)
+                    raise
+                helpers.atomic_write(marker_path, json.dumps({
+                    'interpreter': describe_interpreter(interpreter),
+                    'requirement_files': [os.path.basename(f) for f in requirement_files],
+                    'install_requires': install_requires,
+                    'project_dir': fingerprinted_dir,
+                }, indent=4))
+            os.utime(marker_path, None)
+        with helpers.file_lock(env_path + '.lock', shared=True):
+            # it may have been evicted between the two locks
+            if not os.path.isfile(marker_path):
+                continue
+            logger.info('using test environment ' + env_path)
+            _evict(cache_size, keep=env_path)
+            yield env_path
+            return
+
+
+def activated_environ(env_path, environ=None):
+    """ Get a copy of environ (default: os.environ) with env_path activated, so that `python`,
+    `pip` and any scripts installed in the environment are found first
+    """
+    ret = dict(os.environ if environ is None else environ)
+    ret.pop('PYTHONHOME', None)
+    ret['VIRTUAL_ENV'] = env_path
+    ret['PATH'] = os.pathsep.join([_bin_dir(env_path), ret.get('PATH', '')])
+    return ret
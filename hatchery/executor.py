@@ -1,24 +1,46 @@
 import subprocess
 import sys
 import shlex
+import signal
 import logging
+import threading
+import time
 import funcy
 import os
+import re
 import six
+import select
+from . import jobpool
+from . import metrics
 
 logger = logging.getLogger(__name__)
+# subcommands (and script names) which name a command, unlike paths, options and values
+COMMAND_NAME_WORD_REGEX = re.compile(r'^[A-Za-z][\w.-]*$')
+# streamed output is copied this many bytes at a time, and only the last STREAM_TAIL_SIZE
+# bytes of each stream are kept for the CallResult
+STREAM_BUFFER_SIZE = 256 * 1024
+STREAM_TAIL_SIZE = 64 * 1024
+# how long commands get to exit after being sent SIGTERM (on timing out) before they are killed
+TERMINATE_GRACE_SECONDS = 10
 
 
 class CallResult(object):
     """ Basic representation of a command execution result """
 
-    def __init__(self, exitval, stdout, stderr):
+    def __init__(self, exitval, stdout, stderr, cancelled=False, timed_out=False, killed=False):
         self.exitval = exitval
         self.stdout = stdout
         self.stderr = stderr
+        self.cancelled = cancelled
+        self.timed_out = timed_out
+        self.killed = killed
 
     def format_error_msg(self):
         ret_lines = ['### exitval: {} ###'.format(self.exitval)]
+        if self.timed_out:
+            ret_lines.append('### timed out{} ###'.format(
+                ', killed after ignoring SIGTERM' if self.killed else ''
+            ))
         if self.stdout:
             ret_lines += ['### stdout ###', self.stdout, '### /stdout ###']
         if self.stderr:
@@ -26,15 +48,55 @@ class CallResult(object):
         return os.linesep.join(ret_lines)
 
 
+class Canceller(object):
+    """ Handle for cancelling calls made with it from another thread
+
+    Calls which are running when cancel() is called are terminated (along with anything they
+    started), and calls made afterwards return immediately without running anything
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self._requests = []
+        self._lock = threading.Lock()
+
+    def _register(self, call_request):
+        """ Track call_request, return False if it should not be started at all """
+        with self._lock:
+            if self.cancelled:
+                return False
+            self._requests.append(call_request)
+            return True
+
+    def _unregister(self, call_request):
+        with self._lock:
+            self._requests.remove(call_request)
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            call_requests = list(self._requests)
+        for call_request in call_requests:
+            call_request.terminate()
+
+
 class CallRequest(object):
     """ Class to wrap up command execution and non-blocking output capture """
 
-    def __init__(self, cmd_args, suppress_output=False):
+    def __init__(self, cmd_args, suppress_output=False, cwd=None, canceller=None, env=None,
+                 timeout=None):
         self.cmd_args = cmd_args
         self.suppress_output = suppress_output
+        self.cwd = cwd
+        self.env = env
+        self.canceller = canceller
+        self.timeout = timeout
+        self.timed_out = False
+        self.killed = False
         self.stdout_str = ''
         self.stderr_str = ''
         self.process = None
+        self._started = threading.Event()
 
     def _set_stream_process(self, stream_name):
         # this is magic...the behavior suggests that the code inside this with block
@@ -48,25 +110,213 @@ class CallRequest(object):
                     getattr(sys, stream_name).flush()
                 setattr(self, stream_name + '_str', getattr(self, stream_name + '_str') + line)
 
-    def run(self):
-        self.process = subprocess.Popen(
+    def _pass_through(self):
+        """ Copy the command's output to our own stdout and stderr as it comes, as raw bytes
+        (nothing is decoded, split into lines or accumulated but the tail of each stream)
+        """
+        for stream_name in ('stdout', 'stderr'):
+            getattr(sys, stream_name).flush()
+        streams = {}
+        poller = select.poll()
+        for stream_name in ('stdout', 'stderr'):
+            fd = getattr(self.process, stream_name).fileno()
+            streams[fd] = {
+                'name': stream_name,
+                'target_fd': getattr(sys, stream_name).fileno(),
+                'tail': OutputTail(),
+            }
+            poller.register(fd, select.POLLIN | select.POLLHUP)
+        pending_fds = set(streams)
+        while pending_fds:
+            for fd, _ in poller.poll():
+                stream = streams[fd]
+                data = os.read(fd, STREAM_BUFFER_SIZE)
+                if not data:
+                    poller.unregister(fd)
+                    pending_fds.remove(fd)
+                    continue
+                _write_all(stream['target_fd'], data)
+                stream['tail'].add(data)
+        for stream in streams.values():
+            getattr(self.process, stream['name']).close()
+            output = stream['tail'].decode()
+            setattr(self, stream['name'] + '_str', output)
+
+    def _can_pass_through(self):
+        if self.suppress_output or not hasattr(select, 'poll'):
+            return False
+        try:
+            sys.stdout.fileno()
+            sys.stderr.fileno()
+        except (AttributeError, ValueError, IOError, OSError):
+            # replaced by something which isn't backed by a file
+            return False
+        return True
+
+    def _signal(self, signum):
+        """ Send signum to the command's process group (just the command, where there are no
+        process groups), return False if there was nothing left to send it to
+        """
+        try:
+            if 'posix' in sys.builtin_module_names:
+                os.killpg(self.process.pid, signum)
+            elif signum == signal.SIGTERM:
+                self.process.terminate()
+            else:
+                self.process.kill()
+        except OSError:
+            # exited in the meantime
+            return False
+        return True
+
+    def terminate(self):
+        """ Terminate the running command, and with it anything it started """
+        self._started.wait()
+        if self.process is None or self.process.poll() is not None:
+            return
+        self._signal(signal.SIGTERM)
+
+    def _expire(self):
+        """ Terminate the command (and anything it started) for taking longer than its
+        timeout, killing whatever is still running TERMINATE_GRACE_SECONDS later
+        """
+        self.timed_out = True
+        logger.warning('`{}` timed out after {}s, terminating it'.format(
+            ' '.join(self.cmd_args), self.timeout
+        ))
+        if not self._signal(signal.SIGTERM):
+            return
+        deadline = time.time() + TERMINATE_GRACE_SECONDS
+        while time.time() < deadline:
+            # reaps the command once it exits, so that only what it left behind is signalled
+            self.process.poll()
+            if not self._signal(0):
+                return
+            time.sleep(0.1)
+        self.killed = True
+        logger.warning('`{}` ignored SIGTERM, killing it'.format(' '.join(self.cmd_args)))
+        self._signal(signal.SIGKILL if hasattr(signal, 'SIGKILL') else signal.SIGTERM)
+
+    def _popen(self):
+        kwargs = {}
+        if 'posix' in sys.builtin_module_names:
+            # give the command its own process group so terminating it reaches grandchildren
+            # too (e.g. a test runner's workers, which would otherwise hold the pipes open)
+            if six.PY3:
+                kwargs['start_new_session'] = True
+            else:
+                # preexec_fn isn't safe with threads running, but python 2 has nothing else
+                kwargs['preexec_fn'] = os.setsid
+        return subprocess.Popen(
             self.cmd_args,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
+            cwd=self.cwd,
+            env=self.env,
             close_fds='posix' in sys.builtin_module_names,
-            bufsize=1
+            bufsize=1,
+            **kwargs
         )
-        self._set_stream_process('stdout')
-        self._set_stream_process('stderr')
-        self.process.wait()
 
-        return CallResult(self.process.returncode, self.stdout_str, self.stderr_str)
+    def run(self):
+        if self.canceller is not None and not self.canceller._register(self):
+            return CallResult(-signal.SIGTERM, '', '', cancelled=True)
+        timer = None
+        try:
+            try:
+                self.process = self._popen()
+            finally:
+                self._started.set()
+            if self.timeout:
+                timer = threading.Timer(self.timeout, self._expire)
+                timer.daemon = True
+                timer.start()
+            if self._can_pass_through():
+                self._pass_through()
+            else:
+                self._set_stream_process('stdout')
+                self._set_stream_process('stderr')
+            self.process.wait()
+        except BaseException:
+            # the command doesn't get the terminal's signals in its own process group, so it
+            # would outlive us (on a KeyboardInterrupt, for example) unless terminated here
+            if self.process is not None:
+                self.terminate()
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+                timer.join()
+            if self.canceller is not None:
+                self.canceller._unregister(self)
+        cancelled = self.canceller is not None and self.canceller.cancelled
+        return CallResult(
+            self.process.returncode, self.stdout_str, self.stderr_str, cancelled,
+            timed_out=self.timed_out, killed=self.killed
+        )
+
+
+def _write_all(fd, data):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+class OutputTail(object):
+    """ The last STREAM_TAIL_SIZE bytes of a stream's output, so that the output of a long
+    running command doesn't pile up in memory
+    """
+
+    def __init__(self):
+        self._tail = bytearray()
+        self._truncated = False
+
+    def add(self, data):
+        self._tail += data
+        # trimmed lazily, so that bytes aren't shifted around on every read
+        if len(self._tail) > STREAM_TAIL_SIZE * 2:
+            del self._tail[:-STREAM_TAIL_SIZE]
+            self._truncated = True
+
+    def decode(self):
+        """ Decode the tail, dropping the partial line at its start if it was cut """
+        tail = self._tail
+        if self._truncated or len(tail) > STREAM_TAIL_SIZE:
+            tail = tail[-STREAM_TAIL_SIZE:]
+            tail = tail[tail.find(b'\n') + 1:]
+        return bytes(tail).decode('utf-8', 'replace') if six.PY3 else str(tail)
+
+
+def command_name(cmd_args):
+    """ Name a command for its timings, leaving out paths, options and values (such as version
+    numbers) which would make runs of the same command look different
+
+    >>> command_name(['/usr/bin/python3', 'setup.py', 'sdist', '--formats=gztar'])
+    'python3 setup.py sdist'
+    >>> command_name(['git', 'tag', '1.2.3'])
+    'git tag'
+    >>> command_name(['python', '-c', 'import sys; print(sys.version)'])
+    'python'
+    """
+    words = [os.path.basename(cmd_args[0])]
+    for arg in cmd_args[1:]:
+        if len(words) == 3:
+            break
+        if COMMAND_NAME_WORD_REGEX.match(arg):
+            words.append(arg)
+    return ' '.join(words)
 
 
-def call(cmd_args, suppress_output=False):
+def call(cmd_args, suppress_output=False, cwd=None, canceller=None, env=None, timeout=None):
     """ Call an arbitary command and return the exit value, stdout, and stderr as a tuple
 
-    Command can be passed in as either a string or iterable
+    Command can be passed in as either a string or iterable, and will be run in cwd if it is
+    set (which, unlike os.chdir, is safe to do from multiple threads at once) with env as its
+    environment variables if that is set.  If a Canceller is passed in, the call can be
+    cancelled through it from another thread.  If timeout is set, the command (and anything
+    it started) is terminated after running for that many seconds, and killed if it is still
+    running TERMINATE_GRACE_SECONDS later.  The command waits to be admitted by the jobpool
+    before it starts.
 
     >>> result = call('hatchery', suppress_output=True)
     >>> result.exitval
@@ -78,14 +328,26 @@ def call(cmd_args, suppress_output=False):
     if not funcy.is_list(cmd_args) and not funcy.is_tuple(cmd_args):
         cmd_args = shlex.split(cmd_args)
     logger.info('executing `{}`'.format(' '.join(cmd_args)))
-    call_request = CallRequest(cmd_args, suppress_output=suppress_output)
-    call_result = call_request.run()
-    if call_result.exitval:
+    call_request = CallRequest(
+        cmd_args, suppress_output=suppress_output, cwd=cwd, canceller=canceller, env=env,
+        timeout=timeout
+    )
+    with jobpool.admitted(command_name(cmd_args)):
+        start_time = time.time()
+        call_result = call_request.run()
+    metrics.record(
+        metrics.COMMAND, command_name(cmd_args), time.time() - start_time, call_result.exitval
+    )
+    if call_result.cancelled:
+        logger.info('`{}` was cancelled'.format(' '.join(cmd_args)))
+    elif call_result.timed_out:
+        logger.error('`{}` timed out after {}s'.format(' '.join(cmd_args), timeout))
+    elif call_result.exitval:
         logger.error('`{}` returned error code {}'.format(' '.join(cmd_args), call_result.exitval))
     return call_result
 
 
-def setup(cmd_args, suppress_output=False):
+def setup(cmd_args, suppress_output=False, cwd=None, timeout=None):
     """ Call a setup.py command or list of commands
 
     >>> result = setup('--name', suppress_output=True)
@@ -98,4 +360,4 @@ def setup(cmd_args, suppress_output=False):
     if not funcy.is_list(cmd_args) and not funcy.is_tuple(cmd_args):
         cmd_args = shlex.split(cmd_args)
     cmd_args = [sys.executable, 'setup.py'] + [x for x in cmd_args]
-    return call(cmd_args, suppress_output=suppress_output)
+    return call(cmd_args, suppress_output=suppress_output, cwd=cwd, timeout=timeout)
@@ -0,0 +1,170 @@
+""" Content fingerprints of project trees, for telling quickly whether (and where) they changed
+
+Files are hashed by a pool of threads (hashing and reading both release the GIL), and digests
+are kept in a persistent cache keyed by each file's (inode, mtime, size), so files which
+haven't changed since the last fingerprint are never read again.  The digests are combined
+Merkle-style into a hash per directory and one for the whole tree.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+import multiprocessing
+import multiprocessing.pool
+from . import helpers
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+FINGERPRINT_CACHE_DIR = 'fingerprints'
+READ_BUFFER_SIZE = 1024 * 1024
+# files modified this close to when their digest was cached could have been modified again
+# within the same mtime tick, so their cached digests aren't trusted (like git's racy entries)
+RACY_SECONDS = 2
+
+
+# each thread reuses its own read buffer, rather than allocating one per file
+_thread_buffers = threading.local()
+
+
+def hash_file(file_path, buffer_size=READ_BUFFER_SIZE):
+    """ Get the sha256 hex digest of a file's content, read buffer_size bytes at a time """
+    digest = hashlib.sha256()
+    buf = getattr(_thread_buffers, 'buf', None)
+    if buf is None or len(buf) != buffer_size:
+        buf = _thread_buffers.buf = bytearray(buffer_size)
+    view = memoryview(buf)
+    with open(file_path, 'rb', buffering=0) as fh:
+        while True:
+            size = fh.readinto(buf)
+            if not size:
+                break
+            digest.update(view[:size])
+    return digest.hexdigest()
+
+
+def _stat_key(stat):
+    return [stat.st_ino, helpers.mtime_ns(stat), stat.st_size]
+
+
+class TreeFingerprint(object):
+    """ Digests of the files (by / separated path relative to the root) of a tree, and hashes
+    of its directories ('' being the root) which change whenever anything under them does
+    """
+
+    def __init__(self, file_digests):
+        self.file_digests = file_digests
+        self._children = _tree_children(file_digests)
+        self.dir_hashes = _merkle_hashes(self._children)
+        self.root_hash = self.dir_hashes['']
+
+    def changed_paths(self, previous):
+        """ Get the files which were added, removed or changed since previous (another
+        TreeFingerprint), only looking inside directories whose hashes differ
+        """
+        ret = []
+        pending = ['']
+        while pending:
+            rel_dir = pending.pop()
+            if self.dir_hashes.get(rel_dir) == previous.dir_hashes.get(rel_dir):
+                continue
+            children = self._children.get(rel_dir, {})
+            previous_children = previous._children.get(rel_dir, {})
+            for name in set(children) | set(previous_children):
+                entry, previous_entry = children.get(name), previous_children.get(name)
+                kinds = set(e[0] for e in (entry, previous_entry) if e)
+                child_path = rel_dir + '/' + name if rel_dir else name
+                if 'd' in kinds:
+                    pending.append(child_path)
+                if 'f' in kinds and entry != previous_entry:
+                    ret.append(child_path)
+        return sorted(ret)
+
+
+def _tree_children(file_digests):
+    """ Get a dict mapping each directory to its children: a dict of name -> ('f', digest) for
+    files and ('d', rel_dir) for directories
+    """
+    ret = {'': {}}
+    for rel_path, digest in file_digests.items():
+        parts = rel_path.split('/')
+        for i in range(1, len(parts)):
+            rel_dir = '/'.join(parts[:i])
+            ret.setdefault(rel_dir, {})
+            ret['/'.join(parts[:i - 1])][parts[i - 1]] = ('d', rel_dir)
+        ret['/'.join(parts[:-1])][parts[-1]] = ('f', digest)
+    return ret
+
+
+def _merkle_hashes(children):
+    """ Hash every directory from the (sorted) names and hashes of its files and directories """
+    ret = {}
+    # deepest directories first, so every child directory is hashed before its parent
+    for rel_dir in sorted(children, key=lambda d: d.count('/') + bool(d), reverse=True):
+        digest = hashlib.sha256()
+        for name, (kind, value) in sorted(children[rel_dir].items()):
+            child_hash = ret[value] if kind == 'd' else value
+            digest.update('{} {}\0{}\n'.format(kind, name, child_hash).encode('utf-8'))
+        ret[rel_dir] = digest.hexdigest()
+    return ret
+
+
+def _cache_path(root):
+    digest = hashlib.sha1(os.path.abspath(root).encode('utf-8')).hexdigest()[:16]
+    return helpers.cache_file_path(FINGERPRINT_CACHE_DIR, digest + '.json')
+
+
+def _load_cache(cache_path):
+    try:
+        with open(cache_path) as cache_file:
+            cache = json.load(cache_file)
+    except (IOError, OSError, ValueError):
+        return {}
+    racy_ns = (cache.get('written', 0) - RACY_SECONDS) * 1e9
+    return dict(
+        (rel_path, entry) for rel_path, entry in cache.get('files', {}).items()
+        if entry[0][1] < racy_ns
+    )
+
+
+def fingerprint(root, exclude_regexes=(), rel_paths=None, workers=None):
+    """ Fingerprint the files under root (or just rel_paths, if it is set) which don't match
+    exclude_regexes, hashing them with workers threads (default: 4 per cpu)
+
+    Returns a TreeFingerprint
+    """
+    if rel_paths is None:
+        rel_paths = [p for p, is_dir in helpers.walk_tree(root, exclude_regexes) if not is_dir]
+    cache_path = _cache_path(root)
+    cache = _load_cache(cache_path)
+
+    def digest_file(rel_path):
+        file_path = os.path.join(root, rel_path)
+        stat_key = _stat_key(os.stat(file_path))
+        cached = cache.get(rel_path)
+        if cached and cached[0] == stat_key:
+            return rel_path, stat_key, cached[1], True
+        return rel_path, stat_key, hash_file(file_path), False
+
+    pool = multiprocessing.pool.ThreadPool(workers or multiprocessing.cpu_count() * 4)
+    try:
+        results = pool.map(digest_file, rel_paths, chunksize=64)
+    finally:
+        pool.close()
+        pool.join()
+    new_cache = {}
+    hit_count = 0
+    for rel_path, stat_key, digest, hit in results:
+        new_cache[rel_path] = [stat_key, digest]
+        hit_count += hit
+    metrics.add('cache_hits.fingerprint', hit_count)
+    metrics.add('cache_misses.fingerprint', len(results) - hit_count)
+    logger.debug('hashed {} of {} files under {}'.format(
+        len(results) - hit_count, len(results), root
+    ))
+    if hit_count != len(results) or len(new_cache) != len(cache):
+        helpers.atomic_write(cache_path, json.dumps({'written': time.time(), 'files': new_cache}))
+    return TreeFingerprint(dict((p, entry[1]) for p, entry in new_cache.items()))
@@ -1,5 +1,9 @@
+import re
+import ast
+import fnmatch
 import tokenize
 import collections
+import contextlib
 import os
 import funcy
 import microcache
@@ -10,6 +14,16 @@ try:
 except ImportError:
     import urlparse
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+CACHE_ROOT = '~/.hatchery/cache'
+# top-level directories which are never searched for packages, regardless of their contents
+# (below the top level, only .gitignore decides, since e.g. mypkg/build can be a real package)
+PACKAGE_DISCOVERY_PRUNE = ['node_modules', 'build', 'dist', 'venv', '__pycache__', 'site-packages']
+
 SimplifiedToken = collections.namedtuple('SimplifiedToken', ('typenum', 'value'))
 
 
@@ -73,6 +87,56 @@ def value_of_named_argument_in_function(argument_name, function_name, search_str
     return None
 
 
+def _clear_cache_where(function_names, keep_named):
+    prefixes = tuple(name + '(' for name in function_names)
+    kept_items = [(k, v) for k, v in microcache.items() if k.startswith(prefixes) == keep_named]
+    microcache.clear()
+    for k, v in kept_items:
+        microcache.upsert(k, v)
+
+
+def clear_cache_except(function_names):
+    """ Clear the microcache, except for the results of the named functions (which must be
+    decorated with microcache.this, whose keys start with the function name)
+    """
+    _clear_cache_where(function_names, keep_named=True)
+
+
+def clear_cache_of(function_names):
+    """ Clear only the results of the named functions (decorated with microcache.this) from
+    the microcache
+    """
+    _clear_cache_where(function_names, keep_named=False)
+
+
+def literal_argument_in_function(argument_name, function_name, search_str, default=None):
+    """ Get the value of a named argument from a call to function_name in search_str (python
+    code, which is parsed but not run), which has to be a literal or a variable set to one at
+    the top level
+
+    Returns default if there is no such argument, raises ValueError if its value isn't literal
+    """
+    tree = ast.parse(search_str)
+    assignments = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and \
+                isinstance(node.targets[0], ast.Name):
+            assignments[node.targets[0].id] = node.value
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call):
+            continue
+        if getattr(node.func, 'id', getattr(node.func, 'attr', None)) != function_name:
+            continue
+        for keyword in node.keywords:
+            if keyword.arg != argument_name:
+                continue
+            value = keyword.value
+            if isinstance(value, ast.Name):
+                value = assignments.get(value.id, value)
+            return ast.literal_eval(value)
+    return default
+
+
 @microcache.this
 def get_file_content(file_path):
     """ Load the content of a text file into a string """
@@ -124,3 +188,108 @@ def string_is_url(test_str):
     """
     parsed = urlparse.urlparse(test_str)
     return parsed.scheme is not None and parsed.scheme != ''
+
+
+def gitignore_patterns(root):
+    """ Get simplified glob patterns for the entries in root's .gitignore """
+    gitignore_path = os.path.join(root, '.gitignore')
+    if not os.path.isfile(gitignore_path):
+        return []
+    ret = []
+    with open(gitignore_path) as gitignore:
+        for line in gitignore.readlines():
+            line = line.strip()
+            if not line or line.startswith('#') or line.startswith('!'):
+                continue
+            ret.append(line.strip('/'))
+    return ret
+
+
+def pruned_from_package_discovery(name, rel_path, patterns):
+    """ See if the directory name (at rel_path, / separated from the project root) can't
+    contain packages: dot-directories like the hatchery workdir, PACKAGE_DISCOVERY_PRUNE at
+    the top level, and anything matching patterns (as gitignore_patterns() gives them)
+
+    >>> pruned_from_package_discovery('build', 'build', [])
+    True
+    >>> pruned_from_package_discovery('build', 'mypackage/build', [])
+    False
+    """
+    if '.' in name:
+        return True
+    if name in PACKAGE_DISCOVERY_PRUNE and '/' not in rel_path:
+        return True
+    for pattern in patterns:
+        if fnmatch.fnmatch(rel_path, pattern):
+            return True
+        if '/' not in pattern and fnmatch.fnmatch(name, pattern):
+            return True
+    return False
+
+
+def walk_tree(root, exclude_regexes=()):
+    """ Yield (path, is_dir) for the directories and files under root which don't match any of
+    exclude_regexes, with paths relative to root and / separated
+    """
+    exclude_regexes = [re.compile(r) for r in exclude_regexes]
+
+    def is_excluded(rel_path):
+        return any(regex.match(rel_path) for regex in exclude_regexes)
+
+    for dir_path, dir_names, file_names in os.walk(root):
+        rel_dir = os.path.relpath(dir_path, root).replace(os.sep, '/')
+        rel_dir = '' if rel_dir == os.curdir else rel_dir + '/'
+        dir_names[:] = [d for d in dir_names if not is_excluded(rel_dir + d)]
+        for dir_name in dir_names:
+            yield rel_dir + dir_name, True
+        for file_name in file_names:
+            if not is_excluded(rel_dir + file_name):
+                yield rel_dir + file_name, False
+
+
+def mtime_ns(stat):
+    """ Get a stat result's mtime in (integer) nanoseconds, so that it compares exactly """
+    return getattr(stat, 'st_mtime_ns', int(stat.st_mtime * 1e9))
+
+
+def cache_file_path(*subpath_parts):
+    """ Get the path to a file in the persistent hatchery cache, creating its parent dirs """
+    ret = os.path.join(os.path.expanduser(CACHE_ROOT), *subpath_parts)
+    parent_dir = os.path.dirname(ret)
+    if not os.path.isdir(parent_dir):
+        try:
+            os.makedirs(parent_dir)
+        except OSError:
+            # somebody else got there first
+            if not os.path.isdir(parent_dir):
+                raise
+    return ret
+
+
+def atomic_write(file_path, content, mode='w'):
+    """ Write content to file_path such that readers never see a partially written file """
+    temp_path = '{}.{}.tmp'.format(file_path, os.getpid())
+    with open(temp_path, mode) as fh:
+        fh.write(content)
+    os.rename(temp_path, file_path)
+
+
+@contextlib.contextmanager
+def file_lock(lock_path, shared=False, blocking=True):
+    """ Hold an exclusive lock on lock_path (creating it if needed) for the duration, so that
+    hatchery processes sharing a cache take turns updating it (a no-op without fcntl)
+
+    A shared lock only excludes exclusive ones, and if blocking is False an IOError is raised
+    instead of waiting for the lock to be available
+    """
+    with open(lock_path, 'a') as lock_file:
+        if fcntl is not None:
+            operation = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+            if not blocking:
+                operation |= fcntl.LOCK_NB
+            fcntl.flock(lock_file.fileno(), operation)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
@@ -0,0 +1,215 @@
+""" Timings of past runs, kept in a sqlite database in the hatchery cache, for spotting which
+stages of a project's runs are slow or getting slower
+"""
+
+import os
+import math
+import time
+import sqlite3
+import logging
+import contextlib
+from . import helpers
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+HISTORY_FILE_NAME = 'history.sqlite3'
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY, project TEXT, tasks TEXT, '
+    'started REAL, seconds REAL, exitval INTEGER)',
+    'CREATE INDEX IF NOT EXISTS runs_by_project ON runs (project, id)',
+    'CREATE TABLE IF NOT EXISTS timings (run_id INTEGER, kind TEXT, name TEXT, seconds REAL, '
+    'exitval INTEGER)',
+    'CREATE INDEX IF NOT EXISTS timings_by_run ON timings (run_id)',
+    'CREATE TABLE IF NOT EXISTS counters (run_id INTEGER, name TEXT, value REAL)',
+    'CREATE INDEX IF NOT EXISTS counters_by_run ON counters (run_id)',
+]
+# a stage has regressed when the median of this many of the latest runs is slower than the
+# median of the runs before them
+RECENT_RUNS = 3
+# differences smaller than this are noise, however large they are relatively
+REGRESSION_MIN_SECONDS = 0.1
+
+
+class HistoryError(RuntimeError):
+    pass
+
+
+@contextlib.contextmanager
+def _connect():
+    try:
+        connection = sqlite3.connect(helpers.cache_file_path(HISTORY_FILE_NAME), timeout=30)
+    except (sqlite3.Error, OSError) as e:
+        raise HistoryError('could not open run history: ' + str(e))
+    try:
+        for statement in SCHEMA:
+            connection.execute(statement)
+        with connection:
+            yield connection
+    except sqlite3.Error as e:
+        raise HistoryError('could not use run history: ' + str(e))
+    finally:
+        connection.close()
+
+
+def save_run(project_dir, task_list, started, seconds, exitval):
+    """ Store everything metrics collected over a run of task_list in project_dir """
+    with _connect() as connection:
+        run_id = connection.execute(
+            'INSERT INTO runs (project, tasks, started, seconds, exitval) VALUES (?, ?, ?, ?, ?)',
+            (os.path.abspath(project_dir), ' '.join(task_list), started, seconds, exitval)
+        ).lastrowid
+        connection.executemany(
+            'INSERT INTO timings (run_id, kind, name, seconds, exitval) VALUES (?, ?, ?, ?, ?)',
+            [(run_id, t.kind, t.name, t.seconds, t.exitval) for t in metrics.get_timings()]
+        )
+        connection.executemany(
+            'INSERT INTO counters (run_id, name, value) VALUES (?, ?, ?)',
+            [(run_id, name, value) for name, value in sorted(metrics.get_counters().items())]
+        )
+    return run_id
+
+
+@contextlib.contextmanager
+def recording(project_dir, task_list):
+    """ Save the run made inside the block once it is over (the block can set the exitval to
+    save in the dict it is given), losing the history is never worth failing the run over
+    """
+    metrics.reset()
+    started = time.time()
+    run = {'exitval': 0}
+    try:
+        yield run
+    except SystemExit as e:
+        run['exitval'] = e.code if isinstance(e.code, int) else 1
+        raise
+    except BaseException:
+        run['exitval'] = 1
+        raise
+    finally:
+        try:
+            save_run(project_dir, task_list, started, time.time() - started, run['exitval'])
+        except HistoryError as e:
+            logger.warning(str(e))
+
+
+def get_latest_run(project_dir, since=0):
+    """ Get the latest run of project_dir which started at or after since (a timestamp) as a
+    dict, with the metrics.Timings and counters it recorded, or None if there isn't one
+    """
+    project_dir = os.path.abspath(project_dir)
+    with _connect() as connection:
+        row = connection.execute(
+            'SELECT id, tasks, started, seconds, exitval FROM runs '
+            'WHERE project = ? AND started >= ? ORDER BY id DESC LIMIT 1',
+            (project_dir, since)
+        ).fetchone()
+        if row is None:
+            return None
+        run_id, tasks, started, seconds, exitval = row
+        timings = [metrics.Timing(*timing_row) for timing_row in connection.execute(
+            'SELECT kind, name, seconds, exitval FROM timings WHERE run_id = ? ORDER BY rowid',
+            (run_id,)
+        )]
+        counters = dict(connection.execute(
+            'SELECT name, value FROM counters WHERE run_id = ?', (run_id,)
+        ).fetchall())
+    return {
+        'project': project_dir,
+        'tasks': tasks.split(),
+        'started': started,
+        'seconds': seconds,
+        'exitval': exitval,
+        'timings': timings,
+        'counters': counters,
+    }
+
+
+def get_recent_seconds(kind, name, limit=100):
+    """ Get the latest limit timings of the kind:name stage, across all projects """
+    with _connect() as connection:
+        rows = connection.execute(
+            'SELECT seconds FROM timings WHERE kind = ? AND name = ? ORDER BY rowid DESC LIMIT ?',
+            (kind, name, limit)
+        ).fetchall()
+    return [row[0] for row in reversed(rows)]
+
+
+def percentile(values, pct):
+    """ Nearest-rank percentile of values
+
+    >>> percentile([4, 1, 3, 2], 50)
+    2
+    >>> percentile(range(1, 101), 95)
+    95
+    """
+    ordered = sorted(values)
+    return ordered[max(int(math.ceil(pct / 100.0 * len(ordered))) - 1, 0)]
+
+
+class StageStats(object):
+    """ Timings of one stage over a project's latest runs (oldest first, one per run which
+    had the stage, adding up the timings of a stage which ran more than once in a run)
+    """
+
+    def __init__(self, kind, name, seconds):
+        self.kind = kind
+        self.name = name
+        self.seconds = seconds
+        self.p50 = percentile(seconds, 50)
+        self.p95 = percentile(seconds, 95)
+
+    @property
+    def stage(self):
+        return '{}:{}'.format(self.kind, self.name)
+
+    def regression(self, threshold_pct):
+        """ Get the (baseline, recent) medians if the stage's latest runs regressed by more
+        than threshold_pct, otherwise None
+        """
+        if len(self.seconds) < RECENT_RUNS * 2:
+            return None
+        baseline = percentile(self.seconds[:-RECENT_RUNS], 50)
+        recent = percentile(self.seconds[-RECENT_RUNS:], 50)
+        if recent - baseline > max(baseline * threshold_pct / 100.0, REGRESSION_MIN_SECONDS):
+            return baseline, recent
+        return None
+
+
+def _latest_run_ids(connection, project_dir, run_count):
+    rows = connection.execute(
+        'SELECT id FROM runs WHERE project = ? ORDER BY id DESC LIMIT ?',
+        (os.path.abspath(project_dir), run_count)
+    ).fetchall()
+    return sorted(row[0] for row in rows)
+
+
+def get_stage_stats(project_dir, run_count=20):
+    """ Get StageStats for every stage in the latest run_count runs of project_dir """
+    with _connect() as connection:
+        run_ids = _latest_run_ids(connection, project_dir, run_count)
+        if not run_ids:
+            return []
+        rows = connection.execute(
+            'SELECT kind, name, SUM(timings.seconds) FROM timings JOIN runs ON run_id = id '
+            'WHERE project = ? AND id >= ? GROUP BY run_id, kind, name ORDER BY run_id',
+            (os.path.abspath(project_dir), run_ids[0])
+        ).fetchall()
+    stages = {}
+    for kind, name, seconds in rows:
+        stages.setdefault((kind, name), []).append(seconds)
+    return [StageStats(kind, name, seconds) for (kind, name), seconds in sorted(stages.items())]
+
+
+def get_counter_totals(project_dir, run_count=20):
+    """ Add up each counter over the latest run_count runs of project_dir """
+    with _connect() as connection:
+        run_ids = _latest_run_ids(connection, project_dir, run_count)
+        if not run_ids:
+            return {}
+        rows = connection.execute(
+            'SELECT name, SUM(value) FROM counters JOIN runs ON run_id = id '
+            'WHERE project = ? AND id >= ? GROUP BY name',
+            (os.path.abspath(project_dir), run_ids[0])
+        ).fetchall()
+    return dict(rows)
@@ -0,0 +1,260 @@
+""" Admission control for the commands hatchery runs, so that running tasks, test matrices and
+projects at once doesn't oversubscribe the machine (or the container) it runs on
+
+Every command needs a number of cpu slots and an amount of memory (its weight, 1 cpu and no
+memory unless command_weights in .hatchery.yml says otherwise), and waits in line until they
+fit in the pool's budgets.  Budgets default to what the cgroup (quota and memory limit) and
+the cpu affinity of hatchery's process allow, rather than the size of the whole host.
+"""
+
+import os
+import math
+import time
+import logging
+import threading
+import contextlib
+import collections
+import multiprocessing
+
+logger = logging.getLogger(__name__)
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+# cgroup v1 reports "no memory limit" as a huge number rather than "max"
+CGROUP_V1_UNLIMITED_MEMORY = 2 ** 60
+# waits shorter than this are only logged at debug level
+QUEUE_WAIT_LOG_SECONDS = 0.1
+MEGABYTE = 1024 * 1024
+
+
+def _read_cgroup_file(*path_parts):
+    try:
+        with open(os.path.join(CGROUP_ROOT, *path_parts)) as cgroup_file:
+            return cgroup_file.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def _cgroup_cpu_quota():
+    """ Get the cpus the cgroup's quota allows (possibly fractional), or None if unlimited """
+    cpu_max = _read_cgroup_file('cpu.max')
+    if cpu_max is not None:
+        quota, period = (cpu_max.split() + ['100000'])[:2]
+        if quota == 'max':
+            return None
+        return int(quota) / float(period)
+    for cpu_dir in ('cpu', 'cpu,cpuacct'):
+        quota = _read_cgroup_file(cpu_dir, 'cpu.cfs_quota_us')
+        period = _read_cgroup_file(cpu_dir, 'cpu.cfs_period_us')
+        if quota is not None and period is not None:
+            if int(quota) <= 0:
+                return None
+            return int(quota) / float(period)
+    return None
+
+
+def available_cpus():
+    """ Get how many cpus hatchery can use: the cpus it may be scheduled on, capped by the
+    cgroup's cpu quota (rounded up), and at least 1
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = multiprocessing.cpu_count()
+    quota = _cgroup_cpu_quota()
+    if quota is not None:
+        cpus = min(cpus, int(math.ceil(quota)))
+    return max(cpus, 1)
+
+
+def available_memory():
+    """ Get how many bytes of memory hatchery can use (the cgroup's limit if there is one, or
+    the physical memory), or None if that can't be found out
+    """
+    memory_max = _read_cgroup_file('memory.max')
+    if memory_max is None:
+        memory_max = _read_cgroup_file('memory', 'memory.limit_in_bytes')
+    if memory_max is not None and memory_max != 'max' and \
+            int(memory_max) < CGROUP_V1_UNLIMITED_MEMORY:
+        return int(memory_max)
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+class Weight(object):
+    """ What a command needs to be admitted: cpu slots and bytes of memory """
+
+    def __init__(self, cpus=1, memory=0):
+        self.cpus = cpus
+        self.memory = memory
+
+    def __repr__(self):
+        return 'Weight(cpus={}, memory={})'.format(self.cpus, self.memory)
+
+
+class _Waiter(object):
+
+    def __init__(self, weight, wake):
+        self.weight = weight
+        self.wake = wake
+        self.admitted = False
+
+
+class JobPool(object):
+    """ Admits jobs first come, first served while their weights fit in cpu_slots and
+    memory_bytes (None meaning no memory budget) alongside the jobs already running
+
+    A job which is heavier than the whole budget is admitted once nothing else is running,
+    rather than never
+    """
+
+    def __init__(self, cpu_slots, memory_bytes=None):
+        self.cpu_slots = cpu_slots
+        self.memory_bytes = memory_bytes
+        self.running = 0
+        self.cpus_used = 0
+        self.memory_used = 0
+        self._queue = collections.deque()
+        self._lock = threading.Lock()
+
+    def _fits(self, weight):
+        if not self.running:
+            return True
+        if self.cpus_used + weight.cpus > self.cpu_slots:
+            return False
+        return self.memory_bytes is None or \
+            self.memory_used + weight.memory <= self.memory_bytes
+
+    def _admit_waiting(self):
+        """ Admit queued jobs, in order, for as long as the first one fits (lock held) """
+        while self._queue and self._fits(self._queue[0].weight):
+            waiter = self._queue.popleft()
+            waiter.admitted = True
+            self.running += 1
+            self.cpus_used += waiter.weight.cpus
+            self.memory_used += waiter.weight.memory
+            waiter.wake()
+
+    def enqueue(self, weight, wake):
+        """ Queue a job of weight, calling wake() (with the pool's lock held, so it must not
+        block) once it is admitted, which may be straight away
+
+        Returns a handle for release() (or cancel(), if the job is given up on while queued)
+        """
+        waiter = _Waiter(weight, wake)
+        with self._lock:
+            self._queue.append(waiter)
+            self._admit_waiting()
+        return waiter
+
+    def release(self, waiter):
+        """ Give back what an admitted job took and admit whoever fits now """
+        with self._lock:
+            self.running -= 1
+            self.cpus_used -= waiter.weight.cpus
+            self.memory_used -= waiter.weight.memory
+            self._admit_waiting()
+
+    def cancel(self, waiter):
+        """ Take a job out of the queue (or release it, if it was admitted in the meantime) """
+        with self._lock:
+            if not waiter.admitted:
+                self._queue.remove(waiter)
+                # the jobs behind it may fit now
+                self._admit_waiting()
+                return
+        self.release(waiter)
+
+    @contextlib.contextmanager
+    def admitted(self, weight, job_name):
+        """ Block until a job of weight is admitted, releasing it when the block is over """
+        event = threading.Event()
+        start_time = time.time()
+        waiter = self.enqueue(weight, event.set)
+        event.wait()
+        log_queue_wait(job_name, time.time() - start_time)
+        try:
+            yield
+        finally:
+            self.release(waiter)
+
+
+def log_queue_wait(job_name, seconds):
+    """ Log how long job_name waited to be admitted """
+    log = logger.info if seconds >= QUEUE_WAIT_LOG_SECONDS else logger.debug
+    log('`{}` waited {:.2f}s in the job queue'.format(job_name, seconds))
+
+
+_pool = None
+_weights = {}
+_pool_lock = threading.Lock()
+# how many processes (this one included) each admit commands through a pool of their own
+_workers = 1
+
+
+def share_among(workers):
+    """ Split the budgets of the pools configured from now on evenly among workers processes
+    (each of which calls this), so that together they stay within the machine's budgets
+
+    Every process keeps at least 1 cpu slot, however many workers there are
+    """
+    global _workers
+    _workers = max(workers, 1)
+
+
+def configure(cpu_slots=None, memory_mb=None, command_weights=None):
+    """ Replace the pool commands are admitted through (jobs admitted by the old one keep
+    what they took from it)
+
+    cpu_slots and memory_mb default to available_cpus() and available_memory(), and
+    command_weights maps command names (as executor.command_name() gives them, or their
+    first words) to dicts with the cpus and memory_mb the commands need.  Both budgets are
+    divided by the number of processes share_among() was given.
+    """
+    global _pool, _weights
+    if memory_mb is not None:
+        memory_bytes = int(memory_mb * MEGABYTE)
+    else:
+        memory_bytes = available_memory()
+    if memory_bytes is not None:
+        memory_bytes //= _workers
+    cpu_slots = max((cpu_slots or available_cpus()) // _workers, 1)
+    weights = {}
+    for name, weight in (command_weights or {}).items():
+        weights[name] = Weight(
+            cpus=weight.get('cpus', 1), memory=int(weight.get('memory_mb', 0) * MEGABYTE)
+        )
+    with _pool_lock:
+        _pool = JobPool(cpu_slots, memory_bytes)
+        _weights = weights
+    logger.debug('admitting commands within {} cpus and {} bytes of memory'.format(
+        _pool.cpu_slots, _pool.memory_bytes
+    ))
+
+
+def get_pool():
+    """ Get the pool commands are admitted through, creating the default one if need be """
+    with _pool_lock:
+        if _pool is not None:
+            return _pool
+    configure()
+    return _pool
+
+
+def get_weight(command_name):
+    """ Get the Weight configured for command_name, from the entry matching the most of its
+    leading words (commands without an entry weigh 1 cpu and no memory)
+    """
+    words = command_name.split()
+    for i in range(len(words), 0, -1):
+        weight = _weights.get(' '.join(words[:i]))
+        if weight is not None:
+            return weight
+    return Weight()
+
+
+def admitted(command_name):
+    """ Context manager blocking until command_name is admitted through the pool """
+    pool = get_pool()
+    return pool.admitted(get_weight(command_name), command_name)
@@ -0,0 +1,166 @@
+""" A directory of distributions (as pip reads with --find-links) used as the index to check
+versions against and upload to, when pypi_repository is a file:// url
+
+The project and version of every distribution in the directory are kept in an index in the
+hatchery cache, which is only brought up to date (parsing just the filenames it doesn't know
+yet) when the directory's mtime says files were added or removed.
+"""
+
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import logging
+from six.moves.urllib import parse as urlparse
+from six.moves.urllib import request as urlrequest
+from . import helpers
+
+logger = logging.getLogger(__name__)
+
+LOCAL_INDEX_CACHE_DIR = 'local_indexes'
+DIST_EXTENSIONS = ['.tar.gz', '.tar.bz2', '.tar.xz', '.tgz', '.zip', '.whl', '.egg']
+# files added this close to when the directory was scanned could have been added within the
+# same mtime tick, so the index of a directory modified this recently is never trusted
+RACY_SECONDS = 2
+
+
+class LocalIndexError(RuntimeError):
+    pass
+
+
+def is_local_index(index_url):
+    """ See if index_url points to a local directory
+
+    >>> is_local_index('file:///srv/dists')
+    True
+    >>> is_local_index('https://pypi.org/pypi')
+    False
+    """
+    return urlparse.urlparse(index_url).scheme == 'file'
+
+
+def index_dir(index_url):
+    """ Get the directory a file:// url points to
+
+    >>> index_dir('file:///srv/dists/')
+    '/srv/dists'
+    """
+    return urlrequest.url2pathname(urlparse.urlparse(index_url).path).rstrip(os.sep) or os.sep
+
+
+def normalize_name(project_name):
+    """ Normalize a project name as PEP 503 does
+
+    >>> normalize_name('My_Project.name')
+    'my-project-name'
+    """
+    return re.sub(r'[-_.]+', '-', project_name).lower()
+
+
+def parse_dist_filename(filename):
+    """ Get the (normalized) project name and version of a distribution from its filename, or
+    None if it isn't one
+
+    >>> parse_dist_filename('my-project-1.0.tar.gz')
+    ('my-project', '1.0')
+    >>> parse_dist_filename('my_project-1.0-py2.py3-none-any.whl')
+    ('my-project', '1.0')
+    >>> parse_dist_filename('README.txt') is None
+    True
+    """
+    for extension in DIST_EXTENSIONS:
+        if filename.endswith(extension):
+            stem = filename[:-len(extension)]
+            break
+    else:
+        return None
+    if extension in ('.whl', '.egg'):
+        # names and versions in wheel and egg filenames never contain hyphens
+        parts = stem.split('-')
+        if len(parts) < 2:
+            return None
+        name, version = parts[0], parts[1]
+    else:
+        if '-' not in stem:
+            return None
+        name, version = stem.rsplit('-', 1)
+    return normalize_name(name), version
+
+
+def _cache_path(dir_path):
+    digest = hashlib.sha1(os.path.abspath(dir_path).encode('utf-8')).hexdigest()[:16]
+    return helpers.cache_file_path(LOCAL_INDEX_CACHE_DIR, digest + '.json')
+
+
+def get_index(dir_path):
+    """ Get a dict mapping the filename of every distribution in dir_path to its project name
+    and version, rescanning the directory only if it changed since the last time
+    """
+    try:
+        dir_mtime_ns = helpers.mtime_ns(os.stat(dir_path))
+    except OSError as e:
+        raise LocalIndexError('could not read local index {}: {}'.format(dir_path, e))
+    cache_path = _cache_path(dir_path)
+    try:
+        with open(cache_path) as cache_file:
+            cache = json.load(cache_file)
+    except (IOError, OSError, ValueError):
+        cache = {'dir_mtime_ns': None, 'scanned': 0, 'files': {}}
+    if cache['dir_mtime_ns'] == dir_mtime_ns and \
+            dir_mtime_ns < (cache['scanned'] - RACY_SECONDS) * 1e9:
+        return cache['files']
+    scanned = time.time()
+    files = {}
+    parsed_count = 0
+    for filename in os.listdir(dir_path):
+        if filename in cache['files']:
+            files[filename] = cache['files'][filename]
+            continue
+        parsed = parse_dist_filename(filename)
+        if parsed is not None:
+            files[filename] = list(parsed)
+            parsed_count += 1
+    logger.debug('local index {} changed, {} new distributions'.format(dir_path, parsed_count))
+    helpers.atomic_write(cache_path, json.dumps({
+        'dir_mtime_ns': dir_mtime_ns, 'scanned': scanned, 'files': files
+    }))
+    return files
+
+
+def get_uploaded_versions(project_name, dir_path):
+    """ Get the versions of project_name with distributions in dir_path """
+    name = normalize_name(project_name)
+    return sorted(set(
+        version for dist_name, version in get_index(dir_path).values() if dist_name == name
+    ))
+
+
+def upload(file_paths, dir_path):
+    """ Copy distributions into dir_path, each appearing there at once and complete (copied
+    to a temporary file next to it first), refusing to replace any which already exist
+    """
+    if not os.path.isdir(dir_path):
+        raise LocalIndexError('local index {} is not a directory'.format(dir_path))
+    for file_path in file_paths:
+        target_path = os.path.join(dir_path, os.path.basename(file_path))
+        if os.path.exists(target_path):
+            raise LocalIndexError('{} already exists'.format(target_path))
+        temp_path = os.path.join(
+            dir_path, '.{}.{}.tmp'.format(os.path.basename(file_path), os.getpid())
+        )
+        try:
+            shutil.copyfile(file_path, temp_path)
+            if hasattr(os, 'link'):
+                # unlike a rename, linking fails if somebody else uploaded the file meanwhile
+                try:
+                    os.link(temp_path, target_path)
+                except OSError as e:
+                    raise LocalIndexError('could not upload to {}: {}'.format(target_path, e))
+            else:
+                os.rename(temp_path, target_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        logger.info('uploaded {} to {}'.format(os.path.basename(file_path), dir_path))
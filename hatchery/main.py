@@ -4,15 +4,23 @@ hatchery (version {version})
 Automate the process of testing, packaging, and uploading your project with
 dynamic versioning and no source tree pollution!
 
-Usage: hatchery [<task> ...] [options]
+Usage: hatchery batch <manifest> [options]
+       hatchery daemon [options]
+       hatchery [<task> ...] [options]
 
 Just run from the root of your project and off you go.  Tasks can be
 chained, and will always be run in the order below regardless of the order
-in which they are specified.  Available tasks are:
+in which they are specified (work which doesn't depend on an earlier task,
+like building packages while tests are running, is overlapped, but nothing
+is registered, uploaded or tagged until everything before it succeeded).
+Available tasks are:
 
     help        print this help output (ignores all other tasks)
     check       check to see if this project conforms to hatchery requirements
     config      print the computed config contents to the console
+    stats       print how long each stage (task, command, index query and
+                sync) took over the project's recent runs, and warn about
+                stages which have been getting slower
     clean       clean up the working directory
     test        run tests according to commands specified in .hatchery.yml
     package     create binary packages to be distributed
@@ -21,6 +29,29 @@ in which they are specified.  Available tasks are:
     tag         tag your git repository with the release version and push
                 it back up to the origin
 
+Batch mode:
+
+    Run tasks for many projects at once, as listed in a yaml manifest.  Paths
+    are relative to the manifest, and release_version is optional:
+
+        projects:
+            - path: some_project
+              tasks: [clean, test, package, upload]
+              release_version: 1.2.3
+
+    Projects are run by a pool of --jobs worker processes which share http
+    connections, index lookups and user-level config between the projects they
+    run.  A json summary of the results is printed to stdout at the end.
+
+Daemon mode:
+
+    `hatchery daemon` keeps a process running for the project in the current
+    directory, with imports done and config, setup.py parsing and index
+    lookups cached (project caches are dropped whenever files in the project
+    change).  Run tasks through it with `hatchery-client`, which takes the
+    same arguments as hatchery and streams the output back, and falls back to
+    running in-process when no daemon is running.
+
 General options:
 
     -h, --help      print this help output and quit
@@ -33,6 +64,31 @@ General options:
     -r=VER, --release-version=VER
                     version to use when packaging and registering
                     Note: version will be inferred when uploading
+    --workdir=PATH  directory (relative to the project) to sync the project into
+                    and build packages in.  parallel runs in the same project
+                    each need their own, and later tasks (e.g. upload or tag)
+                    find a run's packages by being given the same path
+                    [default: .hatchery.work]
+    --changed-only  with the test task, only run the test files affected by
+                    changes since the latest release tag (found through the
+                    imports of the project's modules).  test_command has to
+                    mark where the test files go with {{tests}}, which is left
+                    empty when all tests are run
+    -w, --watch     keep running after the test task, and run the tests again
+                    whenever files in the project change
+    --stats-runs=N  number of recent runs the stats task covers [default: 20]
+    --regression-threshold=PCT
+                    how much slower (in percent) a stage's latest runs have to
+                    be than the ones before them for the stats task to flag it
+                    as a regression [default: 25]
+    --metrics-file=PATH
+                    write the run's metrics (task, command, index query and
+                    sync durations, command exit codes, bytes synced and
+                    uploaded and cache hit ratios) to PATH in the prometheus
+                    text format, e.g. for node-exporter's textfile collector
+    -j=N, --jobs=N  number of projects to run tasks for at once in batch mode
+                    or when the subprojects parameter is configured (default:
+                    one per cpu that the cgroup quota and cpu affinity allow)
 
 Notes on tagging:
 
@@ -63,33 +119,189 @@ import docopt
 import logging
 import funcy
 import os
+import re
+import glob
+import shutil
+import threading
+import contextlib
+import functools
+import json
+import time
+import tempfile
+import traceback
+import multiprocessing
+import six
 import workdir
-import git
-import ruamel.yaml as yaml
+import dirsync
+from six.moves import shlex_quote
 from . import _version
 from . import executor
 from . import project
 from . import config
 from . import snippets
 from . import helpers
+from . import vcs
+from . import scheduler
+from . import daemon
+from . import watcher
+from . import snapshot
+from . import environments
+from . import depgraph
+from . import manifest
+from . import metrics
+from . import history
+from . import prometheus
+from . import jobpool
+from . import localindex
 
 logger = logging.getLogger(__name__)
-workdir.options.path = '.hatchery.work'
-workdir.options.sync_exclude_regex_list = [r'\.hatchery\.work']
+DEFAULT_WORKDIR = '.hatchery.work'
+# shared by all runs in a project which use a workdir other than the default one
+SNAPSHOT_PATH = DEFAULT_WORKDIR + '.base'
+SYNC_EXCLUDE_REGEXES = [r'\.hatchery\.work']
+workdir.options.path = DEFAULT_WORKDIR
+workdir.options.sync_exclude_regex_list = list(SYNC_EXCLUDE_REGEXES)
+_snapshot_path = None
+# marks where --changed-only puts the selected test files in test_command
+TESTS_PLACEHOLDER = '{tests}'
+
+# the cwd and workdir.options.path are process-wide, so tasks which are running concurrently
+# have to take turns changing them (and may only assume the cwd is the project root while
+# holding this lock)
+_cwd_lock = threading.RLock()
+
+# how long the project has to be quiet before watch mode runs the tests again
+WATCH_DEBOUNCE_SECONDS = 0.3
+
+
+@contextlib.contextmanager
+def _in_workdir(path=None):
+    """ Thread-safe replacement for workdir.as_cwd(), optionally using another directory """
+    with _cwd_lock:
+        owd = os.getcwd()
+        os.chdir(path or workdir.options.path)
+        try:
+            yield
+        finally:
+            os.chdir(owd)
+
+
+def _configure_workdir(path):
+    """ Use path as this run's workdir, relative to the project in the cwd
+
+    The default workdir is synced directly from the project, any other one is seeded from a
+    snapshot shared by all of the project's runs (so that parallel runs can each have their
+    own without paying for a full copy)
+    """
+    global _snapshot_path
+    workdir.options.path = path
+    workdir.options.sync_exclude_regex_list = list(SYNC_EXCLUDE_REGEXES)
+    _snapshot_path = None
+    if workdir.options.path != os.path.abspath(DEFAULT_WORKDIR):
+        _snapshot_path = os.path.abspath(SNAPSHOT_PATH)
+        workdir_path = os.path.relpath(workdir.options.path)
+        if not workdir_path.startswith(os.pardir):
+            workdir.options.sync_exclude_regex_list.append(re.escape(workdir_path))
+
+
+def _sync_exclude_regexes():
+    """ The paths workdir.sync() leaves out: the configured regexes and .gitignore entries """
+    ret = list(workdir.options.sync_exclude_regex_list)
+    if os.path.isfile('.gitignore'):
+        with open('.gitignore') as gitignore:
+            for line in gitignore:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    ret.append(workdir._gitignore_entry_to_regex(line))
+    return ret
+
+
+def _dirsync(target_path):
+    """ Sync the project in the cwd into target_path like workdir.sync() does, but returning
+    the number of paths dirsync changed (and counting the bytes copied in bytes_synced)
+    """
+    dirsync_logger = logging.getLogger('dirsync')
+    dirsync_logger.setLevel(logging.INFO if workdir.options.debug else logging.FATAL)
+    logger.info('syncing {} to {}'.format(os.getcwd(), target_path))
+    changed_paths = dirsync.sync(
+        sourcedir=os.getcwd(),
+        targetdir=target_path,
+        action='sync',
+        create=True,
+        exclude=_sync_exclude_regexes(),
+        logger=dirsync_logger
+    )
+    for changed_path in changed_paths:
+        if os.path.isfile(changed_path):
+            metrics.add('bytes_synced', os.path.getsize(changed_path))
+    return len(changed_paths)
+
+
+SYNC_MODES = ['all', 'manifest']
+
+
+def _sync_paths_or_die():
+    """ Get the files to sync with sync_mode: manifest (leaving out the ones workdir.sync()
+    always leaves out), or None if the whole project should be synced
+    """
+    config_dict = _get_config_or_die(calling_task='sync', required_params=['sync_mode'])
+    if config_dict['sync_mode'] not in SYNC_MODES:
+        logger.error('sync_mode has to be one of: ' + ', '.join(SYNC_MODES))
+        raise SystemExit(1)
+    if config_dict['sync_mode'] == 'all':
+        return None
+    rel_paths = manifest.get_sync_paths()
+    if rel_paths is None:
+        return None
+    exclude_regexes = [re.compile(r) for r in workdir.options.sync_exclude_regex_list]
+    return [p for p in rel_paths if not any(r.match(p) for r in exclude_regexes)]
+
+
+def _sync_workdir(path=None):
+    """ Thread-safe workdir.sync(), optionally into another directory
+
+    A sync which had nothing to copy counts as a hit for the workdir cache
+    """
+    with _cwd_lock, metrics.timed(metrics.SYNC, 'workdir'):
+        rel_paths = _sync_paths_or_die()
+        if _snapshot_path is not None:
+            changed_count = snapshot.sync(
+                os.getcwd(), _snapshot_path, path or workdir.options.path,
+                exclude_regexes=_sync_exclude_regexes(), rel_paths=rel_paths
+            )
+        elif rel_paths is not None:
+            changed_count = manifest.sync(os.getcwd(), path or workdir.options.path, rel_paths)
+        else:
+            changed_count = _dirsync(path or workdir.options.path)
+    metrics.add('files_synced', changed_count)
+    metrics.cache_lookup('workdir', not changed_count)
+
+
+def _staging_path():
+    return workdir.options.path + '.stage'
+
+
+def _package_excludes():
+    config_dict = _get_config_or_die(calling_task='check', required_params=['package_exclude'])
+    ret = list(config_dict['package_exclude'])
+    workdir_path = os.path.relpath(workdir.options.path)
+    if workdir_path != os.curdir and not workdir_path.startswith(os.pardir):
+        ret.append(workdir_path)
+    return ret
 
 
 def _get_package_name_or_die():
     try:
-        package_name = project.get_package_name()
+        package_name = project.get_package_name(exclude=_package_excludes())
     except project.ProjectError as e:
         logger.error(str(e))
         raise SystemExit(1)
     return package_name
 
 
-def _get_config_or_die(required_params=[], calling_task=None):
+def _get_config_or_die(required_params=[], calling_task=None, round_trip=False):
     try:
-        config_dict = config.from_yaml()
+        config_dict = config.from_yaml(round_trip)
         for key in required_params:
             if key not in config_dict.keys() or config_dict[key] is None:
                 logger.error(
@@ -109,24 +321,37 @@ def _valid_version_or_die(release_version):
         raise SystemExit(1)
 
 
-def _latest_version_or_die(release_version, project_name, pypi_repository, pypi_verify_ssl):
+def _index_url(pypi_repository):
+    """ Get the url of pypi_repository, which is either one already or a pypirc alias """
     if helpers.string_is_url(pypi_repository):
-        index_url = pypi_repository
-    else:
-        pypirc_dict = config.from_pypirc(pypi_repository)
-        index_url = pypirc_dict['repository']
-    if project.version_already_uploaded(project_name, release_version, index_url, pypi_verify_ssl):
-        logger.error('{}=={} already exists on index {}'.format(
-            project_name, release_version, index_url
-        ))
-        raise SystemExit(1)
-    elif not project.version_is_latest(project_name, release_version, index_url, pypi_verify_ssl):
-        latest_version = project.get_latest_uploaded_version(
-            project_name, index_url, pypi_verify_ssl
-        )
-        logger.error('{}=={} is older than the latest ({}) on index {}'.format(
-            project_name, release_version, latest_version, index_url
-        ))
+        return pypi_repository
+    return config.from_pypirc(pypi_repository)['repository']
+
+
+def _latest_version_or_die(release_version, project_name, pypi_repository, pypi_verify_ssl):
+    index_url = _index_url(pypi_repository)
+    config_dict = _get_config_or_die(
+        calling_task='check', required_params=['pypi_hedge_requests']
+    )
+    project.configure_index_queries(hedge_requests=config_dict['pypi_hedge_requests'])
+    try:
+        if project.version_already_uploaded(
+                project_name, release_version, index_url, pypi_verify_ssl):
+            logger.error('{}=={} already exists on index {}'.format(
+                project_name, release_version, index_url
+            ))
+            raise SystemExit(1)
+        elif not project.version_is_latest(
+                project_name, release_version, index_url, pypi_verify_ssl):
+            latest_version = project.get_latest_uploaded_version(
+                project_name, index_url, pypi_verify_ssl
+            )
+            logger.error('{}=={} is older than the latest ({}) on index {}'.format(
+                project_name, release_version, latest_version, index_url
+            ))
+            raise SystemExit(1)
+    except project.ProjectError as e:
+        logger.error(str(e))
         raise SystemExit(1)
 
 
@@ -143,11 +368,15 @@ def _check_and_set_version(release_version, package_name, project_name,
     return release_version
 
 
-def _log_failure_and_die(error_msg, call_result, log_full_result):
+def _log_failure(error_msg, call_result, log_full_result):
     msg = error_msg
     if log_full_result:
         msg += os.linesep.join((':', call_result.format_error_msg()))
     logger.error(msg)
+
+
+def _log_failure_and_die(error_msg, call_result, log_full_result):
+    _log_failure(error_msg, call_result, log_full_result)
     raise SystemExit(1)
 
 
@@ -155,18 +384,20 @@ def task_tag(args):
     if not os.path.isdir(workdir.options.path):
         logger.error('{} does not exist, cannot fetch tag version!'.format(workdir.options.path))
         raise SystemExit(1)
-    with workdir.as_cwd():
+    with _in_workdir():
         config_dict = _get_config_or_die(
             calling_task='upload',
-            required_params=['git_remote_name']
+            required_params=['git_remote_name', 'tag_format']
         )
         git_remote_name = config_dict['git_remote_name']
+        tag_format = config_dict['tag_format']
+        project_name = project.get_project_name()
         package_name = _get_package_name_or_die()
         release_version = project.get_version(package_name, ignore_cache=True)
 
     # this part actually happens outside of the working directory!
-    repo = git.Repo()
-    if repo.is_dirty():
+    repo = vcs.get_repo()
+    if vcs.working_copy_is_dirty():
         logger.error('cannot create tag, repo is dirty')
         raise SystemExit(1)
     if git_remote_name not in [x.name for x in repo.remotes]:
@@ -174,12 +405,33 @@ def task_tag(args):
             'cannot push tag to remote "{}" as it is not defined in repo'.format(git_remote_name)
         )
         raise SystemExit(1)
+    tag_name = tag_format.format(version=release_version, project_name=project_name)
     repo.create_tag(
-        path=release_version,
-        message='tag {} created by hatchery'.format(release_version)
+        path=tag_name,
+        message='tag {} created by hatchery'.format(tag_name)
     )
     repo.remotes[git_remote_name].push(tags=True)
-    logger.info('version {} tagged and pushed!'.format(release_version))
+    logger.info('version {} tagged as {} and pushed!'.format(release_version, tag_name))
+
+
+COMMAND_TIMEOUT_STEPS = ['test', 'package', 'upload']
+
+
+def _command_timeout_or_die(step):
+    """ Get the timeout (in seconds) configured for the commands of step, or None """
+    config_dict = _get_config_or_die(calling_task=step, required_params=['command_timeouts'])
+    command_timeouts = config_dict['command_timeouts']
+    garbage_steps = set(command_timeouts) - set(COMMAND_TIMEOUT_STEPS)
+    if garbage_steps:
+        logger.error('found garbage steps in command_timeouts: {}'.format(
+            ', '.join(sorted(garbage_steps))
+        ))
+        raise SystemExit(1)
+    timeout = command_timeouts.get(step)
+    if timeout is not None and (not isinstance(timeout, (int, float)) or timeout <= 0):
+        logger.error('command_timeouts must be positive numbers of seconds (or null)')
+        raise SystemExit(1)
+    return timeout
 
 
 def _call_twine(args, pypi_repository, suppress_output):
@@ -190,7 +442,9 @@ def _call_twine(args, pypi_repository, suppress_output):
         twine_args += ['-r', pypirc_index_name, '--config-file', pypirc_path]
     else:
         twine_args += ['-r', pypi_repository]
-    return executor.call(twine_args, suppress_output=suppress_output)
+    return executor.call(
+        twine_args, suppress_output=suppress_output, timeout=_command_timeout_or_die('upload')
+    )
 
 
 def task_upload(args):
@@ -198,7 +452,7 @@ def task_upload(args):
     if not os.path.isdir(workdir.options.path):
         logger.error('{} does not exist, nothing to upload!'.format(workdir.options.path))
         raise SystemExit(1)
-    with workdir.as_cwd():
+    with _in_workdir():
         config_dict = _get_config_or_die(
             calling_task='upload',
             required_params=['pypi_repository', 'pypi_verify_ssl']
@@ -215,37 +469,56 @@ def task_upload(args):
         release_version = project.get_version(package_name, ignore_cache=True)
         _valid_version_or_die(release_version)
         _latest_version_or_die(release_version, project_name, pypi_repository, pypi_verify_ssl)
-        result = _call_twine(['upload', 'dist/*'], pypi_repository, suppress_output)
-        if result.exitval:
-            if 'not allowed to edit' in result.stderr:
-                logger.error('could not upload packages, try `hatchery register`')
-            else:
-                _log_failure_and_die(
-                    'failed to upload packages', result, log_full_result=suppress_output
-                )
-            raise SystemExit(1)
+        index_url = _index_url(pypi_repository)
+        if localindex.is_local_index(index_url):
+            _upload_to_local_index_or_die(glob.glob('dist/*'), index_url)
+        else:
+            _upload_with_twine_or_die(pypi_repository, suppress_output)
+        metrics.add('bytes_uploaded', sum(os.path.getsize(p) for p in glob.glob('dist/*')))
     logger.info('successfully uploaded {}=={} to [{}]'.format(
         project_name, release_version, pypi_repository
     ))
 
 
-def _create_packages(create_wheel, suppress_output):
-    with workdir.as_cwd():
-        setup_args = ['sdist']
-        if create_wheel:
-            setup_args.append('bdist_wheel')
-        result = executor.setup(setup_args, suppress_output=suppress_output)
-        if result.exitval:
+def _upload_to_local_index_or_die(file_paths, index_url):
+    try:
+        localindex.upload(file_paths, localindex.index_dir(index_url))
+    except (localindex.LocalIndexError, IOError, OSError) as e:
+        logger.error('failed to upload packages: ' + str(e))
+        raise SystemExit(1)
+
+
+def _upload_with_twine_or_die(pypi_repository, suppress_output):
+    result = _call_twine(['upload', 'dist/*'], pypi_repository, suppress_output)
+    if result.exitval:
+        if 'not allowed to edit' in result.stderr:
+            logger.error('could not upload packages, try `hatchery register`')
+        else:
             _log_failure_and_die(
-                'failed to package project', result, log_full_result=suppress_output
+                'failed to upload packages', result, log_full_result=suppress_output
             )
+        raise SystemExit(1)
+
+
+def _create_packages(create_wheel, suppress_output, path=None):
+    setup_args = ['sdist']
+    if create_wheel:
+        setup_args.append('bdist_wheel')
+    result = executor.setup(
+        setup_args, suppress_output=suppress_output, cwd=path or workdir.options.path,
+        timeout=_command_timeout_or_die('package')
+    )
+    if result.exitval:
+        _log_failure_and_die(
+            'failed to package project', result, log_full_result=suppress_output
+        )
 
 
 def task_register(args):
     release_version = args['--release-version']
     suppress_output = not args['--stream-command-output']
-    workdir.sync()
-    with workdir.as_cwd():
+    _sync_workdir()
+    with _in_workdir():
         config_dict = _get_config_or_die(
             calling_task='register',
             required_params=['pypi_repository', 'pypi_verify_ssl']
@@ -253,6 +526,11 @@ def task_register(args):
         pypi_repository = config_dict['pypi_repository']
         pypi_verify_ssl = config_dict['pypi_verify_ssl']
         project_name = project.get_project_name()
+        if localindex.is_local_index(_index_url(pypi_repository)):
+            logger.info('{} is a local index, there is nothing to register'.format(
+                pypi_repository
+            ))
+            return
         package_name = _get_package_name_or_die()
         packaged_files = project.get_packaged_files(package_name)
         if len(packaged_files) == 0:
@@ -264,22 +542,128 @@ def task_register(args):
             _check_and_set_version(
                 release_version, package_name, project_name, pypi_repository, pypi_verify_ssl
             )
-            _create_packages(create_wheel=False, suppress_output=suppress_output)
-            packaged_files = project.get_packaged_files(package_name)
-        package_path = packaged_files[0]
-        result = _call_twine(['register', package_path], pypi_repository, suppress_output)
-        if result.exitval or '(400)' in result.stdout:
-            _log_failure_and_die(
-                'failed to register project', result, log_full_result=suppress_output
+            # no need to build a package just for its metadata
+            _register_metadata_or_die(
+                _get_metadata_or_die(suppress_output), pypi_repository, pypi_verify_ssl
             )
+        else:
+            package_path = packaged_files[0]
+            result = _call_twine(['register', package_path], pypi_repository, suppress_output)
+            if result.exitval or '(400)' in result.stdout:
+                _log_failure_and_die(
+                    'failed to register project', result, log_full_result=suppress_output
+                )
     logger.info('successfully registered {} with [{}]'.format(project_name, pypi_repository))
 
 
-def task_package(args):
+def _get_metadata_or_die(suppress_output):
+    """ Get the project's metadata from an egg_info run in the workdir (which writes a few
+    small files, rather than building a package)
+    """
+    egg_base = tempfile.mkdtemp(prefix='hatchery-egg-info-')
+    try:
+        result = executor.setup(
+            ['egg_info', '--egg-base', egg_base], suppress_output=suppress_output,
+            cwd=workdir.options.path, timeout=_command_timeout_or_die('package')
+        )
+        if result.exitval:
+            _log_failure_and_die(
+                'failed to read project metadata', result, log_full_result=suppress_output
+            )
+        pkg_info_paths = glob.glob(os.path.join(egg_base, '*.egg-info', 'PKG-INFO'))
+        if not pkg_info_paths:
+            logger.error('egg_info did not write any project metadata')
+            raise SystemExit(1)
+        return project.read_pkg_info(pkg_info_paths[0])
+    finally:
+        shutil.rmtree(egg_base, ignore_errors=True)
+
+
+def _register_metadata_or_die(metadata, pypi_repository, pypi_verify_ssl):
+    if helpers.string_is_url(pypi_repository):
+        # the same credentials as the temporary pypirc twine is given
+        username, password = 'anonymous', 'nopassword'
+    else:
+        # like twine, the environment wins over the pypirc file
+        pypirc_dict = config.from_pypirc(pypi_repository)
+        username = os.environ.get('TWINE_USERNAME') or pypirc_dict.get('username')
+        password = os.environ.get('TWINE_PASSWORD') or pypirc_dict.get('password')
+        for name, value in (('username', username), ('password', password)):
+            if not value:
+                logger.error(
+                    'no {} to register with [{}]: set it in the pypirc file or in the '
+                    'TWINE_{} environment variable'.format(name, pypi_repository, name.upper())
+                )
+                raise SystemExit(1)
+    try:
+        project.register_metadata(
+            metadata, _index_url(pypi_repository), username, password, pypi_verify_ssl
+        )
+    except project.ProjectError as e:
+        logger.error('failed to register project: ' + str(e))
+        raise SystemExit(1)
+
+
+def _convert_readme_or_die(project_dir='.'):
+    """ Get README.md converted to rst, or None if there is nothing (safe) to convert """
+    if not project.project_has_readme_md(project_dir):
+        return None
+    try:
+        return project.get_readme_rst(project_dir)
+    except project.ProjectError as e:
+        if 'could not convert' in str(e):
+            logger.error(e)
+            raise SystemExit(1)
+        logger.info(e)
+    return None
+
+
+def _check_version_ahead(args):
+    """ Do the index lookups for task_package up front (the results are cached) """
+    with _cwd_lock:
+        config_dict = _get_config_or_die(
+            calling_task='package',
+            required_params=['pypi_repository', 'pypi_verify_ssl']
+        )
+        project_name = project.get_project_name()
+    release_version = args['--release-version']
+    _valid_version_or_die(release_version)
+    _latest_version_or_die(
+        release_version, project_name, config_dict['pypi_repository'],
+        config_dict['pypi_verify_ssl']
+    )
+
+
+def _convert_readme_ahead(context):
+    """ Convert the project's README.md for task_package without touching the workdir """
+    with _cwd_lock:
+        config_dict = _get_config_or_die(calling_task='package', required_params=['readme_to_rst'])
+        project_dir = os.getcwd()
+    context['readme_rst'] = None
+    if config_dict['readme_to_rst']:
+        context['readme_rst'] = _convert_readme_or_die(project_dir)
+
+
+def _promote_staged_package(staging_path):
+    """ Move the results of a staged task_package into the workdir """
+    with _cwd_lock:
+        if _snapshot_path is not None:
+            snapshot.seed(staging_path, workdir.options.path)
+        else:
+            workdir.sync(sourcedir=staging_path, exclude_gitignore_entries=False)
+    shutil.rmtree(staging_path)
+
+
+def task_package(args, context=None):
+    """ Package the project, context (if given) may hold the results of steps run ahead of
+    time, and a package_path to build in instead of the workdir
+    """
+    context = context or {}
+    package_path = context.get('package_path', workdir.options.path)
     release_version = args['--release-version']
     suppress_output = not args['--stream-command-output']
-    workdir.sync()
-    with workdir.as_cwd():
+    _sync_workdir(package_path)
+    with _in_workdir(package_path):
         config_dict = _get_config_or_die(
             calling_task='package',
             required_params=['create_wheel', 'readme_to_rst', 'pypi_repository', 'pypi_verify_ssl']
@@ -292,46 +676,316 @@ def task_package(args):
             release_version, package_name, project_name, pypi_repository, pypi_verify_ssl
         )
         if config_dict['readme_to_rst']:
-            if project.project_has_readme_md():
-                try:
-                    project.convert_readme_to_rst()
-                except project.ProjectError as e:
-                    if 'could not convert' in str(e):
-                        logger.error(e)
-                        raise SystemExit(1)
-                    else:
-                        logger.info(e)
-        _create_packages(config_dict['create_wheel'], suppress_output)
+            if 'readme_rst' in context:
+                rst_content = context['readme_rst']
+            else:
+                rst_content = _convert_readme_or_die()
+            if rst_content is not None:
+                project.write_readme_rst(rst_content)
+    _create_packages(config_dict['create_wheel'], suppress_output, package_path)
     logger.info('successfully packaged {}=={}'.format(project_name, release_version))
 
 
-def task_test(args):
-    suppress_output = not args['--stream-command-output']
-    workdir.sync()
-    with workdir.as_cwd():
+def _get_test_config_or_die(test_paths=None):
+    """ Get the test commands (as a list) and the config they should be run with
+
+    TESTS_PLACEHOLDER in the commands is replaced by test_paths, or removed if that isn't set
+    """
+    with _in_workdir():
         config_dict = _get_config_or_die(
             calling_task='test',
-            required_params=['test_command']
+            required_params=[
+                'test_command', 'test_environment', 'test_environment_cache_size',
+                'test_interpreters'
+            ]
+        )
+    test_commands = config_dict['test_command']
+    if not funcy.is_list(test_commands):
+        test_commands = [test_commands]
+    if test_paths is not None and not any(TESTS_PLACEHOLDER in c for c in test_commands):
+        logger.error('--changed-only needs test_command to say where the test paths go with ' +
+                     TESTS_PLACEHOLDER)
+        raise SystemExit(1)
+    test_paths_str = ' '.join(shlex_quote(p) for p in test_paths or [])
+    test_commands = [c.replace(TESTS_PLACEHOLDER, test_paths_str) for c in test_commands]
+    return test_commands, config_dict
+
+
+def _changed_test_paths_or_die():
+    """ Get the test files affected by the changes since the latest release tag (or None if
+    all of them are)
+    """
+    with _cwd_lock:
+        config_dict = _get_config_or_die(calling_task='test', required_params=['tag_format'])
+        try:
+            release_tag = vcs.latest_release_tag(
+                config_dict['tag_format'], project.get_project_name()
+            )
+            if release_tag is None:
+                logger.info('no release has been tagged yet, running all tests')
+                return None
+            changed_paths = vcs.changed_paths_since(release_tag)
+        except vcs.VcsError as e:
+            logger.error('could not work out what changed since the last release: ' + str(e))
+            raise SystemExit(1)
+        test_paths = depgraph.affected_tests(changed_paths, root=os.getcwd())
+    if test_paths is not None:
+        logger.info('{} changed paths since {} affect {} test files'.format(
+            len(changed_paths), release_tag, len(test_paths)
+        ))
+    return test_paths
+
+
+@contextlib.contextmanager
+def _test_environ(config_dict, interpreter=None, path=None):
+    """ Yield the environment variables to run test commands with, which activate a cached
+    test environment if test_environment is set or a specific interpreter is asked for (or
+    None to use hatchery's own environment)
+    """
+    if not config_dict['test_environment'] and not interpreter:
+        yield None
+        return
+    with environments.use(
+        path or workdir.options.path, interpreter=interpreter,
+        cache_size=config_dict['test_environment_cache_size']
+    ) as env_path:
+        yield environments.activated_environ(env_path)
+
+
+@contextlib.contextmanager
+def _test_environ_or_die(config_dict, interpreter=None, path=None):
+    try:
+        with _test_environ(config_dict, interpreter=interpreter, path=path) as environ:
+            yield environ
+    except environments.TestEnvironmentError as e:
+        logger.error(str(e))
+        raise SystemExit(1)
+
+
+def _run_test_commands(test_commands, suppress_output, canceller=None, environ=None,
+                       path=None):
+    """ Run test commands in the workdir (or path), return the result of the first one that
+    failed (or None if they all passed)
+    """
+    timeout = _command_timeout_or_die('test')
+    for cmd_str in test_commands:
+        result = executor.call(
+            cmd_str, suppress_output=suppress_output, cwd=path or workdir.options.path,
+            canceller=canceller, env=environ, timeout=timeout
+        )
+        if result.exitval:
+            return result
+    return None
+
+
+def _matrix_workdir_path(interpreter):
+    return '{}.test-{}'.format(
+        workdir.options.path, re.sub(r'[^\w.-]+', '_', interpreter).strip('_')
+    )
+
+
+def _run_matrix_entry(interpreter, path, test_commands, config_dict, suppress_output):
+    """ Run the tests against one interpreter, in its own copy of the workdir (path) and its
+    own cached test environment
+    """
+    start_time = time.time()
+    _sync_workdir(path)
+    try:
+        with _test_environ(config_dict, interpreter=interpreter, path=path) as environ:
+            failed_result = _run_test_commands(
+                test_commands, suppress_output, environ=environ, path=path
+            )
+    except environments.TestEnvironmentError as e:
+        failed_result = executor.CallResult(
+            1, '', 'could not set up a test environment for {}: {}'.format(interpreter, e)
+        )
+    return {
+        'interpreter': interpreter,
+        'failed_result': failed_result,
+        'seconds': round(time.time() - start_time, 1),
+    }
+
+
+def _run_test_matrix(interpreters, test_commands, config_dict, suppress_output):
+    """ Run the tests against all interpreters at once, then report the combined results """
+    results = [None] * len(interpreters)
+    # worked out up front, workdir.options.path changes while other threads are syncing
+    paths = [_matrix_workdir_path(interpreter) for interpreter in interpreters]
+    # configuration errors are reported once, before any of the entries start
+    _command_timeout_or_die('test')
+
+    def run_entry(i):
+        start_time = time.time()
+        try:
+            results[i] = _run_matrix_entry(
+                interpreters[i], paths[i], test_commands, config_dict, suppress_output
+            )
+        except (Exception, SystemExit) as e:
+            if isinstance(e, SystemExit):
+                # the reason was logged before raising it
+                error = 'tests could not run for {}, see the errors above'.format(
+                    interpreters[i]
+                )
+            else:
+                error = 'tests could not run for {}:{}{}'.format(
+                    interpreters[i], os.linesep, traceback.format_exc()
+                )
+            results[i] = {
+                'interpreter': interpreters[i],
+                'failed_result': executor.CallResult(1, '', error),
+                'seconds': round(time.time() - start_time, 1),
+            }
+
+    threads = [threading.Thread(target=run_entry, args=(i,)) for i in range(len(interpreters))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    summary_lines = ['test matrix results:']
+    for result in results:
+        if result['failed_result']:
+            _log_failure(
+                'tests failed for ' + result['interpreter'], result['failed_result'],
+                log_full_result=suppress_output
+            )
+        summary_lines.append('    {}: {} ({}s)'.format(
+            result['interpreter'], 'FAILED' if result['failed_result'] else 'passed',
+            result['seconds']
+        ))
+    if any(result['failed_result'] for result in results):
+        logger.error(os.linesep.join(summary_lines))
+        raise SystemExit(1)
+    logger.info(os.linesep.join(summary_lines))
+
+
+def task_test(args):
+    suppress_output = not args['--stream-command-output']
+    test_paths = None
+    if args['--changed-only']:
+        test_paths = _changed_test_paths_or_die()
+        if test_paths == []:
+            logger.info('no tests are affected by the changes since the last release')
+            return
+    _sync_workdir()
+    test_commands, config_dict = _get_test_config_or_die(test_paths)
+    if config_dict['test_interpreters']:
+        _run_test_matrix(
+            config_dict['test_interpreters'], test_commands, config_dict, suppress_output
         )
-        test_commands = config_dict['test_command']
-        if not funcy.is_list(test_commands):
-            test_commands = [test_commands]
-        for cmd_str in test_commands:
-            result = executor.call(cmd_str, suppress_output=suppress_output)
-            if result.exitval:
-                _log_failure_and_die('tests failed', result, log_full_result=suppress_output)
+        logger.info('testing completed successfully')
+        return
+    with _test_environ_or_die(config_dict) as environ:
+        failed_result = _run_test_commands(test_commands, suppress_output, environ=environ)
+    if failed_result:
+        _log_failure_and_die('tests failed', failed_result, log_full_result=suppress_output)
     logger.info('testing completed successfully')
 
 
+def _push_changed_paths(changed_paths, path=None):
+    """ Bring the workdir up to date with just the paths (relative to the project root) which
+    changed, instead of syncing the whole project again
+    """
+    path = path or workdir.options.path
+    for rel_path in changed_paths:
+        target_path = os.path.join(path, rel_path)
+        if os.path.isdir(target_path) and not os.path.isdir(rel_path):
+            shutil.rmtree(target_path)
+        if os.path.isdir(rel_path):
+            if not os.path.isdir(target_path):
+                os.makedirs(target_path)
+        elif os.path.exists(rel_path):
+            if not os.path.isdir(os.path.dirname(target_path)):
+                os.makedirs(os.path.dirname(target_path))
+            snapshot.replace_file(rel_path, target_path)
+        elif os.path.lexists(target_path):
+            os.remove(target_path)
+
+
+def _watched_test_run(suppress_output, canceller):
+    try:
+        test_commands, config_dict = _get_test_config_or_die()
+        with _test_environ_or_die(config_dict) as environ:
+            failed_result = _run_test_commands(
+                test_commands, suppress_output, canceller=canceller, environ=environ
+            )
+    except SystemExit:
+        # the reason was logged, wait for the config (or requirements) to be fixed
+        return
+    if failed_result is None:
+        logger.info('testing completed successfully')
+    elif failed_result.cancelled:
+        return
+    else:
+        _log_failure('tests failed', failed_result, log_full_result=suppress_output)
+    logger.info('watching for changes...')
+
+
+def _debounce_changes(project_watcher, changed_paths):
+    """ Keep collecting changes until none come in for WATCH_DEBOUNCE_SECONDS, so that a burst
+    of saves only triggers a single run
+    """
+    changed_paths = set(changed_paths)
+    while True:
+        more_changed_paths = project_watcher.poll(timeout=WATCH_DEBOUNCE_SECONDS)
+        if not more_changed_paths:
+            return sorted(changed_paths)
+        changed_paths.update(more_changed_paths)
+
+
+def _watch_tests(args):
+    """ Run the tests, then run them again every time files in the project change (cancelling
+    the previous run if it is still going), until interrupted
+    """
+    suppress_output = not args['--stream-command-output']
+    project_watcher = watcher.get_watcher(
+        os.getcwd(),
+        exclude_regexes=watcher.DEFAULT_EXCLUDE_REGEXES + workdir.options.sync_exclude_regex_list
+    )
+    canceller = None
+    _configure_job_pool()
+    _sync_workdir()
+    try:
+        while True:
+            canceller = executor.Canceller()
+            test_thread = threading.Thread(
+                target=_watched_test_run, args=(suppress_output, canceller)
+            )
+            test_thread.daemon = True
+            test_thread.start()
+            changed_paths = []
+            while not changed_paths:
+                changed_paths = project_watcher.poll(timeout=1)
+            if test_thread.is_alive():
+                logger.info('changes detected, cancelling the running tests')
+                canceller.cancel()
+            changed_paths = _debounce_changes(project_watcher, changed_paths)
+            test_thread.join()
+            logger.info('{} changed paths, running tests again'.format(len(changed_paths)))
+            _push_changed_paths(changed_paths)
+            helpers.clear_cache_except(daemon.PERSISTENT_CACHES)
+    except KeyboardInterrupt:
+        logger.info('stopped watching')
+    finally:
+        if canceller is not None:
+            canceller.cancel()
+        project_watcher.close()
+    return 0
+
+
 def task_clean(args):
     workdir.remove()
+    for path in [_staging_path()] + glob.glob(workdir.options.path + '.test-*'):
+        if os.path.isdir(path):
+            shutil.rmtree(path)
 
 
 def task_config(args):
     config_dict = _get_config_or_die(
         calling_task='config',
-        required_params=[]
+        required_params=[],
+        round_trip=True
     )
+    yaml = config.import_yaml()
     print(os.linesep.join((
         '### yaml ###',
         '',
@@ -340,10 +994,58 @@ def task_config(args):
     )))
 
 
+def _format_seconds(seconds):
+    return '{:.2f}s'.format(seconds)
+
+
+def task_stats(args):
+    run_count = int(args['--stats-runs'])
+    threshold_pct = float(args['--regression-threshold'])
+    try:
+        stage_stats = history.get_stage_stats(os.getcwd(), run_count)
+        counter_totals = history.get_counter_totals(os.getcwd(), run_count)
+    except history.HistoryError as e:
+        logger.error(str(e))
+        raise SystemExit(1)
+    if not stage_stats:
+        logger.info('no runs of this project have been recorded yet')
+        return
+    name_width = max(len(s.stage) for s in stage_stats)
+    lines = ['{}  {:>5}  {:>9}  {:>9}  {:>9}'.format(
+        'stage'.ljust(name_width), 'runs', 'p50', 'p95', 'latest'
+    )]
+    for s in stage_stats:
+        lines.append('{}  {:>5}  {:>9}  {:>9}  {:>9}'.format(
+            s.stage.ljust(name_width), len(s.seconds), _format_seconds(s.p50),
+            _format_seconds(s.p95), _format_seconds(s.seconds[-1])
+        ))
+    cache_names = sorted(set(
+        name.split('.', 1)[1] for name in counter_totals if name.startswith('cache_')
+    ))
+    if cache_names:
+        lines += ['', 'cache hit ratios:']
+    for cache_name in cache_names:
+        hits = counter_totals.get('cache_hits.' + cache_name, 0)
+        misses = counter_totals.get('cache_misses.' + cache_name, 0)
+        lines.append('    {}: {:.0%} of {:.0f} lookups'.format(
+            cache_name, hits / float(hits + misses), hits + misses
+        ))
+    if 'bytes_synced' in counter_totals:
+        lines += ['', 'bytes synced: {:.0f}'.format(counter_totals['bytes_synced'])]
+    regressions = [(s, s.regression(threshold_pct)) for s in stage_stats]
+    regressions = [(s, r) for s, r in regressions if r]
+    print(os.linesep.join(lines))
+    for s, (baseline, recent) in regressions:
+        logger.warning('{} regressed: median {} over the latest {} runs, {} before ({})'.format(
+            s.stage, _format_seconds(recent), history.RECENT_RUNS, _format_seconds(baseline),
+            '{:+.0%}'.format(recent / baseline - 1) if baseline else 'new'
+        ))
+
+
 def task_check(args):
     logger.debug('verifying that project has a single package')
     try:
-        package_name = project.get_package_name()
+        package_name = project.get_package_name(exclude=_package_excludes())
     except project.ProjectError as e:
         logger.error(str(e))
         raise SystemExit(1)
@@ -372,16 +1074,75 @@ def task_check(args):
     logger.info('all checks passed!')
 
 
-ORDERED_TASKS = ['check', 'config', 'clean', 'test', 'package', 'register', 'upload', 'tag']
-CHECK_TASKS = [t for t in ORDERED_TASKS if t not in ('config', 'clean')]
+ORDERED_TASKS = [
+    'check', 'config', 'stats', 'clean', 'test', 'package', 'register', 'upload', 'tag'
+]
+CHECK_TASKS = [t for t in ORDERED_TASKS if t not in ('config', 'stats', 'clean')]
+COMMIT_TASKS = ['register', 'upload', 'tag']
+# runs of nothing but these don't do any work worth keeping timings of
+UNRECORDED_TASKS = ['config', 'stats']
 
 
-def hatchery():
+def _task_step(task, func):
+    def _run_task():
+        logger.info('starting task: ' + task)
+        with metrics.timed(metrics.TASK, task):
+            func()
+    return _run_task
+
+
+def _schedule_tasks(task_list, args):
+    """ Build the dependency graph for the requested tasks (check is run separately)
+
+    test and package are independent, as are package's index lookups and readme conversion,
+    so all of them overlap. When both are requested, package builds in a staging directory
+    which is promoted into the workdir once both have succeeded. Commit tasks only run once
+    everything scheduled before them has succeeded
+    """
+    task_scheduler = scheduler.Scheduler()
+    context = {}
+    prerequisites = []
+    if 'config' in task_list:
+        task_scheduler.add('config', _task_step('config', functools.partial(task_config, args)))
+    if 'stats' in task_list:
+        task_scheduler.add('stats', _task_step('stats', functools.partial(task_stats, args)))
+    if 'clean' in task_list:
+        task_scheduler.add('clean', _task_step('clean', functools.partial(task_clean, args)))
+        prerequisites.append('clean')
+    if 'test' in task_list:
+        task_scheduler.add(
+            'test', _task_step('test', functools.partial(task_test, args)),
+            requires=prerequisites
+        )
+    if 'package' in task_list:
+        task_scheduler.add('package:version', functools.partial(_check_version_ahead, args))
+        task_scheduler.add('package:readme', functools.partial(_convert_readme_ahead, context))
+        if 'test' in task_list:
+            context['package_path'] = _staging_path()
+        task_scheduler.add(
+            'package', _task_step('package', functools.partial(task_package, args, context)),
+            requires=prerequisites + ['package:version', 'package:readme']
+        )
+        if 'test' in task_list:
+            task_scheduler.add(
+                'package:promote',
+                functools.partial(_promote_staged_package, context['package_path']),
+                requires=['test', 'package']
+            )
+    for task in COMMIT_TASKS:
+        if task in task_list:
+            task_func = functools.partial(globals()['task_' + task], args)
+            task_scheduler.add(task, _task_step(task, task_func), barrier=True)
+    return task_scheduler
+
+
+def hatchery(argv=None):
     """ Main entry point for the hatchery program """
-    args = docopt.docopt(__doc__)
+    args = docopt.docopt(__doc__, argv=argv)
     task_list = args['<task>']
 
-    if not task_list or 'help' in task_list or args['--help']:
+    nothing_to_do = not task_list and not args['batch'] and not args['daemon']
+    if nothing_to_do or 'help' in task_list or args['--help']:
         print(__doc__.format(version=_version.__version__, config_files=config.CONFIG_LOCATIONS))
         return 0
 
@@ -389,6 +1150,8 @@ def hatchery():
     try:
         level_const = getattr(logging, level_str.upper())
         logging.basicConfig(level=level_const)
+        # a daemon serves many runs, each of which may ask for a different level
+        logging.getLogger().setLevel(level_const)
         if level_const == logging.DEBUG:
             workdir.options.debug = True
     except LookupError:
@@ -396,15 +1159,72 @@ def hatchery():
         logger.error('received invalid log level: ' + level_str)
         return 1
 
+    _configure_workdir(args['--workdir'])
+
+    if args['batch']:
+        return run_batch(args['<manifest>'], args)
+
+    if args['daemon']:
+        try:
+            daemon.Daemon(hatchery).serve_forever()
+        except daemon.DaemonError as e:
+            logger.error(str(e))
+            return 1
+        return 0
+
     for task in task_list:
         if task not in ORDERED_TASKS:
             logger.info('starting task: check')
             logger.error('received invalid task: ' + task)
             return 1
 
+    config_dict = _get_config_or_die(calling_task='hatchery')
+    if args['--watch']:
+        if 'test' not in task_list or set(task_list) - set(['clean', 'test']) or \
+                config_dict['subprojects']:
+            logger.error('--watch only works with the clean and test tasks of a single project')
+            return 1
+        task_check(args)
+        if 'clean' in task_list:
+            task_clean(args)
+        return _watch_tests(args)
+    if config_dict['subprojects']:
+        return _run_subprojects(config_dict['subprojects'], task_list, args)
+    start_time = time.time()
+    try:
+        return _run_tasks(task_list, args)
+    finally:
+        _write_metrics_file(args, [os.getcwd()], start_time)
+
+
+def _configure_job_pool():
+    """ Admit the project's commands within the budgets and weights its config sets """
+    config_dict = _get_config_or_die(
+        calling_task='hatchery', required_params=['command_weights']
+    )
+    jobpool.configure(
+        cpu_slots=config_dict['job_cpu_slots'], memory_mb=config_dict['job_memory_mb'],
+        command_weights=config_dict['command_weights']
+    )
+
+
+def _run_tasks(task_list, args):
+    """ Run the requested tasks for the project in the cwd, keeping the run's timings in the
+    project's history (unless nothing but UNRECORDED_TASKS were requested)
+    """
+    _configure_job_pool()
+    if set(task_list) <= set(UNRECORDED_TASKS):
+        return _run_requested_tasks(task_list, args)
+    with history.recording(os.getcwd(), task_list) as run:
+        run['exitval'] = _run_requested_tasks(task_list, args)
+    return run['exitval']
+
+
+def _run_requested_tasks(task_list, args):
     for task in CHECK_TASKS:
         if task in task_list:
-            task_check(args)
+            with metrics.timed(metrics.TASK, 'check'):
+                task_check(args)
             break
 
     if 'package' in task_list and not args['--release-version']:
@@ -421,10 +1241,186 @@ def hatchery():
 
     # all commands will raise a SystemExit if they fail
     # check will have already been run
-    for task in ORDERED_TASKS:
-        if task in task_list and task != 'check':
-            logger.info('starting task: ' + task)
-            globals()['task_' + task](args)
+    failed_steps = _schedule_tasks(task_list, args).run()
+    if failed_steps:
+        raise failed_steps[0].error
 
     logger.info("all's well that ends well...hatchery out")
     return 0
+
+
+def _write_metrics_file(args, project_dirs, start_time, root=None):
+    """ Write the metrics of the runs of project_dirs (as saved in their history) which started
+    at or after start_time to --metrics-file, if it is set, labelled by their path relative to
+    root (if it isn't None)
+
+    The file is replaced atomically, so that collectors never read a partial one
+    """
+    metrics_path = args['--metrics-file']
+    if not metrics_path:
+        return
+    try:
+        runs = [history.get_latest_run(d, since=start_time) for d in project_dirs]
+    except history.HistoryError as e:
+        logger.error('could not write metrics file: ' + str(e))
+        return
+    runs = [r for r in runs if r]
+    if not runs:
+        logger.info('no runs were recorded, leaving {} as it is'.format(metrics_path))
+        return
+    helpers.atomic_write(metrics_path, prometheus.format_runs(runs, root=root))
+    logger.info('wrote run metrics to ' + metrics_path)
+
+
+# results of these functions don't depend on which project is being worked on, so worker
+# processes keep them cached from one project to the next
+WORKER_SHARED_CACHES = [
+    '_load_config_file', 'from_pypirc', 'pypirc_temp', '_get_uploaded_versions'
+]
+
+
+def _run_project(project_dir, project_root, task_list, args):
+    """ Run the requested tasks for one project in a worker process and return the exitval
+
+    Worker processes are reused, so everything but WORKER_SHARED_CACHES is reset first
+    """
+    os.chdir(os.path.join(project_root, project_dir))
+    _configure_workdir(args['--workdir'])
+    helpers.clear_cache_except(WORKER_SHARED_CACHES)
+    log_format = '[{}] %(levelname)s:%(name)s:%(message)s'.format(project_dir)
+    for handler in logging.getLogger().handlers:
+        handler.setFormatter(logging.Formatter(log_format))
+    try:
+        return _run_tasks(list(task_list), args)
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else 1
+    except Exception:
+        logger.exception('unexpected error')
+        return 1
+
+
+def _run_in_pool(jobs, calls):
+    """ Run (func, args) calls in a pool of jobs worker processes, return their results
+
+    The workers split the job pool's budgets between them, rather than each admitting as many
+    commands as the whole machine can take
+    """
+    workers = min(jobs, len(calls))
+    pool = multiprocessing.Pool(
+        processes=workers, initializer=jobpool.share_among, initargs=(workers,)
+    )
+    try:
+        async_results = [pool.apply_async(func, func_args) for func, func_args in calls]
+        return [async_result.get() for async_result in async_results]
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _run_subprojects(subproject_patterns, task_list, args):
+    """ Run the requested tasks for every subproject concurrently, one process per subproject
+    (each with its own cwd and workdir), and summarize the results
+    """
+    subproject_dirs = project.find_subprojects(subproject_patterns)
+    if not subproject_dirs:
+        logger.error('no subprojects with a setup.py matched: {}'.format(subproject_patterns))
+        return 1
+    jobs = int(args['--jobs'] or jobpool.available_cpus())
+    logger.info('running {} subprojects, {} at a time'.format(len(subproject_dirs), jobs))
+    start_time = time.time()
+    exitvals = _run_in_pool(jobs, [
+        (_run_project, (subproject_dir, os.getcwd(), task_list, dict(args)))
+        for subproject_dir in subproject_dirs
+    ])
+    _write_metrics_file(args, subproject_dirs, start_time, root=os.getcwd())
+    failed_dirs = [d for d, exitval in zip(subproject_dirs, exitvals) if exitval]
+    for subproject_dir, exitval in zip(subproject_dirs, exitvals):
+        if exitval:
+            logger.error('{}: failed (exitval {})'.format(subproject_dir, exitval))
+        else:
+            logger.info('{}: succeeded'.format(subproject_dir))
+    if failed_dirs:
+        logger.error('{} of {} subprojects failed'.format(len(failed_dirs), len(subproject_dirs)))
+        return 1
+    logger.info("all's well that ends well...hatchery out")
+    return 0
+
+
+def _run_batch_project(project_dir, project_root, task_list, release_version, args):
+    args = dict(args)
+    args['--release-version'] = release_version
+    start_time = time.time()
+    exitval = _run_project(project_dir, project_root, task_list, args)
+    return {
+        'path': project_dir,
+        'tasks': task_list,
+        'release_version': release_version,
+        'exitval': exitval,
+        'seconds': round(time.time() - start_time, 3),
+    }
+
+
+def _load_batch_manifest_or_die(manifest_path):
+    yaml = config.import_yaml()
+    try:
+        with open(manifest_path) as manifest_file:
+            manifest = yaml.safe_load(manifest_file)
+    except (IOError, yaml.YAMLError) as e:
+        logger.error('could not load batch manifest: ' + str(e))
+        raise SystemExit(1)
+    if not isinstance(manifest, dict) or not funcy.is_list(manifest.get('projects')):
+        logger.error('batch manifest must define a list of projects')
+        raise SystemExit(1)
+    for entry in manifest['projects']:
+        if not isinstance(entry, dict) or 'path' not in entry or 'tasks' not in entry:
+            logger.error('every project in a batch manifest needs a path and tasks')
+            raise SystemExit(1)
+        if not isinstance(entry['path'], six.string_types):
+            logger.error('batch manifest path must be a string: {!r}'.format(entry['path']))
+            raise SystemExit(1)
+        if not funcy.is_list(entry['tasks']):
+            logger.error('tasks for {} must be a list, not {!r}'.format(
+                entry['path'], entry['tasks']
+            ))
+            raise SystemExit(1)
+        release_version = entry.get('release_version')
+        if release_version is not None and not isinstance(release_version, six.string_types):
+            logger.error('release_version for {} must be a string (quote it): {!r}'.format(
+                entry['path'], release_version
+            ))
+            raise SystemExit(1)
+        for task in entry['tasks']:
+            if task not in ORDERED_TASKS:
+                logger.error('received invalid task for {}: {}'.format(entry['path'], task))
+                raise SystemExit(1)
+    return manifest
+
+
+def run_batch(manifest_path, args):
+    """ Run the tasks for every project in a batch manifest and print a json summary """
+    manifest = _load_batch_manifest_or_die(manifest_path)
+    project_root = os.path.dirname(os.path.abspath(manifest_path))
+    # parse the user-level config once, so that forked workers inherit it
+    _get_config_or_die(calling_task='batch')
+    jobs = int(args['--jobs'] or jobpool.available_cpus())
+    entries = manifest['projects']
+    logger.info('running {} projects, {} at a time'.format(len(entries), jobs))
+    start_time = time.time()
+    results = _run_in_pool(jobs, [
+        (_run_batch_project, (
+            entry['path'], project_root, list(entry['tasks']),
+            entry.get('release_version'), dict(args)
+        ))
+        for entry in entries
+    ]) if entries else []
+    _write_metrics_file(
+        args, [os.path.join(project_root, entry['path']) for entry in entries], start_time,
+        root=project_root
+    )
+    failed = [r for r in results if r['exitval']]
+    print(json.dumps({
+        'projects': results,
+        'succeeded': len(results) - len(failed),
+        'failed': len(failed),
+    }, indent=2, sort_keys=True))
+    return 1 if failed else 0
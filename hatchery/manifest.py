@@ -0,0 +1,264 @@
+""" The files a project needs in its workdir (to be tested and packaged), for syncing only
+those instead of the whole project directory
+
+That is every file git knows about (tracked, or untracked and neither ignored nor in one of
+ALWAYS_EXCLUDED_DIRS) plus whatever packaging asks for on top of that (MANIFEST.in entries and
+package_data), which may include generated files git ignores.  Outside of a git checkout,
+everything but .gitignore'd files and ALWAYS_EXCLUDED_DIRS is used instead.
+"""
+
+import os
+import re
+import glob
+import fnmatch
+import logging
+from . import helpers
+from . import metrics
+from . import snapshot
+from . import vcs
+
+logger = logging.getLogger(__name__)
+
+# never synced (unless packaging explicitly asks for files in them)
+ALWAYS_EXCLUDED_DIRS = [
+    '.git', '.hg', '.svn', '.tox', '.nox', '.venv', 'venv', '.eggs', '__pycache__',
+    '.pytest_cache', 'build', 'dist', '.hatchery.work*'
+]
+# synced whenever they exist, even if git doesn't know about them
+PACKAGING_FILES = [
+    'setup.py', 'setup.cfg', 'pyproject.toml', 'MANIFEST.in', '.hatchery.yml', '.hatchery.yaml'
+]
+
+
+def _glob_to_regex(pattern):
+    """ Translate a gitignore glob (without the leading / or trailing /) into a regex
+
+    >>> _glob_to_regex('*.py[co]')
+    '[^/]*\\\\.py[co]'
+    >>> _glob_to_regex('docs/**/build')
+    'docs/(?:.*/)?build'
+    """
+    ret = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            ret.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('**', i):
+            ret.append('.*')
+            i += 2
+        elif pattern[i] == '*':
+            ret.append('[^/]*')
+            i += 1
+        elif pattern[i] == '?':
+            ret.append('[^/]')
+            i += 1
+        elif pattern[i] == '[' and ']' in pattern[i + 1:]:
+            end = pattern.index(']', i + 1)
+            ret.append('[' + pattern[i + 1:end].replace('!', '^', 1) + ']')
+            i = end + 1
+        elif pattern[i] == '\\' and i + 1 < len(pattern):
+            ret.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            ret.append(re.escape(pattern[i]))
+            i += 1
+    return ''.join(ret)
+
+
+class GitignoreMatcher(object):
+    """ Matches paths (relative to the project root, / separated) against .gitignore entries
+
+    Each run of consecutive entries of the same kind (negated or not, directory-only or not) is
+    compiled into a single regex, and the last run with a match wins like the last matching
+    entry does for git.  Results for directories are remembered, since every path under an
+    ignored directory is ignored too
+    """
+
+    def __init__(self, lines):
+        self._rules = []
+        for line in lines:
+            line = line.rstrip('\n').rstrip()
+            if not line or line.startswith('#'):
+                continue
+            negated = line.startswith('!')
+            if negated:
+                line = line[1:]
+            dir_only = line.endswith('/')
+            line = line.rstrip('/')
+            # entries with a / (other than a trailing one) are relative to the root
+            anchored = '/' in line
+            regex = _glob_to_regex(line.lstrip('/'))
+            if not anchored:
+                regex = '(?:.*/)?' + regex
+            self._rules.append((negated, dir_only, regex))
+        # consecutive rules with the same (negated, dir_only) are merged into one regex
+        self._compiled = []
+        for negated, dir_only, regex in self._rules:
+            if self._compiled and self._compiled[-1][:2] == (negated, dir_only):
+                self._compiled[-1][2].append(regex)
+            else:
+                self._compiled.append((negated, dir_only, [regex]))
+        self._compiled = [
+            (negated, dir_only, re.compile('(?:{})$'.format('|'.join(regexes))))
+            for negated, dir_only, regexes in self._compiled
+        ]
+        self._dir_results = {}
+
+    @classmethod
+    def from_file(cls, gitignore_path):
+        if not os.path.isfile(gitignore_path):
+            return cls([])
+        with open(gitignore_path) as gitignore:
+            return cls(gitignore.readlines())
+
+    def _matches(self, rel_path, is_dir):
+        for negated, dir_only, regex in reversed(self._compiled):
+            if dir_only and not is_dir:
+                continue
+            if regex.match(rel_path):
+                return not negated
+        return False
+
+    def is_ignored(self, rel_path, is_dir=False):
+        parent = rel_path.rsplit('/', 1)[0] if '/' in rel_path else None
+        if parent is not None and self.is_ignored(parent, is_dir=True):
+            return True
+        if not is_dir:
+            return self._matches(rel_path, False)
+        if rel_path not in self._dir_results:
+            self._dir_results[rel_path] = self._matches(rel_path, True)
+        return self._dir_results[rel_path]
+
+
+def _is_always_excluded(dir_name):
+    return any(fnmatch.fnmatch(dir_name, p) for p in ALWAYS_EXCLUDED_DIRS)
+
+
+def _walk_files(root, rel_dir, matcher):
+    """ Get the paths (relative to root) of the files under root/rel_dir, skipping ignored ones
+    and ALWAYS_EXCLUDED_DIRS
+    """
+    ret = []
+    for dir_path, dir_names, file_names in os.walk(os.path.join(root, rel_dir)):
+        rel_dir_path = os.path.relpath(dir_path, root).replace(os.sep, '/')
+        prefix = '' if rel_dir_path == os.curdir else rel_dir_path + '/'
+        dir_names[:] = [
+            d for d in dir_names
+            if not _is_always_excluded(d) and not matcher.is_ignored(prefix + d, is_dir=True)
+        ]
+        ret += [prefix + f for f in file_names if not matcher.is_ignored(prefix + f)]
+    return ret
+
+
+def _manifest_in_files(root, matcher):
+    """ Get the files the include, recursive-include, global-include and graft commands in
+    MANIFEST.in ask for (leaving out the files excluded by .gitignore when a whole directory
+    is included)
+
+    Exclusions are not applied, since syncing more files than the build uses is harmless
+    """
+    manifest_path = os.path.join(root, 'MANIFEST.in')
+    if not os.path.isfile(manifest_path):
+        return []
+    ret = []
+    with open(manifest_path) as manifest_in:
+        for line in manifest_in:
+            words = line.split()
+            if not words or words[0].startswith('#'):
+                continue
+            command, arguments = words[0], words[1:]
+            if command == 'include':
+                for pattern in arguments:
+                    ret += [
+                        os.path.relpath(p, root).replace(os.sep, '/')
+                        for p in glob.glob(os.path.join(root, pattern)) if os.path.isfile(p)
+                    ]
+            elif command in ('recursive-include', 'global-include', 'graft'):
+                if command == 'global-include':
+                    rel_dir, patterns = '', arguments
+                else:
+                    rel_dir, patterns = arguments[0].strip('/'), arguments[1:] or ['*']
+                if not os.path.isdir(os.path.join(root, rel_dir)):
+                    continue
+                ret += [
+                    p for p in _walk_files(root, rel_dir, matcher)
+                    if any(fnmatch.fnmatch(p.rsplit('/', 1)[-1], pat) for pat in patterns)
+                ]
+    return ret
+
+
+def _package_data_files(root, package_dirs):
+    """ Get the files matched by setup.py's package_data, raises ValueError if it isn't a
+    literal
+    """
+    setup_py_path = os.path.join(root, 'setup.py')
+    if not os.path.isfile(setup_py_path):
+        return []
+    with open(setup_py_path) as setup_py:
+        package_data = helpers.literal_argument_in_function(
+            'package_data', 'setup', setup_py.read(), default={}
+        )
+    ret = []
+    for package_name, patterns in package_data.items():
+        if package_name:
+            rel_dirs = [package_name.replace('.', '/')]
+        else:
+            # applies to every package
+            rel_dirs = package_dirs
+        for rel_dir in rel_dirs:
+            for pattern in patterns:
+                ret += [
+                    os.path.relpath(p, root).replace(os.sep, '/')
+                    for p in glob.glob(os.path.join(root, rel_dir, pattern)) if os.path.isfile(p)
+                ]
+    return ret
+
+
+def get_sync_paths(root='.'):
+    """ Get the paths (relative to root, / separated) of the files the project in root needs
+    in its workdir, or None if they can't be worked out (and the whole project should be
+    synced instead)
+    """
+    matcher = GitignoreMatcher.from_file(os.path.join(root, '.gitignore'))
+    try:
+        rel_paths = set(vcs.list_files(root))
+        rel_paths.update(
+            p for p in vcs.list_files(root, untracked=True)
+            if not any(_is_always_excluded(d) for d in p.split('/')[:-1])
+        )
+    except vcs.VcsError as e:
+        logger.debug('not using git to list files: ' + str(e))
+        rel_paths = set(_walk_files(root, '', matcher))
+    package_dirs = sorted(set(
+        p.rsplit('/', 1)[0] for p in rel_paths if p.endswith('/__init__.py')
+    ))
+    try:
+        rel_paths.update(_package_data_files(root, package_dirs))
+    except (ValueError, SyntaxError) as e:
+        logger.warning('could not read package_data from setup.py, syncing all files: ' + str(e))
+        return None
+    rel_paths.update(_manifest_in_files(root, matcher))
+    rel_paths.update(p for p in PACKAGING_FILES if os.path.isfile(os.path.join(root, p)))
+    return sorted(rel_paths)
+
+
+def sync(source_dir, target_dir, rel_paths):
+    """ Copy the files in rel_paths from source_dir to target_dir, if they are newer than the
+    copy in target_dir (like workdir.sync(), so that changes made by earlier tasks survive)
+
+    Returns the number of files copied (counting the bytes copied in the bytes_synced metric)
+    """
+    logger.info('syncing {} files from {} to {}'.format(len(rel_paths), source_dir, target_dir))
+    changed_count = 0
+    for rel_path in rel_paths:
+        source_path = os.path.join(source_dir, rel_path)
+        target_path = os.path.join(target_dir, rel_path)
+        if snapshot.is_up_to_date(source_path, target_path):
+            continue
+        if not os.path.isdir(os.path.dirname(target_path)):
+            os.makedirs(os.path.dirname(target_path))
+        snapshot.replace_file(source_path, target_path)
+        metrics.add('bytes_synced', os.path.getsize(target_path))
+        changed_count += 1
+    return changed_count
@@ -0,0 +1,326 @@
+""" Pure-python conversion of the commonly used subset of markdown into reStructuredText
+
+Supported: ATX and setext headings, paragraphs, bullet and numbered lists (including nested
+and lazily continued items), fenced and indented code blocks, horizontal rules, and inline
+code, emphasis, links, autolinks, images and badges (linked images).
+
+Anything else (tables, html, block quotes, reference-style links, ...) raises
+UnsupportedMarkdown so that the caller can fall back to a full converter like pandoc.
+"""
+
+import re
+
+HEADING_CHARS = ['=', '-', '~', '^', '"', "'"]
+
+ATX_HEADING_REGEX = re.compile(r'^(?P<level>#{1,6})\s+(?P<text>.*?)(?:\s+#+)?\s*$')
+SETEXT_UNDERLINE_REGEX = re.compile(r'^(?P<char>=|-)(?P=char)*\s*$')
+FENCE_REGEX = re.compile(r'^(?P<indent>\s*)(?P<fence>`{3,}|~{3,})\s*(?P<lang>[\w+-]*)\s*$')
+HR_REGEX = re.compile(r'^\s{0,3}(?:(?:\*\s*){3,}|(?:-\s*){3,}|(?:_\s*){3,})$')
+LIST_ITEM_REGEX = re.compile(
+    r'^(?P<indent>\s*)(?:(?P<bullet>[*+-])|(?P<number>\d+)[.)])\s+(?P<text>.*)$'
+)
+TABLE_SEPARATOR_REGEX = re.compile(r'^\s*\|?\s*:?-+:?\s*(?:\|\s*:?-+:?\s*)+\|?\s*$')
+UNSUPPORTED_BLOCK_REGEXES = [
+    (re.compile(r'^\s{0,3}>'), 'block quote'),
+    (re.compile(r'^\s{0,3}<(?:[A-Za-z/]|!--)'), 'html block'),
+    (re.compile(r'^\s{0,3}\[[^\]]+\]:\s'), 'reference-style link definition'),
+]
+
+INLINE_REGEX = re.compile(r'''
+    (?P<code_delim>`+)(?P<code_text>.+?)(?P=code_delim)(?!`)
+  | \[!\[(?P<badge_alt>[^\]]*)\]\((?P<badge_src>[^)\s]+)\)\]\((?P<badge_href>[^)\s]+)\)
+  | !\[(?P<image_alt>[^\]]*)\]\((?P<image_src>[^)\s]+)\)
+  | \[(?P<link_text>[^\]]+)\]\((?P<link_href>[^)\s]+)\)
+  | <(?P<autolink>(?:https?|ftp|mailto):[^>\s]+)>
+  | \*\*(?P<strong_text>[^\s*](?:.*?[^\s*])?)\*\*
+  | (?<!\w)__(?P<ustrong_text>[^\s_](?:.*?[^\s_])?)__(?!\w)
+  | \*(?P<em_text>[^\s*](?:.*?[^\s*])?)\*
+  | (?<!\w)_(?P<uem_text>[^\s_](?:.*?[^\s_])?)_(?!\w)
+  | \\(?P<escaped>[^\w\s])
+''', re.VERBOSE | re.DOTALL)
+
+# characters which may surround inline markup without an escaped space in between
+MARKUP_START_PRECEDERS = ' \t\n-:/\'"<([{'
+MARKUP_END_FOLLOWERS = ' \t\n-.,:;!?\\/\'")]}>'
+
+
+class UnsupportedMarkdown(ValueError):
+    pass
+
+
+def _escape_text(text):
+    """ Escape plain text so that nothing in it is picked up as rst markup """
+    if re.search(r'<(?:[A-Za-z/]|!--)', text):
+        raise UnsupportedMarkdown('inline html: ' + text)
+    if '[' in text and re.search(r'\[[^\]]*\]\s*[\[(]', text):
+        raise UnsupportedMarkdown('link syntax that could not be parsed: ' + text)
+    text = text.replace('\\', '\\\\')
+    for char in ('*', '`', '|'):
+        text = text.replace(char, '\\' + char)
+    # a trailing underscore would turn a word into a reference
+    return re.sub(r'(?<=\w)_(?=\W|$)', r'\\_', text)
+
+
+class _Substitutions(object):
+    """ Collect the image substitution definitions that have to go at the end of a document """
+
+    def __init__(self):
+        self.definitions = []
+        self.names = {}
+
+    def add(self, alt, src, href=None):
+        if '|' in alt or '`' in alt:
+            raise UnsupportedMarkdown('image alt text with markup: ' + alt)
+        name = alt.strip() or 'image'
+        key = (src, href)
+        candidate, i = name, 1
+        while candidate in self.names and self.names[candidate] != key:
+            i += 1
+            candidate = '{} {}'.format(name, i)
+        if candidate not in self.names:
+            self.names[candidate] = key
+            definition = ['.. |{}| image:: {}'.format(candidate, src)]
+            if href:
+                definition.append('   :target: {}'.format(href))
+            self.definitions.append('\n'.join(definition))
+        return '|{}|'.format(candidate)
+
+
+def _convert_inline(text, substitutions):
+    """ Convert inline markdown markup in text into its rst equivalent """
+    ret = []
+    position = 0
+    for match in INLINE_REGEX.finditer(text):
+        ret.append(_escape_text(text[position:match.start()]))
+        position = match.end()
+        groups = match.groupdict()
+        if groups['escaped'] is not None:
+            ret.append(_escape_text(groups['escaped']))
+            continue
+        if groups['code_text'] is not None:
+            code_text = groups['code_text'].strip()
+            if '``' in code_text or not code_text:
+                raise UnsupportedMarkdown('inline code with backticks: ' + match.group(0))
+            markup = '``{}``'.format(code_text)
+        elif groups['badge_src'] is not None:
+            markup = substitutions.add(
+                groups['badge_alt'], groups['badge_src'], groups['badge_href']
+            )
+        elif groups['image_src'] is not None:
+            markup = substitutions.add(groups['image_alt'], groups['image_src'])
+        elif groups['link_href'] is not None:
+            link_text = groups['link_text']
+            if re.search(r'[`*_\\<>]', link_text):
+                raise UnsupportedMarkdown('link text with markup: ' + link_text)
+            if link_text == groups['link_href']:
+                markup = link_text
+            else:
+                markup = '`{} <{}>`__'.format(link_text, groups['link_href'])
+        elif groups['autolink'] is not None:
+            ret.append(groups['autolink'])
+            continue
+        elif groups['strong_text'] is not None or groups['ustrong_text'] is not None:
+            strong_text = groups['strong_text'] or groups['ustrong_text']
+            markup = '**{}**'.format(_convert_nested(strong_text))
+        else:
+            em_text = groups['em_text'] or groups['uem_text']
+            markup = '*{}*'.format(_convert_nested(em_text))
+        if match.start() > 0 and text[match.start() - 1] not in MARKUP_START_PRECEDERS:
+            ret.append('\\ ')
+        ret.append(markup)
+        if match.end() < len(text) and text[match.end()] not in MARKUP_END_FOLLOWERS:
+            ret.append('\\ ')
+    ret.append(_escape_text(text[position:]))
+    return ''.join(ret)
+
+
+def _convert_nested(text):
+    """ rst can't nest inline markup, so emphasized text has to be plain """
+    if INLINE_REGEX.search(text):
+        raise UnsupportedMarkdown('nested inline markup: ' + text)
+    return _escape_text(text)
+
+
+def _check_supported(line, next_line):
+    for regex, description in UNSUPPORTED_BLOCK_REGEXES:
+        if regex.match(line):
+            raise UnsupportedMarkdown('{}: {}'.format(description, line))
+    if '|' in line and next_line is not None and TABLE_SEPARATOR_REGEX.match(next_line):
+        raise UnsupportedMarkdown('table: ' + line)
+
+
+def _heading(text, level, substitutions):
+    text = _convert_inline(text.strip(), substitutions)
+    return '\n'.join((text, HEADING_CHARS[level - 1] * max(len(text), 1)))
+
+
+def _code_block(lines, lang=''):
+    while lines and not lines[-1].strip():
+        lines = lines[:-1]
+    if not lines:
+        raise UnsupportedMarkdown('empty code block')
+    header = '.. code:: ' + lang if lang else '::'
+    body = ['    ' + line if line.strip() else '' for line in lines]
+    return '\n'.join([header, ''] + body)
+
+
+class _ListItem(object):
+
+    def __init__(self, indent, number, text):
+        self.indent = indent
+        self.number = number
+        self.lines = [text]
+        self.children = []
+
+
+def _render_list(items, substitutions, indent=''):
+    ret = []
+    start = items[0].number
+    for i, item in enumerate(items):
+        marker = '*' if start is None else '{}.'.format(start + i)
+        text = _convert_inline('\n'.join(item.lines), substitutions)
+        item_indent = indent + ' ' * (len(marker) + 1)
+        text_lines = text.split('\n')
+        ret.append(indent + marker + ' ' + text_lines[0])
+        ret += [item_indent + line for line in text_lines[1:]]
+        if item.children:
+            ret.append('')
+            ret += _render_list(item.children, substitutions, item_indent)
+            if i < len(items) - 1:
+                ret.append('')
+    return ret
+
+
+def _parse_list(lines, i):
+    """ Consume a (possibly nested) list starting at lines[i], return (items, next index) """
+    root = []
+    # stack of (indent, list of sibling items)
+    stack = [(None, root)]
+    last_item = None
+    while i < len(lines):
+        line = lines[i]
+        match = LIST_ITEM_REGEX.match(line)
+        if not line.strip():
+            # a blank line ends the list unless another item follows
+            j = i + 1
+            while j < len(lines) and not lines[j].strip():
+                j += 1
+            if j < len(lines) and LIST_ITEM_REGEX.match(lines[j]):
+                i = j
+                continue
+            if j < len(lines) and lines[j].startswith((' ', '\t')):
+                raise UnsupportedMarkdown('multi-paragraph list item: ' + lines[j])
+            return root, i
+        if match:
+            indent = len(match.group('indent').expandtabs(4))
+            number = match.group('number')
+            item = _ListItem(indent, int(number) if number else None, match.group('text'))
+            while len(stack) > 1 and indent < stack[-1][0]:
+                stack.pop()
+            if stack[-1][0] is None:
+                stack[-1] = (indent, root)
+                root.append(item)
+            elif indent > stack[-1][0]:
+                stack[-1][1][-1].children.append(item)
+                stack.append((indent, stack[-1][1][-1].children))
+            elif (item.number is None) != (stack[-1][1][0].number is None):
+                # switching between bullets and numbers starts a new list
+                if len(stack) > 1:
+                    raise UnsupportedMarkdown('mixed list types: ' + line)
+                return root, i
+            else:
+                stack[-1][1].append(item)
+            last_item = item
+        else:
+            if FENCE_REGEX.match(line) or ATX_HEADING_REGEX.match(line) or HR_REGEX.match(line):
+                raise UnsupportedMarkdown('block inside of list item: ' + line)
+            _check_supported(line, None)
+            last_item.lines.append(line.strip())
+        i += 1
+    return root, i
+
+
+def convert(md_content):
+    """ Convert a markdown string into reStructuredText
+
+    >>> print(convert('# title' + chr(10) + chr(10) + 'some `code`'))
+    title
+    =====
+    <BLANKLINE>
+    some ``code``
+    <BLANKLINE>
+    """
+    lines = md_content.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    substitutions = _Substitutions()
+    blocks = []
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        next_line = lines[i + 1] if i + 1 < len(lines) else None
+        if not line.strip():
+            i += 1
+            continue
+        _check_supported(line, next_line)
+        fence_match = FENCE_REGEX.match(line)
+        heading_match = ATX_HEADING_REGEX.match(line)
+        if fence_match:
+            fence = fence_match.group('fence')
+            j = i + 1
+            while j < len(lines) and not lines[j].strip().startswith(fence):
+                j += 1
+            if j == len(lines):
+                raise UnsupportedMarkdown('unterminated code fence: ' + line)
+            indent = len(fence_match.group('indent'))
+            code_lines = [code_line[indent:] if code_line[:indent].strip() == '' else code_line
+                          for code_line in lines[i + 1:j]]
+            blocks.append(_code_block(code_lines, fence_match.group('lang')))
+            i = j + 1
+        elif heading_match:
+            level = len(heading_match.group('level'))
+            blocks.append(_heading(heading_match.group('text'), level, substitutions))
+            i += 1
+        elif HR_REGEX.match(line):
+            blocks.append(None)
+            i += 1
+        elif LIST_ITEM_REGEX.match(line):
+            items, i = _parse_list(lines, i)
+            blocks.append('\n'.join(_render_list(items, substitutions)))
+        elif line.startswith(('    ', '\t')):
+            j = i
+            code_lines = []
+            while j < len(lines) and (not lines[j].strip() or lines[j].startswith(('    ', '\t'))):
+                code_lines.append(lines[j].expandtabs(4)[4:])
+                j += 1
+            blocks.append(_code_block(code_lines))
+            i = j
+        else:
+            paragraph = []
+            while i < len(lines) and lines[i].strip():
+                if paragraph and SETEXT_UNDERLINE_REGEX.match(lines[i]):
+                    break
+                if paragraph and (FENCE_REGEX.match(lines[i]) or
+                                  ATX_HEADING_REGEX.match(lines[i]) or
+                                  HR_REGEX.match(lines[i]) or
+                                  LIST_ITEM_REGEX.match(lines[i])):
+                    break
+                _check_supported(lines[i], lines[i + 1] if i + 1 < len(lines) else None)
+                paragraph.append(lines[i].strip())
+                i += 1
+            text = '\n'.join(paragraph)
+            if i < len(lines) and SETEXT_UNDERLINE_REGEX.match(lines[i]):
+                level = 1 if lines[i].strip().startswith('=') else 2
+                blocks.append(_heading(text.replace('\n', ' '), level, substitutions))
+                i += 1
+            else:
+                text = _convert_inline(text, substitutions)
+                if re.match(r'\.\.\s|[-+*]\s|\d+[.)]\s', text):
+                    text = '\\' + text
+                blocks.append(text)
+    # transitions are not allowed at the beginning or end of a document
+    while blocks and blocks[0] is None:
+        blocks.pop(0)
+    while blocks and blocks[-1] is None:
+        blocks.pop()
+    blocks = ['-' * 4 if block is None else block for block in blocks]
+    blocks += substitutions.definitions
+    return '\n\n'.join(blocks) + '\n'
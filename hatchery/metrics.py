@@ -0,0 +1,71 @@
+""" Timings and counters collected over the course of a run
+
+Everything is kept in memory for the current process (and reset between the projects a
+worker process runs), for history and the metrics file to pick up once the run is over.
+"""
+
+import time
+import threading
+import contextlib
+
+TASK = 'task'
+COMMAND = 'command'
+HTTP = 'http'
+SYNC = 'sync'
+
+_lock = threading.Lock()
+_timings = []
+_counters = {}
+
+
+class Timing(object):
+    """ How long one stage (of kind, called name) of a run took """
+
+    def __init__(self, kind, name, seconds, exitval=None):
+        self.kind = kind
+        self.name = name
+        self.seconds = seconds
+        self.exitval = exitval
+
+
+def reset():
+    with _lock:
+        del _timings[:]
+        _counters.clear()
+
+
+def record(kind, name, seconds, exitval=None):
+    with _lock:
+        _timings.append(Timing(kind, name, seconds, exitval))
+
+
+@contextlib.contextmanager
+def timed(kind, name):
+    """ Record how long the block takes, with an exitval of 1 if it raises (0 otherwise) """
+    start_time = time.time()
+    exitval = 1
+    try:
+        yield
+        exitval = 0
+    finally:
+        record(kind, name, time.time() - start_time, exitval)
+
+
+def add(name, value=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def cache_lookup(cache_name, hit):
+    """ Count a hit (or miss) for one of hatchery's caches """
+    add('cache_{}.{}'.format('hits' if hit else 'misses', cache_name))
+
+
+def get_timings():
+    with _lock:
+        return list(_timings)
+
+
+def get_counters():
+    with _lock:
+        return dict(_counters)
@@ -1,11 +1,22 @@
-import setuptools
 import os
+import time
+import random
+import glob
+import hashlib
+import threading
+import collections
+import email.parser
 import requests
 import logging
 import microcache
 import pypandoc
 import funcy
+from six.moves import queue
 from . import helpers
+from . import history
+from . import localindex
+from . import metrics
+from . import md2rst
 
 # packaging got moved into its own top-level package in recent python versions
 try:
@@ -21,8 +32,206 @@ class ProjectError(RuntimeError):
     pass
 
 
-def get_package_name():
-    packages = setuptools.find_packages()
+_session = None
+_session_pid = None
+
+
+def _get_session():
+    """ Get the requests session (and its connection pool) shared by all index queries made by
+    this process
+    """
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        _session = requests.Session()
+        _session_pid = os.getpid()
+    return _session
+
+
+# seconds to wait for a connection to the index, and then for each read from it
+INDEX_TIMEOUTS = (5, 30)
+# times a query is retried after a connection error, timeout or 5xx response, waiting a random
+# fraction (full jitter) of INDEX_BACKOFF_SECONDS * 2 ** attempt (at most INDEX_BACKOFF_MAX)
+INDEX_RETRIES = 3
+INDEX_BACKOFF_SECONDS = 0.5
+INDEX_BACKOFF_MAX = 8
+# with hedging, a query which hasn't been answered by the p95 of the latest INDEX_LATENCY_SAMPLES
+# (or INDEX_HEDGE_DEFAULT_DELAY, until there are INDEX_HEDGE_MIN_SAMPLES) is sent again, over
+# another connection, and whichever answer comes back first is used
+INDEX_LATENCY_SAMPLES = 100
+INDEX_HEDGE_MIN_SAMPLES = 5
+INDEX_HEDGE_DEFAULT_DELAY = 1.0
+index_options = {'hedge_requests': False}
+_index_latencies = {}
+_index_latencies_lock = threading.Lock()
+
+
+def configure_index_queries(hedge_requests=False):
+    """ Set whether index queries are hedged """
+    index_options['hedge_requests'] = hedge_requests
+
+
+def _index_latency_samples(request_name):
+    """ Get the deque of recent latencies of request_name, seeded from the run history """
+    with _index_latencies_lock:
+        if request_name not in _index_latencies:
+            try:
+                seconds = history.get_recent_seconds(
+                    metrics.HTTP, request_name, INDEX_LATENCY_SAMPLES
+                )
+            except history.HistoryError:
+                seconds = []
+            _index_latencies[request_name] = collections.deque(
+                seconds, maxlen=INDEX_LATENCY_SAMPLES
+            )
+        return _index_latencies[request_name]
+
+
+def _hedge_delay(request_name):
+    samples = list(_index_latency_samples(request_name))
+    if len(samples) < INDEX_HEDGE_MIN_SAMPLES:
+        return INDEX_HEDGE_DEFAULT_DELAY
+    return history.percentile(samples, 95)
+
+
+def _hedged_get(url, requests_verify, delay):
+    """ GET url, sending the request again over a new connection if there is no response
+    within delay seconds, and return the first response (or raise the last error if both
+    requests fail)
+
+    Only slowness is hedged: if the first request fails before the delay, its error is raised
+    straight away (for _index_get to retry within its budget)
+    """
+    results = queue.Queue()
+
+    def fetch(session, close_session):
+        try:
+            results.put((session.get(url, verify=requests_verify, timeout=INDEX_TIMEOUTS), None))
+        except Exception as e:
+            results.put((None, e))
+        finally:
+            if close_session:
+                session.close()
+
+    def start(session, close_session=False):
+        thread = threading.Thread(target=fetch, args=(session, close_session))
+        # the slower request is abandoned rather than waited for
+        thread.daemon = True
+        thread.start()
+
+    start(_get_session())
+    try:
+        response, error = results.get(timeout=delay)
+    except queue.Empty:
+        pass
+    else:
+        if error is not None:
+            raise error
+        return response
+    logger.debug('no response from {} within {:.2f}s, hedging'.format(url, delay))
+    metrics.add('hedged_requests')
+    start(requests.Session(), close_session=True)
+    for _ in range(2):
+        response, error = results.get()
+        if error is None:
+            return response
+    raise error
+
+
+def _index_get(url, requests_verify, request_name):
+    """ GET url from an index with timeouts, retrying connection errors, timeouts and 5xx
+    responses with exponential backoff (and hedging the request, if that is configured)
+
+    Raises ProjectError if the index can't be queried
+    """
+    for attempt in range(INDEX_RETRIES + 1):
+        start_time = time.time()
+        try:
+            with metrics.timed(metrics.HTTP, request_name):
+                if index_options['hedge_requests']:
+                    response = _hedged_get(url, requests_verify, _hedge_delay(request_name))
+                else:
+                    response = _get_session().get(
+                        url, verify=requests_verify, timeout=INDEX_TIMEOUTS
+                    )
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = str(e)
+        else:
+            if index_options['hedge_requests']:
+                _index_latency_samples(request_name).append(time.time() - start_time)
+            if response.status_code < 500:
+                return response
+            error = 'status code {}'.format(response.status_code)
+        if attempt == INDEX_RETRIES:
+            raise ProjectError('could not query {} ({} attempts): {}'.format(
+                url, INDEX_RETRIES + 1, error
+            ))
+        backoff = random.uniform(0, min(INDEX_BACKOFF_SECONDS * 2 ** attempt, INDEX_BACKOFF_MAX))
+        logger.warning('querying {} failed ({}), retrying in {:.1f}s'.format(url, error, backoff))
+        metrics.add('index_retries')
+        time.sleep(backoff)
+
+
+_package_discovery_cache = {}
+
+
+def _mtime(path):
+    """ Get the most precise modification time available for path, or None if it is gone """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return getattr(stat, 'st_mtime_ns', stat.st_mtime)
+
+
+def _walk_packages(root, patterns):
+    """ Find all packages under root, only descending into directories which are packages
+
+    Returns a tuple of (packages, mtimes), where mtimes holds the modification time of every
+    path that was consulted along the way
+    """
+    packages = []
+    mtimes = {os.path.join(root, '.gitignore'): _mtime(os.path.join(root, '.gitignore'))}
+    pending = [(root, '')]
+    while pending:
+        dir_path, prefix = pending.pop()
+        mtimes[dir_path] = _mtime(dir_path)
+        for name in sorted(os.listdir(dir_path)):
+            rel_path = (prefix + name).replace('.', '/')
+            if helpers.pruned_from_package_discovery(name, rel_path, patterns):
+                continue
+            full_path = os.path.join(dir_path, name)
+            if not os.path.isdir(full_path):
+                continue
+            # adding an __init__.py to a directory later changes its mtime
+            mtimes[full_path] = _mtime(full_path)
+            if not os.path.isfile(os.path.join(full_path, '__init__.py')):
+                continue
+            packages.append(prefix + name)
+            pending.append((full_path, prefix + name + '.'))
+    return sorted(packages), mtimes
+
+
+def find_packages(root='.', exclude=()):
+    """ Pruned equivalent of setuptools.find_packages(root)
+
+    Skips directories which can't contain packages (see helpers.pruned_from_package_discovery,
+    plus the glob patterns in exclude), and memoizes the result until one of the directories it
+    looked at changes
+    """
+    root = os.path.abspath(root)
+    cache_key = (root, tuple(exclude))
+    if cache_key in _package_discovery_cache:
+        packages, mtimes = _package_discovery_cache[cache_key]
+        if all(_mtime(path) == mtime for path, mtime in mtimes.items()):
+            return list(packages)
+    patterns = helpers.gitignore_patterns(root) + [p.strip('/') for p in exclude]
+    packages, mtimes = _walk_packages(root, patterns)
+    _package_discovery_cache[cache_key] = (packages, mtimes)
+    return list(packages)
+
+
+def get_package_name(exclude=()):
+    packages = find_packages(exclude=exclude)
     build_package = None
     for package_name in packages:
         root_package = package_name.split('.')[0]
@@ -37,6 +246,18 @@ def get_package_name():
     return build_package
 
 
+def find_subprojects(patterns, root='.'):
+    """ Expand glob patterns into the sorted list of matching directories with a setup.py """
+    if not funcy.is_list(patterns):
+        patterns = [patterns]
+    ret = set()
+    for pattern in patterns:
+        for path in glob.glob(os.path.join(root, pattern)):
+            if os.path.isfile(os.path.join(path, 'setup.py')):
+                ret.add(os.path.normpath(os.path.relpath(path, root)))
+    return sorted(ret)
+
+
 def project_has_setup_py():
     """ Check to make sure setup.py exists in the project """
     return os.path.isfile('setup.py')
@@ -109,8 +330,8 @@ def set_version(package_name, version_str):
     version_file_path = helpers.package_file_path('_version.py', package_name)
     version_file_content = helpers.get_file_content(version_file_path)
     version_file_content = version_file_content.replace(current_version, version_str)
-    with open(version_file_path, 'w') as version_file:
-        version_file.write(version_file_content)
+    # replace rather than rewrite the file, so that nothing ever reads it half written
+    helpers.atomic_write(version_file_path, version_file_content)
 
 
 def version_is_valid(version_str):
@@ -131,7 +352,7 @@ def version_is_valid(version_str):
 def _get_uploaded_versions_warehouse(project_name, index_url, requests_verify=True):
     """ Query the pypi index at index_url using warehouse api to find all of the "releases" """
     url = '/'.join((index_url, project_name, 'json'))
-    response = requests.get(url, verify=requests_verify)
+    response = _index_get(url, requests_verify, 'index:warehouse')
     if response.status_code == 200:
         return response.json()['releases'].keys()
     return None
@@ -145,14 +366,25 @@ def _get_uploaded_versions_pypicloud(project_name, index_url, requests_verify=Tr
             api_url = api_url[:len(suffix) * -1] + '/api/package'
             break
     url = '/'.join((api_url, project_name))
-    response = requests.get(url, verify=requests_verify)
+    response = _index_get(url, requests_verify, 'index:pypicloud')
     if response.status_code == 200:
         return [p['version'] for p in response.json()['packages']]
     return None
 
 
+# set by _get_uploaded_versions whenever it actually runs, rather than being answered from
+# the microcache, so that _lookup_uploaded_versions can count cache hits
+_index_lookup = threading.local()
+
+
 @microcache.this
 def _get_uploaded_versions(project_name, index_url, requests_verify=True):
+    _index_lookup.computed = True
+    if localindex.is_local_index(index_url):
+        try:
+            return localindex.get_uploaded_versions(project_name, localindex.index_dir(index_url))
+        except localindex.LocalIndexError as e:
+            raise ProjectError(str(e))
     server_types = ('warehouse', 'pypicloud')
     for server_type in server_types:
         get_method = globals()['_get_uploaded_versions_' + server_type]
@@ -165,16 +397,24 @@ def _get_uploaded_versions(project_name, index_url, requests_verify=True):
     return []
 
 
+def _lookup_uploaded_versions(project_name, index_url, requests_verify):
+    """ _get_uploaded_versions(), counting whether its result was already cached """
+    _index_lookup.computed = False
+    versions = _get_uploaded_versions(project_name, index_url, requests_verify)
+    metrics.cache_lookup('index', not _index_lookup.computed)
+    return versions
+
+
 def version_already_uploaded(project_name, version_str, index_url, requests_verify=True):
     """ Check to see if the version specified has already been uploaded to the configured index
     """
-    all_versions = _get_uploaded_versions(project_name, index_url, requests_verify)
+    all_versions = _lookup_uploaded_versions(project_name, index_url, requests_verify)
     return version_str in all_versions
 
 
 def get_latest_uploaded_version(project_name, index_url, requests_verify=True):
     """ Grab the latest version of project_name according to index_url """
-    all_versions = _get_uploaded_versions(project_name, index_url, requests_verify)
+    all_versions = _lookup_uploaded_versions(project_name, index_url, requests_verify)
     ret = None
     for uploaded_version in all_versions:
         ret = ret or '0.0'
@@ -197,17 +437,146 @@ def version_is_latest(project_name, version_str, index_url, requests_verify=True
     return False
 
 
-def project_has_readme_md():
+# PKG-INFO fields which can appear more than once, by the (plural) name the index expects
+PKG_INFO_MULTIPLE_USE_FIELDS = {
+    'classifier': 'classifiers',
+    'platform': 'platform',
+    'supported_platform': 'supported_platform',
+    'requires_dist': 'requires_dist',
+    'requires_external': 'requires_external',
+    'provides_dist': 'provides_dist',
+    'obsoletes_dist': 'obsoletes_dist',
+    'project_url': 'project_urls',
+    'provides_extra': 'provides_extras',
+}
+
+
+def _unfold_description(value):
+    """ Undo the folding of an old-style Description header, whose continuation lines are
+    indented by 8 spaces (like pkginfo does)
+
+    >>> _unfold_description('line one\\n        line two\\n        \\n          indented')
+    'line one\\nline two\\n\\n  indented'
+    """
+    return '\n'.join(
+        line[8:] if line.startswith(' ' * 8) else line for line in value.strip().splitlines()
+    )
+
+
+def read_pkg_info(pkg_info_path):
+    """ Read the metadata in a PKG-INFO file into a dict of the form fields the index's
+    register api expects
+    """
+    with open(pkg_info_path) as pkg_info_file:
+        message = email.parser.Parser().parse(pkg_info_file)
+    ret = {}
+    for header in set(message.keys()):
+        field = header.lower().replace('-', '_')
+        values = message.get_all(header)
+        if field in PKG_INFO_MULTIPLE_USE_FIELDS:
+            ret[PKG_INFO_MULTIPLE_USE_FIELDS[field]] = values
+        elif field == 'description':
+            ret[field] = _unfold_description(values[0])
+        else:
+            ret[field] = values[0]
+    # newer metadata versions put the description in the body
+    if message.get_payload() and 'description' not in ret:
+        ret['description'] = message.get_payload()
+    return ret
+
+
+def register_metadata(metadata, index_url, username, password, requests_verify=True):
+    """ Register a project (and version) with the index at index_url from its metadata (as
+    read_pkg_info() returns it), without uploading any distribution
+
+    Raises ProjectError if username or password is missing, or if the index refuses
+    """
+    if not username or not password:
+        raise ProjectError('no {} to register with {}'.format(
+            'username' if not username else 'password', index_url
+        ))
+    data = dict(metadata, **{':action': 'submit', 'protocol_version': '1'})
+    try:
+        with metrics.timed(metrics.HTTP, 'index:register'):
+            response = _get_session().post(
+                index_url, data=data, auth=(username, password), verify=requests_verify,
+                timeout=INDEX_TIMEOUTS
+            )
+    except requests.RequestException as e:
+        raise ProjectError('could not register with {}: {}'.format(index_url, e))
+    if response.status_code >= 400:
+        raise ProjectError('{} refused the registration ({} {})'.format(
+            index_url, response.status_code, response.reason
+        ))
+
+
+def project_has_readme_md(project_dir='.'):
     """ See if project has a readme.md file """
-    for filename in os.listdir('.'):
+    for filename in os.listdir(project_dir):
         if filename.lower() == 'readme.md':
             return True
     return False
 
 
-def convert_readme_to_rst():
-    """ Attempt to convert a README.md file into README.rst """
-    project_files = os.listdir('.')
+def _find_executable(name):
+    try:
+        from shutil import which
+    except ImportError:
+        from distutils.spawn import find_executable as which
+    return which(name)
+
+
+def _pandoc_fingerprint():
+    """ Identify the pandoc binary pypandoc will use without launching it
+
+    The resolved path, size and mtime change whenever pandoc is upgraded, which makes this a
+    stricter cache key than the version string (that can only be had by running pandoc)
+    """
+    pandoc_path = os.environ.get('PYPANDOC_PANDOC') or _find_executable('pandoc')
+    if not pandoc_path:
+        return None
+    pandoc_path = os.path.realpath(pandoc_path)
+    try:
+        stat = os.stat(pandoc_path)
+    except OSError:
+        return None
+    return '{}:{}:{}'.format(pandoc_path, stat.st_size, stat.st_mtime)
+
+
+def _readme_cache_path(readme_content, pandoc_fingerprint):
+    cache_key = hashlib.sha256(readme_content)
+    cache_key.update(pandoc_fingerprint.encode('utf-8'))
+    return helpers.cache_file_path('readme', cache_key.hexdigest() + '.rst')
+
+
+def _convert_md_file_to_rst(filename):
+    """ Convert filename with the built-in converter, falling back to pandoc (reusing a cached
+    result for identical content) if the markdown uses constructs it doesn't handle
+    """
+    with open(filename, 'rb') as md_file:
+        readme_content = md_file.read()
+    try:
+        return md2rst.convert(readme_content.decode('utf-8'))
+    except (md2rst.UnsupportedMarkdown, UnicodeDecodeError) as e:
+        logger.debug('falling back to pandoc for rst conversion: ' + str(e))
+    pandoc_fingerprint = _pandoc_fingerprint()
+    cache_path = None
+    if pandoc_fingerprint is not None:
+        cache_path = _readme_cache_path(readme_content, pandoc_fingerprint)
+        hit = os.path.isfile(cache_path)
+        metrics.cache_lookup('readme', hit)
+        if hit:
+            logger.debug('using cached rst conversion: ' + cache_path)
+            return helpers.get_file_content(cache_path)
+    rst_content = pypandoc.convert(filename, 'rst')
+    if cache_path is not None:
+        helpers.atomic_write(cache_path, rst_content)
+    return rst_content
+
+
+def get_readme_rst(project_dir='.'):
+    """ Convert the README.md file in project_dir to rst and return the result """
+    project_files = os.listdir(project_dir)
     for filename in project_files:
         if filename.lower() == 'readme':
             raise ProjectError(
@@ -221,13 +590,9 @@ def convert_readme_to_rst():
             )
     for filename in project_files:
         if filename.lower() == 'readme.md':
-            rst_filename = 'README.rst'
-            logger.info('converting {} to {}'.format(filename, rst_filename))
+            logger.info('converting {} to {}'.format(filename, 'README.rst'))
             try:
-                rst_content = pypandoc.convert(filename, 'rst')
-                with open('README.rst', 'w') as rst_file:
-                    rst_file.write(rst_content)
-                return
+                return _convert_md_file_to_rst(os.path.join(project_dir, filename))
             except OSError as e:
                 raise ProjectError(
                     'could not convert readme to rst due to pypandoc error:' + os.linesep + str(e)
@@ -235,6 +600,15 @@ def convert_readme_to_rst():
     raise ProjectError('could not find any README.md file to convert')
 
 
+def write_readme_rst(rst_content):
+    helpers.atomic_write('README.rst', rst_content)
+
+
+def convert_readme_to_rst():
+    """ Attempt to convert a README.md file into README.rst """
+    write_readme_rst(get_readme_rst())
+
+
 def get_packaged_files(package_name):
     """ Collect relative paths to all files which have already been packaged """
     if not os.path.isdir('dist'):
@@ -0,0 +1,109 @@
+""" Run metrics in the Prometheus text exposition format (for node-exporter's textfile collector
+and the like), one set of samples per project run
+"""
+
+import os
+import collections
+from . import metrics
+
+METRIC_PREFIX = 'hatchery_'
+# counters which are exported as they are, by metric name
+COUNTER_METRICS = [
+    ('bytes_synced', 'synced_bytes', 'Bytes copied into the workdir (or its snapshot)'),
+    ('files_synced', 'synced_files', 'Files copied into or removed from the workdir'),
+    ('bytes_uploaded', 'uploaded_bytes', 'Bytes of packages uploaded to the index'),
+]
+# metric name and help text for the timings of each kind, and the label naming the stage
+TIMING_METRICS = {
+    metrics.TASK: ('task_duration_seconds', 'How long each task took', 'task'),
+    metrics.COMMAND: ('command_duration_seconds', 'How long each command took', 'command'),
+    metrics.HTTP: ('http_request_duration_seconds', 'How long index queries took', 'request'),
+    metrics.SYNC: ('sync_duration_seconds', 'How long syncing the workdir took', 'sync'),
+}
+
+
+def _escape(value):
+    """ Escape a label value (backslashes, double quotes and newlines) """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class _Exposition(object):
+    """ Samples grouped by metric, so that each metric's HELP and TYPE lines come once, before
+    all of its samples
+    """
+
+    def __init__(self):
+        self._families = collections.OrderedDict()
+
+    def add(self, name, help_text, labels, value):
+        family = self._families.setdefault(name, (help_text, []))
+        label_str = ','.join('{}="{}"'.format(k, _escape(v)) for k, v in sorted(labels.items()))
+        family[1].append('{}{}{{{}}} {!r}'.format(METRIC_PREFIX, name, label_str, float(value)))
+
+    def format(self):
+        lines = []
+        for name, (help_text, samples) in self._families.items():
+            lines.append('# HELP {}{} {}'.format(METRIC_PREFIX, name, help_text))
+            lines.append('# TYPE {}{} gauge'.format(METRIC_PREFIX, name))
+            lines += samples
+        return ''.join(line + '\n' for line in lines)
+
+
+def _project_label(project_dir, root):
+    """ Label a project by its path relative to root (the monorepo or batch root, where
+    directory names alone can clash), or by its directory name when there is no root
+    """
+    if root is None:
+        return os.path.basename(project_dir)
+    return os.path.relpath(project_dir, root).replace(os.sep, '/')
+
+
+def _add_run(exposition, run, root):
+    labels = {'project': _project_label(run['project'], root)}
+    exposition.add('run_timestamp_seconds', 'When the run started', labels, run['started'])
+    exposition.add('run_duration_seconds', 'How long the whole run took', labels, run['seconds'])
+    exposition.add('run_exit_code', 'Exit code of the run', labels, run['exitval'])
+    stages = collections.OrderedDict()
+    for timing in run['timings']:
+        # a stage which ran more than once adds up, keeping the last failure's exit code
+        stage = stages.setdefault((timing.kind, timing.name), {'seconds': 0, 'exitval': 0})
+        stage['seconds'] += timing.seconds
+        if timing.exitval:
+            stage['exitval'] = timing.exitval
+    for (kind, name), stage in sorted(stages.items()):
+        if kind not in TIMING_METRICS:
+            continue
+        metric_name, help_text, label_name = TIMING_METRICS[kind]
+        stage_labels = dict(labels, **{label_name: name})
+        exposition.add(metric_name, help_text, stage_labels, stage['seconds'])
+        if kind == metrics.COMMAND:
+            exposition.add(
+                'command_exit_code', 'Exit code of each command (the last failure of a '
+                'command which ran more than once)', stage_labels, stage['exitval']
+            )
+    counters = run['counters']
+    for counter_name, metric_name, help_text in COUNTER_METRICS:
+        exposition.add(metric_name, help_text, labels, counters.get(counter_name, 0))
+    cache_names = sorted(set(
+        name.split('.', 1)[1] for name in counters if name.startswith('cache_')
+    ))
+    for cache_name in cache_names:
+        cache_labels = dict(labels, cache=cache_name)
+        hits = counters.get('cache_hits.' + cache_name, 0)
+        misses = counters.get('cache_misses.' + cache_name, 0)
+        exposition.add('cache_hits', 'Lookups answered by each cache', cache_labels, hits)
+        exposition.add('cache_misses', 'Lookups each cache could not answer', cache_labels, misses)
+        exposition.add(
+            'cache_hit_ratio', 'Share of the lookups answered by each cache', cache_labels,
+            hits / float(hits + misses)
+        )
+
+
+def format_runs(runs, root=None):
+    """ Format runs (as returned by history.get_latest_run()) in the exposition format, with
+    projects labelled by their path relative to root if it is given
+    """
+    exposition = _Exposition()
+    for run in runs:
+        _add_run(exposition, run, root)
+    return exposition.format()
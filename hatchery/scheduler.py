@@ -0,0 +1,115 @@
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+
+class SchedulerError(RuntimeError):
+    pass
+
+
+class Step(object):
+    """ A unit of work in the dependency graph """
+
+    def __init__(self, name, func, requires):
+        self.name = name
+        self.func = func
+        self.requires = list(requires)
+        self.state = PENDING
+        self.error = None
+
+
+class Scheduler(object):
+    """ Run steps concurrently, each as soon as all of the steps it requires have succeeded
+
+    Once any step fails no new steps are started, steps which are already running are allowed
+    to finish, and everything else is marked as skipped.
+
+    >>> results = []
+    >>> s = Scheduler()
+    >>> s.add('a', lambda: results.append('a'))
+    >>> s.add('b', lambda: results.append('b'), requires=['a'])
+    >>> s.run()
+    []
+    >>> results
+    ['a', 'b']
+    """
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self.steps = []
+        self._condition = threading.Condition()
+
+    def get(self, name):
+        for step in self.steps:
+            if step.name == name:
+                return step
+        raise SchedulerError('no step named ' + name)
+
+    def add(self, name, func, requires=(), barrier=False):
+        """ Add a step which calls func with no arguments
+
+        If barrier is True, the step requires every step that was added before it, which is
+        how commit points (anything with side effects outside of the working directory) make
+        sure that all of their prerequisites succeeded
+        """
+        if name in [s.name for s in self.steps]:
+            raise SchedulerError('duplicate step name: ' + name)
+        requires = list(requires)
+        if barrier:
+            requires += [s.name for s in self.steps if s.name not in requires]
+        for required_name in requires:
+            self.get(required_name)
+        self.steps.append(Step(name, func, requires))
+
+    def _is_ready(self, step):
+        return step.state == PENDING and \
+            all(self.get(name).state == SUCCEEDED for name in step.requires)
+
+    def _run_step(self, step):
+        try:
+            step.func()
+        except BaseException as e:
+            with self._condition:
+                step.state = FAILED
+                step.error = e
+                self._condition.notify_all()
+            return
+        with self._condition:
+            step.state = SUCCEEDED
+            self._condition.notify_all()
+
+    def run(self):
+        """ Run all steps, return the list of steps which failed """
+        threads = []
+        with self._condition:
+            while True:
+                running = [s for s in self.steps if s.state == RUNNING]
+                if not any(s.state == FAILED for s in self.steps):
+                    for step in self.steps:
+                        if len(running) >= self.max_workers:
+                            break
+                        if self._is_ready(step):
+                            logger.debug('starting step: ' + step.name)
+                            step.state = RUNNING
+                            running.append(step)
+                            thread = threading.Thread(target=self._run_step, args=(step,))
+                            thread.daemon = True
+                            threads.append(thread)
+                            thread.start()
+                if not running:
+                    break
+                self._condition.wait()
+            for step in self.steps:
+                if step.state == PENDING:
+                    logger.debug('skipping step: ' + step.name)
+                    step.state = SKIPPED
+        for thread in threads:
+            thread.join()
+        return [s for s in self.steps if s.state == FAILED]
@@ -0,0 +1,158 @@
+""" Shared snapshot of a project which isolated working directories are seeded from
+
+Working directories are populated with copies of the snapshot's files (copy-on-write clones,
+on filesystems which support them), so that builds and tests writing to files in a working
+directory never change the snapshot or the other working directories.  The snapshot only
+ever replaces files (rather than writing to them) when the project changes.
+"""
+
+import os
+import sys
+import shutil
+import logging
+from . import helpers
+from . import metrics
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# linux ioctl making a copy-on-write clone of a file (on btrfs and xfs, for example)
+FICLONE = 0x40049409
+
+
+def _with_parent_dirs(rel_paths):
+    """ Yield the parent directories of rel_paths (parents first), then rel_paths themselves,
+    in the same form as helpers.walk_tree()
+    """
+    dirs = set()
+    for rel_path in rel_paths:
+        parts = rel_path.split('/')[:-1]
+        dirs.update('/'.join(parts[:i]) for i in range(1, len(parts) + 1))
+    for rel_dir in sorted(dirs):
+        yield rel_dir, True
+    for rel_path in rel_paths:
+        yield rel_path, False
+
+
+def _copy_file(source_path, target_path):
+    """ Copy source_path (and its mtime) to target_path, cloning it where the filesystem can """
+    if fcntl is not None and sys.platform.startswith('linux'):
+        try:
+            with open(source_path, 'rb') as source, open(target_path, 'wb') as target:
+                fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+            shutil.copystat(source_path, target_path)
+            return
+        except (IOError, OSError):
+            # the filesystem can't clone files (or not across filesystems)
+            pass
+    shutil.copy2(source_path, target_path)
+
+
+def replace_file(source_path, target_path):
+    """ Put a copy of source_path at target_path without writing to any file which was at
+    target_path already
+    """
+    temp_path = '{}.{}.tmp'.format(target_path, os.getpid())
+    _copy_file(source_path, temp_path)
+    os.rename(temp_path, target_path)
+
+
+def is_up_to_date(source_path, target_path):
+    """ Whether target_path exists and is at least as new as source_path, in which case syncing
+    leaves it alone (it may have been changed by an earlier task)
+    """
+    try:
+        return helpers.mtime_ns(os.stat(target_path)) >= helpers.mtime_ns(os.stat(source_path))
+    except OSError:
+        return False
+
+
+def _is_stale(source_path, target_path):
+    try:
+        target_stat = os.stat(target_path)
+    except OSError:
+        return True
+    source_stat = os.stat(source_path)
+    return source_stat.st_size != target_stat.st_size or \
+        helpers.mtime_ns(source_stat) != helpers.mtime_ns(target_stat)
+
+
+def refresh(source_dir, snapshot_dir, exclude_regexes=(), rel_paths=None):
+    """ Bring snapshot_dir up to date with source_dir (or just the files in rel_paths, if it is
+    set), only copying files which changed
+
+    Returns the number of files which were copied or removed (counting the bytes copied in
+    the bytes_synced metric)
+    """
+    changed_count = 0
+    seen = set()
+    if rel_paths is None:
+        entries = helpers.walk_tree(source_dir, exclude_regexes)
+    else:
+        entries = _with_parent_dirs(rel_paths)
+    for rel_path, is_dir in entries:
+        seen.add(rel_path)
+        target_path = os.path.join(snapshot_dir, rel_path)
+        if is_dir:
+            if os.path.isfile(target_path):
+                os.remove(target_path)
+            if not os.path.isdir(target_path):
+                os.makedirs(target_path)
+        elif _is_stale(os.path.join(source_dir, rel_path), target_path):
+            if os.path.isdir(target_path):
+                shutil.rmtree(target_path)
+            replace_file(os.path.join(source_dir, rel_path), target_path)
+            metrics.add('bytes_synced', os.path.getsize(target_path))
+            changed_count += 1
+    for rel_path, is_dir in sorted(helpers.walk_tree(snapshot_dir, ()), reverse=True):
+        if rel_path in seen:
+            continue
+        target_path = os.path.join(snapshot_dir, rel_path)
+        if is_dir:
+            shutil.rmtree(target_path, ignore_errors=True)
+        elif os.path.lexists(target_path):
+            os.remove(target_path)
+            changed_count += 1
+    logger.debug('refreshed {} files in {}'.format(changed_count, snapshot_dir))
+    return changed_count
+
+
+def seed(snapshot_dir, target_dir):
+    """ Populate target_dir with copies of the files in snapshot_dir
+
+    Like workdir.sync(), files in target_dir are only replaced if the snapshot's version is
+    newer (so changes made by earlier tasks in the run survive), and files which aren't in the
+    snapshot (such as build output) are left alone
+    """
+    for rel_path, is_dir in helpers.walk_tree(snapshot_dir, ()):
+        source_path = os.path.join(snapshot_dir, rel_path)
+        target_path = os.path.join(target_dir, rel_path)
+        if is_dir:
+            if not os.path.isdir(target_path):
+                os.makedirs(target_path)
+            continue
+        if is_up_to_date(source_path, target_path):
+            continue
+        if os.path.isdir(target_path):
+            shutil.rmtree(target_path)
+        replace_file(source_path, target_path)
+
+
+def sync(source_dir, snapshot_dir, target_dir, exclude_regexes=(), rel_paths=None):
+    """ Refresh the shared snapshot of source_dir (or just the files in rel_paths) and seed
+    target_dir from it, holding a lock so that concurrent runs don't refresh the snapshot at
+    the same time
+
+    Returns the number of files the snapshot refresh copied or removed
+    """
+    if not os.path.isdir(snapshot_dir):
+        os.makedirs(snapshot_dir)
+    logger.info('syncing {} to {} (via {})'.format(source_dir, target_dir, snapshot_dir))
+    with helpers.file_lock(snapshot_dir + '.lock'):
+        changed_count = refresh(source_dir, snapshot_dir, exclude_regexes, rel_paths)
+        seed(snapshot_dir, target_dir)
+    return changed_count
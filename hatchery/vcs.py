@@ -0,0 +1,132 @@
+import os
+import re
+import subprocess
+import logging
+import git
+import microcache
+
+# packaging got moved into its own top-level package in recent python versions
+try:
+    from pkg_resources.extern import packaging
+except ImportError:
+    import packaging
+
+logger = logging.getLogger(__name__)
+
+
+class VcsError(RuntimeError):
+    pass
+
+
+@microcache.this
+def _get_repo(repo_path):
+    return git.Repo(repo_path, search_parent_directories=True)
+
+
+def get_repo(repo_path=None):
+    """ Get a git.Repo handle for the repository containing repo_path (default: cwd), cached
+    so it is only built once
+    """
+    return _get_repo(os.path.abspath(repo_path or os.getcwd()))
+
+
+def _git_diff_is_quiet(repo_path, diff_args):
+    """ Run a `git diff --quiet` variant, which stops at the first difference it finds
+
+    Returns True if no differences were found, False if any were
+    """
+    env = dict(os.environ)
+    # read-only check, don't let git take the index lock to refresh stat info
+    env['GIT_OPTIONAL_LOCKS'] = '0'
+    cmd_args = ['git', 'diff', '--quiet', '--no-ext-diff', '--no-renames'] + list(diff_args)
+    with open(os.devnull, 'w') as devnull:
+        exitval = subprocess.call(
+            cmd_args, cwd=repo_path, env=env, stdout=devnull, stderr=devnull
+        )
+    if exitval not in (0, 1):
+        raise VcsError('`{}` returned error code {}'.format(' '.join(cmd_args), exitval))
+    return exitval == 0
+
+
+def working_copy_is_dirty(repo_path=None):
+    """ Fast equivalent of git.Repo.is_dirty() (index and working tree, no untracked files)
+
+    Each check exits on the first dirty entry rather than collecting the full status, and
+    honors the repository's core.fsmonitor/core.untrackedCache settings
+    """
+    repo_path = os.path.abspath(repo_path or os.getcwd())
+    try:
+        if not _git_diff_is_quiet(repo_path, ['--cached']):
+            return True
+        return not _git_diff_is_quiet(repo_path, [])
+    except (OSError, VcsError) as e:
+        logger.debug('fast dirty check failed, falling back to gitpython: ' + str(e))
+        return get_repo(repo_path).is_dirty()
+
+
+def _git_output(repo_path, git_args, null_separated=False):
+    """ Run a read-only git command in repo_path and return its output lines (or the entries
+    of its -z output, if null_separated)
+    """
+    env = dict(os.environ)
+    env['GIT_OPTIONAL_LOCKS'] = '0'
+    cmd_args = ['git'] + list(git_args)
+    try:
+        output = subprocess.check_output(
+            cmd_args, cwd=repo_path, env=env, stderr=subprocess.PIPE
+        )
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise VcsError('`{}` failed: {}'.format(' '.join(cmd_args), e))
+    output = output.decode('utf-8')
+    lines = output.split('\0') if null_separated else output.splitlines()
+    return [line for line in lines if line]
+
+
+def latest_release_tag(tag_format, project_name, repo_path=None):
+    """ Find the tag (created according to tag_format) of the highest released version, or None
+    if no release has been tagged yet
+    """
+    tag_regex = re.compile(re.escape(
+        tag_format.replace('{version}', '\0').format(project_name=project_name)
+    ).replace(re.escape('\0'), '(.+)') + '$')
+    try:
+        tags = get_repo(repo_path).tags
+    except git.exc.GitError as e:
+        raise VcsError('could not list tags: ' + repr(e))
+    ret, ret_version = None, None
+    for tag in tags:
+        match = tag_regex.match(tag.name)
+        if not match:
+            continue
+        try:
+            version = packaging.version.Version(match.group(1))
+        except packaging.version.InvalidVersion:
+            continue
+        if ret_version is None or version > ret_version:
+            ret, ret_version = tag.name, version
+    return ret
+
+
+def changed_paths_since(ref, repo_path=None):
+    """ Get the paths (relative to repo_path, default: cwd) of the files under repo_path which
+    differ between ref and the working tree, including untracked and deleted files
+    """
+    repo_path = os.path.abspath(repo_path or os.getcwd())
+    changed_paths = _git_output(
+        repo_path, ['diff', '--name-only', '--no-renames', '--relative', ref, '--']
+    )
+    changed_paths += _git_output(repo_path, ['ls-files', '--others', '--exclude-standard'])
+    return sorted(set(changed_paths))
+
+
+def list_files(repo_path=None, untracked=False):
+    """ Get the paths (relative to repo_path, default: cwd) of the files under repo_path which
+    are tracked (or untracked and not ignored, if untracked is set) and exist in the working
+    tree
+    """
+    repo_path = os.path.abspath(repo_path or os.getcwd())
+    ls_files_args = ['--others', '--exclude-standard'] if untracked else ['--cached']
+    rel_paths = _git_output(repo_path, ['ls-files', '-z'] + ls_files_args, null_separated=True)
+    return sorted(set(
+        p for p in rel_paths if os.path.isfile(os.path.join(repo_path, p))
+    ))
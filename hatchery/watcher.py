@@ -0,0 +1,271 @@
+import os
+import re
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+import six
+
+logger = logging.getLogger(__name__)
+
+# paths (relative to the watched root) which never affect a hatchery run
+DEFAULT_EXCLUDE_REGEXES = [
+    r'\.git$', r'\.hatchery\.work', r'(.*/)?__pycache__$', r'.*\.py[co]$'
+]
+POLL_INTERVAL_SECONDS = 0.5
+
+# from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_MASK = IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+INOTIFY_EVENT_HEADER = struct.Struct('iIII')
+
+_libc = None
+
+
+class _Watcher(object):
+    """ Shared path filtering for the watcher implementations """
+
+    def __init__(self, root, exclude_regexes=None, extra_paths=()):
+        self.root = os.path.abspath(root)
+        if exclude_regexes is None:
+            exclude_regexes = DEFAULT_EXCLUDE_REGEXES
+        self.exclude_regexes = [re.compile(r) for r in exclude_regexes]
+        self.extra_paths = [os.path.abspath(os.path.expanduser(p)) for p in extra_paths]
+
+    def _is_excluded(self, rel_path):
+        return any(regex.match(rel_path) for regex in self.exclude_regexes)
+
+    def _walk(self, rel_root=''):
+        """ Yield the (relative) paths of all directories and files under rel_root which are
+        not excluded, directories first
+        """
+        for dir_path, dir_names, file_names in os.walk(os.path.join(self.root, rel_root)):
+            rel_dir = os.path.relpath(dir_path, self.root)
+            rel_dir = '' if rel_dir == os.curdir else rel_dir
+            dir_names[:] = [
+                d for d in dir_names if not self._is_excluded(os.path.join(rel_dir, d))
+            ]
+            yield rel_dir, True
+            for file_name in file_names:
+                rel_path = os.path.join(rel_dir, file_name)
+                if not self._is_excluded(rel_path):
+                    yield rel_path, False
+
+    def close(self):
+        pass
+
+
+class PollingWatcher(_Watcher):
+    """ Detect changes to the files under root by comparing snapshots of their stat info
+
+    Call poll() to get the paths (relative to root) that were created, modified or removed
+    since the last call
+    """
+
+    def __init__(self, root, exclude_regexes=None, extra_paths=()):
+        super(PollingWatcher, self).__init__(root, exclude_regexes, extra_paths)
+        self._snapshot = self._take_snapshot()
+
+    def _take_snapshot(self):
+        ret = {}
+        for rel_path, is_dir in self._walk():
+            if is_dir:
+                continue
+            try:
+                stat = os.stat(os.path.join(self.root, rel_path))
+            except OSError:
+                continue
+            ret[rel_path] = (stat.st_mtime, stat.st_size)
+        for extra_path in self.extra_paths:
+            try:
+                stat = os.stat(extra_path)
+            except OSError:
+                ret[extra_path] = None
+                continue
+            ret[extra_path] = (stat.st_mtime, stat.st_size)
+        return ret
+
+    def _changes(self):
+        snapshot = self._take_snapshot()
+        changed = set(
+            path for path in set(snapshot) | set(self._snapshot)
+            if snapshot.get(path) != self._snapshot.get(path)
+        )
+        self._snapshot = snapshot
+        return changed
+
+    def poll(self, timeout=0):
+        """ Return the sorted list of paths which changed since the last poll, waiting up to
+        timeout seconds for something to change
+        """
+        deadline = time.time() + timeout
+        while True:
+            changed = self._changes()
+            remaining = deadline - time.time()
+            if changed or remaining <= 0:
+                break
+            time.sleep(min(POLL_INTERVAL_SECONDS, remaining))
+        if changed:
+            logger.debug('detected changes: {}'.format(sorted(changed)))
+        return sorted(changed)
+
+
+def _get_libc():
+    """ Get a handle on libc if it provides inotify, None otherwise """
+    global _libc
+    if _libc is None:
+        _libc = False
+        libc_name = ctypes.util.find_library('c')
+        if libc_name:
+            libc = ctypes.CDLL(libc_name, use_errno=True)
+            if hasattr(libc, 'inotify_init1') and hasattr(libc, 'inotify_add_watch'):
+                _libc = libc
+    return _libc or None
+
+
+def _raise_errno(message):
+    error_number = ctypes.get_errno()
+    raise OSError(error_number, '{}: {}'.format(message, os.strerror(error_number)))
+
+
+class InotifyWatcher(_Watcher):
+    """ Same interface as PollingWatcher, but woken up by the kernel instead of walking the
+    tree on every poll (linux only)
+
+    Raises OSError if inotify is not available or the tree can't be watched (for example
+    because fs.inotify.max_user_watches is exhausted)
+    """
+
+    def __init__(self, root, exclude_regexes=None, extra_paths=()):
+        super(InotifyWatcher, self).__init__(root, exclude_regexes, extra_paths)
+        self._libc = _get_libc()
+        if self._libc is None:
+            raise OSError(errno.ENOSYS, 'inotify is not available on this platform')
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            _raise_errno('inotify_init1 failed')
+        # watch descriptor -> directory relative to root
+        self._watched_dirs = {}
+        # watch descriptor -> {file name: absolute path}, for extra paths outside of root
+        self._watched_extra_paths = {}
+        try:
+            for rel_path, is_dir in self._walk():
+                if is_dir:
+                    self._add_watch(rel_path)
+            for extra_path in self.extra_paths:
+                extra_dir, extra_name = os.path.split(extra_path)
+                if not os.path.isdir(extra_dir):
+                    continue
+                watch_descriptor = self._add_watch_descriptor(extra_dir)
+                if watch_descriptor is not None:
+                    self._watched_extra_paths.setdefault(watch_descriptor, {})[extra_name] = \
+                        extra_path
+        except OSError:
+            self.close()
+            raise
+
+    def _add_watch_descriptor(self, path):
+        if six.PY3:
+            path = os.fsencode(path)
+        watch_descriptor = self._libc.inotify_add_watch(self._fd, path, INOTIFY_MASK)
+        if watch_descriptor < 0:
+            if ctypes.get_errno() == errno.ENOENT:
+                # removed before we got to it, its parent will report that
+                return None
+            _raise_errno('inotify_add_watch failed for ' + repr(path))
+        return watch_descriptor
+
+    def _add_watch(self, rel_dir):
+        watch_descriptor = self._add_watch_descriptor(os.path.join(self.root, rel_dir))
+        if watch_descriptor is not None:
+            self._watched_dirs[watch_descriptor] = rel_dir
+
+    def _read_events(self):
+        data = b''
+        while True:
+            try:
+                chunk = os.read(self._fd, 65536)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            if not chunk:
+                break
+            data += chunk
+        offset = 0
+        while offset + INOTIFY_EVENT_HEADER.size <= len(data):
+            watch_descriptor, mask, _, name_length = \
+                INOTIFY_EVENT_HEADER.unpack_from(data, offset)
+            offset += INOTIFY_EVENT_HEADER.size
+            name = data[offset:offset + name_length].rstrip(b'\0')
+            offset += name_length
+            if six.PY3:
+                name = os.fsdecode(name)
+            yield watch_descriptor, mask, name
+
+    def _changes(self):
+        changed = set()
+        for watch_descriptor, mask, name in self._read_events():
+            if mask & IN_Q_OVERFLOW:
+                logger.debug('inotify queue overflowed, treating everything as changed')
+                changed.update(rel_path for rel_path, _ in self._walk() if rel_path)
+                changed.update(self.extra_paths)
+                continue
+            if mask & IN_IGNORED:
+                self._watched_dirs.pop(watch_descriptor, None)
+                continue
+            extra_names = self._watched_extra_paths.get(watch_descriptor, {})
+            if name in extra_names:
+                changed.add(extra_names[name])
+            if watch_descriptor not in self._watched_dirs or not name:
+                continue
+            rel_path = os.path.join(self._watched_dirs[watch_descriptor], name)
+            if self._is_excluded(rel_path):
+                continue
+            changed.add(rel_path)
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                # anything created in the new directory before it was watched goes unreported
+                for new_path, is_dir in self._walk(rel_path):
+                    if is_dir:
+                        self._add_watch(new_path)
+                    changed.add(new_path)
+        return changed
+
+    def poll(self, timeout=0):
+        """ Return the sorted list of paths which changed since the last poll, waiting up to
+        timeout seconds for something to change
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        changed = self._changes() if readable else set()
+        if changed:
+            logger.debug('detected changes: {}'.format(sorted(changed)))
+        return sorted(changed)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def get_watcher(root, exclude_regexes=None, extra_paths=()):
+    """ Get the best available watcher for root """
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(root, exclude_regexes=exclude_regexes, extra_paths=extra_paths)
+        except OSError as e:
+            logger.debug('falling back to polling for changes: ' + str(e))
+    return PollingWatcher(root, exclude_regexes=exclude_regexes, extra_paths=extra_paths)
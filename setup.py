@@ -1,10 +1,25 @@
+import sys
 from setuptools import setup
+from setuptools.command.build_py import build_py
 from imp import find_module, load_module
 
 PROJECT_NAME = 'hatchery'
 GITHUB_USER = 'ajk8'
 GITHUB_ROOT = 'https://github.com/{}/{}'.format(GITHUB_USER, PROJECT_NAME)
 
+# modules which only run (and compile) on python 3.5+, left out of older interpreters' installs
+PY35_MODULES = ['async_executor']
+
+
+class BuildPy(build_py):
+
+    def find_package_modules(self, package, package_dir):
+        modules = build_py.find_package_modules(self, package, package_dir)
+        if sys.version_info < (3, 5):
+            modules = [m for m in modules if m[1] not in PY35_MODULES]
+        return modules
+
+
 found = find_module('_version', [PROJECT_NAME])
 _version = load_module('{}._version'.format(PROJECT_NAME), *found)
 
@@ -18,8 +33,12 @@ setup(
     download_url='{}/tarball/{}'.format(GITHUB_ROOT, _version.__version__),
     license='MIT',
     packages=[PROJECT_NAME],
+    cmdclass={'build_py': BuildPy},
     package_data={PROJECT_NAME: ['snippets/*']},
-    entry_points={'console_scripts': ['hatchery=hatchery.main:hatchery']},
+    entry_points={'console_scripts': [
+        'hatchery=hatchery.main:hatchery',
+        'hatchery-client=hatchery.client:main',
+    ]},
     install_requires=[
         'funcy>=1.4',
         'docopt>=0.6.2',
@@ -29,6 +48,7 @@ setup(
         'twine>=1.6.5',
         'microcache>=0.2',
         'workdir>=0.3.1',
+        'dirsync>=2.2.2',
         'gitpython>=1.0.2',
         'requests>=2.10.0',
         'six>=1.10.0',
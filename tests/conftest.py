@@ -0,0 +1,16 @@
+import sys
+import pytest
+from hatchery import helpers
+
+# async_executor is python 3.5+ only
+collect_ignore = ['test_async_executor.py'] if sys.version_info < (3, 5) else []
+
+
+@pytest.fixture(autouse=True)
+def hatchery_cache(tmpdir_factory, monkeypatch):
+    """ Keep the persistent hatchery cache of every test in a directory of its own, rather
+    than in the real ~/.hatchery/cache
+    """
+    cache_root = tmpdir_factory.mktemp('cache')
+    monkeypatch.setattr(helpers, 'CACHE_ROOT', str(cache_root))
+    return cache_root
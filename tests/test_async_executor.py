@@ -0,0 +1,118 @@
+import os
+import sys
+import time
+import asyncio
+import pytest
+from hatchery import async_executor
+from hatchery import jobpool
+
+
+@pytest.fixture(autouse=True)
+def job_pool():
+    # wide enough for the commands below to run at once, however few cpus there are
+    jobpool.configure(cpu_slots=8)
+    yield
+    jobpool.configure()
+
+
+def _run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def test_async_call():
+    cmd = [sys.executable, '-c', 'import sys; print("out"); sys.stderr.write("err"); sys.exit(3)']
+    result = _run(async_executor.async_call(cmd, suppress_output=True))
+    assert result.exitval == 3
+    assert result.stdout.strip() == 'out'
+    assert result.stderr == 'err'
+    assert not result.cancelled
+
+
+def test_async_call_keeps_output_tail(monkeypatch):
+    monkeypatch.setattr(async_executor.executor, 'STREAM_TAIL_SIZE', 1000)
+    cmd = [sys.executable, '-c', 'import sys; sys.stdout.write("line\\n" * 10000)']
+    result = _run(async_executor.async_call(cmd, suppress_output=True))
+    # only a (whole-line) tail of the output is kept
+    assert result.stdout.startswith('line\n')
+    assert len(result.stdout) <= 1000
+
+
+def test_async_call_cancelled():
+    sleep_cmd = [sys.executable, '-c', 'import time; time.sleep(30)']
+
+    loop = asyncio.new_event_loop()
+    try:
+        task = loop.create_task(async_executor.async_call(sleep_cmd))
+        loop.call_later(0.5, task.cancel)
+        start_time = time.time()
+        result = loop.run_until_complete(task)
+    finally:
+        loop.close()
+    assert time.time() - start_time < 10
+    assert result.exitval
+    assert result.cancelled
+
+
+def test_call_all():
+    cmds = [[sys.executable, '-c', 'print({})'.format(i)] for i in range(20)]
+    results = async_executor.call_all(cmds, suppress_output=True, limit=8)
+    assert [r.stdout.strip() for r in results] == [str(i) for i in range(20)]
+    assert not any(r.exitval for r in results)
+
+
+def test_call_all_fail_fast():
+    sleep_cmd = [sys.executable, '-c', 'import time; time.sleep(30)']
+    fail_cmd = [sys.executable, '-c', 'import sys; sys.exit(1)']
+    start_time = time.time()
+    results = async_executor.call_all(
+        [sleep_cmd, fail_cmd, sleep_cmd], suppress_output=True, limit=2, fail_fast=True
+    )
+    assert time.time() - start_time < 10
+    assert [r.cancelled for r in results] == [True, False, True]
+    assert results[1].exitval == 1
+
+
+def test_call_all_queued_by_job_pool():
+    jobpool.configure(cpu_slots=1)
+    sleep_cmd = [sys.executable, '-c', 'import time; time.sleep(0.5)']
+    start_time = time.time()
+    results = async_executor.call_all([sleep_cmd, sleep_cmd], suppress_output=True)
+    assert time.time() - start_time >= 1
+    assert not any(r.exitval for r in results)
+
+
+def test_call_all_fail_fast_on_exception(tmpdir):
+    marker_path = str(tmpdir.join('finished'))
+    sleep_cmd = [sys.executable, '-c', 'import time; time.sleep(1); open({!r}, "w")'.format(
+        marker_path
+    )]
+    with pytest.raises(OSError):
+        async_executor.call_all(
+            [sleep_cmd, ['hatchery-not-a-real-command']], suppress_output=True, fail_fast=True
+        )
+    time.sleep(1.5)
+    assert not os.path.exists(marker_path)
+
+
+def test_async_call_cancelled_ignoring_sigterm(monkeypatch):
+    monkeypatch.setattr(async_executor.executor, 'TERMINATE_GRACE_SECONDS', 1)
+    stubborn_cmd = [sys.executable, '-c', (
+        'import signal, sys, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); '
+        'print("ready"); sys.stdout.flush(); time.sleep(30)'
+    )]
+
+    loop = asyncio.new_event_loop()
+    try:
+        task = loop.create_task(async_executor.async_call(stubborn_cmd, suppress_output=True))
+        loop.call_later(1, task.cancel)
+        start_time = time.time()
+        result = loop.run_until_complete(task)
+    finally:
+        loop.close()
+    assert time.time() - start_time < 10
+    assert result.cancelled
+    assert result.exitval == -9
@@ -28,6 +28,37 @@ def test_from_yaml(tmpdir, monkeypatch):
                 config.from_yaml()
 
 
+def test_from_yaml_compiled(tmpdir, monkeypatch):
+    with microcache.temporarily_disabled():
+        with tmpdir.as_cwd():
+            monkeypatch.setattr(config, 'CONFIG_LOCATIONS', ['.hatchery.yml'])
+            with open('.hatchery.yml', 'w') as f:
+                f.write('# run the tests\ntest_command: "testme!"\n')
+            assert config.from_yaml()['test_command'] == 'testme!'
+            # the compiled config is used while the files are unchanged, without parsing them
+            with monkeypatch.context() as m:
+                m.setattr(config, '_load_yaml', None)
+                assert config.from_yaml()['test_command'] == 'testme!'
+            with open('.hatchery.yml', 'w') as f:
+                f.write('test_command: "changed"\n')
+            assert config.from_yaml()['test_command'] == 'changed'
+            os.remove('.hatchery.yml')
+            assert config.from_yaml()['test_command'] is None
+            # round trip keeps the default config's comments, for printing it
+            round_trip_dict = config.from_yaml(round_trip=True)
+            assert 'automatically create and push a git tag' in \
+                config.import_yaml().round_trip_dump(round_trip_dict)
+
+
+def test_from_yaml_compiled_cache_size(tmpdir, monkeypatch, hatchery_cache):
+    monkeypatch.setattr(config, 'COMPILED_CONFIG_CACHE_SIZE', 2)
+    with microcache.temporarily_disabled():
+        for name in ('a', 'b', 'c'):
+            with tmpdir.mkdir(name).as_cwd():
+                config.from_yaml()
+    assert len(hatchery_cache.join(config.COMPILED_CONFIG_CACHE_DIR).listdir()) == 2
+
+
 PYPIRC_DATA = '''
 [distutils]
 index-servers:
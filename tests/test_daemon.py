@@ -0,0 +1,66 @@
+import os
+import sys
+import time
+import logging
+import multiprocessing
+import pytest
+from hatchery import client
+from hatchery import daemon
+
+
+def _fake_run_argv(argv):
+    sys.stdout.write('out:' + ' '.join(argv) + os.linesep)
+    logging.getLogger('hatchery.fake').error('logged:' + ' '.join(argv))
+    if argv == ['exit']:
+        raise SystemExit(3)
+    if argv == ['boom']:
+        raise ValueError('boom')
+    return 0
+
+
+def _serve(project_dir):
+    logging.basicConfig()
+    daemon.Daemon(_fake_run_argv, project_dir).serve_forever()
+
+
+@pytest.fixture
+def running_daemon(tmpdir, monkeypatch):
+    monkeypatch.setattr(client, 'SOCKET_DIR', str(tmpdir.join('run')))
+    project_dir = tmpdir.join('project').ensure(dir=True)
+    process = multiprocessing.Process(target=_serve, args=(str(project_dir),))
+    process.start()
+    for _ in range(100):
+        if client.connect(str(project_dir)) is not None:
+            break
+        time.sleep(0.05)
+    yield str(project_dir)
+    process.terminate()
+    process.join()
+    assert not os.path.exists(client.socket_path(str(project_dir)))
+
+
+def test_socket_path(tmpdir):
+    assert client.socket_path(str(tmpdir)) == client.socket_path(str(tmpdir) + '/')
+    assert client.socket_path(str(tmpdir)) != client.socket_path(str(tmpdir.join('other')))
+
+
+def test_run_without_daemon(tmpdir, monkeypatch):
+    monkeypatch.setattr(client, 'SOCKET_DIR', str(tmpdir.join('run')))
+    assert client.run(['check'], str(tmpdir)) is None
+
+
+def test_run_through_daemon(running_daemon, capsys):
+    assert client.run(['clean', 'test'], running_daemon) == 0
+    captured = capsys.readouterr()
+    assert 'out:clean test' in captured.out
+    assert 'logged:clean test' in captured.err
+    assert client.run(['exit'], running_daemon) == 3
+    assert client.run(['boom'], running_daemon) == 1
+    assert 'ValueError: boom' in capsys.readouterr().err
+    assert client.run(['daemon'], running_daemon) == 1
+    assert client.run(['check'], os.path.dirname(running_daemon)) is None
+
+
+def test_start_twice(running_daemon):
+    with pytest.raises(daemon.DaemonError):
+        daemon.Daemon(_fake_run_argv, running_daemon).start()
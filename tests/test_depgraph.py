@@ -0,0 +1,83 @@
+import os
+import json
+from hatchery import depgraph
+
+PROJECT_FILES = {
+    'setup.py': 'from setuptools import setup\n',
+    'package/__init__.py': '',
+    'package/core.py': 'X = 1\n',
+    'package/sub/__init__.py': 'from ..core import X\n',
+    'package/sub/helpers.py': 'from . import __name__\n',
+    'package/api.py': 'import package.sub.helpers\n',
+    'tests/__init__.py': '',
+    'tests/test_core.py': 'from package.core import X\n',
+    'tests/test_api.py': 'from package import api\n',
+    'tests/test_other.py': 'import os\n',
+    'build/lib/package/core.py': 'X = 2\n',
+}
+
+
+def _make_project(root):
+    for rel_path, content in PROJECT_FILES.items():
+        path = os.path.join(root, *rel_path.split('/'))
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fh:
+            fh.write(content)
+
+
+def test_build(tmpdir):
+    _make_project(str(tmpdir.join('project')))
+    graph = depgraph.build(str(tmpdir.join('project')))
+    assert 'build/lib/package/core.py' not in graph
+    assert graph['package/sub/__init__.py'] == set(['package/__init__.py', 'package/core.py'])
+    assert graph['package/sub/helpers.py'] == set([
+        'package/__init__.py', 'package/sub/__init__.py'
+    ])
+    assert graph['package/api.py'] == set([
+        'package/__init__.py', 'package/sub/__init__.py', 'package/sub/helpers.py'
+    ])
+    assert graph['tests/test_other.py'] == set()
+    cache_path = depgraph._cache_path(str(tmpdir.join('project')))
+    with open(cache_path) as fh:
+        assert json.load(fh)['tests/test_core.py']['imports'] == [
+            'package.core', 'package.core.X'
+        ]
+
+
+def test_affected_tests(tmpdir):
+    root = str(tmpdir.join('project'))
+    _make_project(root)
+    assert depgraph.affected_tests(['package/core.py'], root) == [
+        'tests/test_api.py', 'tests/test_core.py'
+    ]
+    assert depgraph.affected_tests(['package/api.py', 'README.md'], root) == ['tests/test_api.py']
+    assert depgraph.affected_tests(['tests/test_other.py'], root) == ['tests/test_other.py']
+    assert depgraph.affected_tests(['docs/index.rst'], root) == []
+    assert depgraph.affected_tests(['setup.py'], root) is None
+    assert depgraph.affected_tests(['package/deleted.py'], root) is None
+    assert depgraph.affected_tests(['requirements.txt'], root) is None
+
+
+SRC_LAYOUT_FILES = {
+    'setup.py': "from setuptools import setup\nsetup(name='pkg', package_dir={'': 'src'})\n",
+    'src/pkg/__init__.py': '',
+    'src/pkg/core.py': 'X = 1\n',
+    'src/pkg/sub/__init__.py': 'from ..core import X\n',
+    'src/pkg/unused.py': '',
+    'tests/helpers.py': 'from pkg.sub import X\n',
+    'tests/test_core.py': 'from pkg.core import X\n',
+    'tests/test_sub.py': 'import helpers\n',
+}
+
+
+def test_affected_tests_src_layout(tmpdir):
+    root = str(tmpdir.join('project'))
+    for rel_path, content in SRC_LAYOUT_FILES.items():
+        tmpdir.join('project', *rel_path.split('/')).write(content, ensure=True)
+    assert depgraph.affected_tests(['src/pkg/core.py'], root) == [
+        'tests/test_core.py', 'tests/test_sub.py'
+    ]
+    assert depgraph.affected_tests(['tests/helpers.py'], root) == ['tests/test_sub.py']
+    # nothing imports it, so there's no telling which tests it affects
+    assert depgraph.affected_tests(['src/pkg/unused.py'], root) is None
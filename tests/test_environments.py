@@ -0,0 +1,95 @@
+import os
+import sys
+import json
+import pytest
+from hatchery import environments
+
+SETUP_PY_LITERAL = '''
+from setuptools import setup
+setup(name='a', install_requires=['requests>=2', 'six'])
+'''
+SETUP_PY_VARIABLE = '''
+import setuptools
+REQUIRES = ['funcy']
+setuptools.setup(name='a', install_requires=REQUIRES)
+'''
+SETUP_PY_DYNAMIC = '''
+from setuptools import setup
+setup(name='a', install_requires=open('reqs').read().split())
+'''
+
+
+def test_get_install_requires(tmpdir):
+    setup_py = tmpdir.join('setup.py')
+    setup_py.write(SETUP_PY_LITERAL)
+    assert environments.get_install_requires(str(setup_py)) == ['requests>=2', 'six']
+    setup_py.write(SETUP_PY_VARIABLE)
+    assert environments.get_install_requires(str(setup_py)) == ['funcy']
+    setup_py.write("from setuptools import setup\nsetup(name='a')\n")
+    assert environments.get_install_requires(str(setup_py)) == []
+    setup_py.write(SETUP_PY_DYNAMIC)
+    with pytest.raises(environments.TestEnvironmentError):
+        environments.get_install_requires(str(setup_py))
+
+
+def test_fingerprint(tmpdir):
+    requirements = tmpdir.join('requirements.txt')
+    requirements.write('six\n')
+    fingerprint = environments.fingerprint(sys.executable, [str(requirements)], [])
+    assert fingerprint == environments.fingerprint(sys.executable, [str(requirements)], [])
+    assert fingerprint != environments.fingerprint(sys.executable, [str(requirements)], ['a'])
+    requirements.write('six>=1.10\n')
+    assert fingerprint != environments.fingerprint(sys.executable, [str(requirements)], [])
+    assert environments.fingerprint(sys.executable, [], [], str(tmpdir.join('a'))) != \
+        environments.fingerprint(sys.executable, [], [], str(tmpdir.join('b')))
+
+
+def test_use(tmpdir, monkeypatch):
+    created = []
+
+    def fake_create(env_path, interpreter, requirement_files, install_requires, project_dir):
+        created.append(install_requires)
+        os.makedirs(env_path)
+
+    monkeypatch.setattr(environments, '_create', fake_create)
+    project_dir = tmpdir.mkdir('project')
+    setup_py = project_dir.join('setup.py')
+    setup_py.write(SETUP_PY_LITERAL)
+    with environments.use(str(project_dir), cache_size=1) as first_env_path:
+        with open(os.path.join(first_env_path, environments.COMPLETE_MARKER)) as fh:
+            assert json.load(fh)['install_requires'] == ['requests>=2', 'six']
+    with environments.use(str(project_dir), cache_size=1) as env_path:
+        assert env_path == first_env_path
+    assert len(created) == 1
+    setup_py.write(SETUP_PY_VARIABLE)
+    with environments.use(str(project_dir), cache_size=1) as env_path:
+        assert env_path != first_env_path
+        assert not os.path.exists(first_env_path)
+        environ = environments.activated_environ(env_path, {'PATH': '/usr/bin'})
+        assert environ['VIRTUAL_ENV'] == env_path
+        assert environ['PATH'].split(os.pathsep) == [os.path.join(env_path, 'bin'), '/usr/bin']
+    assert created == [['requests>=2', 'six'], ['funcy']]
+
+
+def test_use_relative_path_requirements(tmpdir, monkeypatch):
+    created_in = []
+
+    def fake_create(env_path, interpreter, requirement_files, install_requires, project_dir):
+        created_in.append(project_dir)
+        os.makedirs(env_path)
+
+    monkeypatch.setattr(environments, '_create', fake_create)
+    env_paths = []
+    for name in ('a', 'b'):
+        project_dir = tmpdir.mkdir(name)
+        project_dir.join('requirements.txt').write('six\n')
+        with environments.use(str(project_dir)) as env_path:
+            env_paths.append(env_path)
+    assert env_paths[0] == env_paths[1]
+    env_paths = []
+    for name in ('a', 'b'):
+        tmpdir.join(name, 'requirements.txt').write('-e .\n')
+        with environments.use(str(tmpdir.join(name))) as env_path:
+            env_paths.append(env_path)
+    assert env_paths[0] != env_paths[1]
+    assert created_in == [str(tmpdir.join(name)) for name in ('a', 'a', 'b')]
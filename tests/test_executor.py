@@ -0,0 +1,78 @@
+import os
+import sys
+import time
+import threading
+from hatchery import executor
+
+
+def test_call_with_canceller():
+    canceller = executor.Canceller()
+    result = executor.call([sys.executable, '-c', 'print(1)'], canceller=canceller)
+    assert result.exitval == 0
+    assert not result.cancelled
+    sleep_cmd = [sys.executable, '-c', 'import time; time.sleep(30)']
+    threading.Timer(0.5, canceller.cancel).start()
+    start_time = time.time()
+    result = executor.call(sleep_cmd, canceller=canceller)
+    assert time.time() - start_time < 10
+    assert result.exitval
+    assert result.cancelled
+    result = executor.call(sleep_cmd, canceller=canceller)
+    assert result.exitval
+    assert result.cancelled
+
+
+def test_call_passes_streamed_output_through(tmpdir, monkeypatch):
+    monkeypatch.setattr(executor, 'STREAM_TAIL_SIZE', 1000)
+    stdout_path, stderr_path = str(tmpdir.join('stdout')), str(tmpdir.join('stderr'))
+    cmd = [
+        sys.executable, '-c',
+        'import sys; sys.stdout.write("line\\n" * 10000); sys.stderr.write("error\\n"); '
+        'sys.exit(2)'
+    ]
+    with open(stdout_path, 'w') as stdout, open(stderr_path, 'w') as stderr:
+        monkeypatch.setattr(sys, 'stdout', stdout)
+        monkeypatch.setattr(sys, 'stderr', stderr)
+        result = executor.call(cmd)
+    assert result.exitval == 2
+    with open(stdout_path) as stdout:
+        assert stdout.read() == 'line\n' * 10000
+    with open(stderr_path) as stderr:
+        assert stderr.read() == 'error\n'
+    # only a (whole-line) tail of the output is kept
+    assert result.stdout.startswith('line\n')
+    assert len(result.stdout) <= 1000
+    assert result.stderr == 'error\n'
+
+
+def test_call_with_timeout(monkeypatch):
+    monkeypatch.setattr(executor, 'TERMINATE_GRACE_SECONDS', 1)
+    result = executor.call([sys.executable, '-c', 'print(1)'], timeout=10)
+    assert result.exitval == 0
+    assert not result.timed_out
+    start_time = time.time()
+    result = executor.call([sys.executable, '-c', 'import time; time.sleep(30)'], timeout=0.5)
+    assert time.time() - start_time < 10
+    assert result.exitval
+    assert result.timed_out
+    assert not result.killed
+    # a grandchild which ignores SIGTERM (and holds the pipes open) is killed too
+    stubborn_cmd = [sys.executable, '-c', (
+        'import signal, subprocess, sys, time; '
+        'subprocess.Popen([sys.executable, "-c", "import signal, time; '
+        'signal.signal(signal.SIGTERM, signal.SIG_IGN); time.sleep(30)"]); '
+        'time.sleep(30)'
+    )]
+    start_time = time.time()
+    result = executor.call(stubborn_cmd, timeout=0.5)
+    assert time.time() - start_time < 10
+    assert result.timed_out
+    assert result.killed
+    assert 'timed out' in result.format_error_msg()
+
+
+def test_call_in_own_session():
+    result = executor.call(
+        [sys.executable, '-c', 'import os; print(os.getsid(0))'], suppress_output=True
+    )
+    assert int(result.stdout) != os.getsid(0)
@@ -0,0 +1,78 @@
+import os
+import time
+from hatchery import fingerprint
+from hatchery import metrics
+
+
+def _write(path, content, mtime=None):
+    if os.path.dirname(path) and not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as fh:
+        fh.write(content)
+    # old enough for the cached digest to be trusted
+    mtime = mtime or time.time() - 60
+    os.utime(path, (mtime, mtime))
+
+
+def test_hash_file(tmpdir):
+    file_path = str(tmpdir.join('file'))
+    _write(file_path, 'x' * 100)
+    assert fingerprint.hash_file(file_path, buffer_size=7) == fingerprint.hash_file(file_path)
+
+
+def test_fingerprint(tmpdir):
+    root = str(tmpdir.join('project'))
+    _write(os.path.join(root, 'setup.py'), 'setup()')
+    _write(os.path.join(root, 'package', '__init__.py'), '')
+    _write(os.path.join(root, 'package', 'sub', 'module.py'), 'a = 1')
+    _write(os.path.join(root, 'docs', 'index.md'), '# docs')
+    _write(os.path.join(root, 'ignored', 'big.bin'), 'x')
+    metrics.reset()
+    first = fingerprint.fingerprint(root, exclude_regexes=['ignored'], workers=2)
+    assert sorted(first.file_digests) == [
+        'docs/index.md', 'package/__init__.py', 'package/sub/module.py', 'setup.py'
+    ]
+    assert sorted(first.dir_hashes) == ['', 'docs', 'package', 'package/sub']
+    assert metrics.get_counters()['cache_misses.fingerprint'] == 4
+
+    # unchanged files come from the stat cache, and the hashes are stable
+    metrics.reset()
+    second = fingerprint.fingerprint(root, exclude_regexes=['ignored'], workers=2)
+    assert metrics.get_counters()['cache_hits.fingerprint'] == 4
+    assert second.root_hash == first.root_hash
+    assert second.dir_hashes == first.dir_hashes
+    assert second.changed_paths(first) == []
+
+    # a change is reflected in the hashes of every directory above it, and no others
+    _write(os.path.join(root, 'package', 'sub', 'module.py'), 'a = 2')
+    os.remove(os.path.join(root, 'setup.py'))
+    _write(os.path.join(root, 'package', 'sub', 'new.py'), '')
+    metrics.reset()
+    third = fingerprint.fingerprint(root, exclude_regexes=['ignored'], workers=2)
+    assert metrics.get_counters()['cache_misses.fingerprint'] == 2
+    assert third.root_hash != first.root_hash
+    assert third.dir_hashes['package'] != first.dir_hashes['package']
+    assert third.dir_hashes['docs'] == first.dir_hashes['docs']
+    assert third.changed_paths(first) == [
+        'package/sub/module.py', 'package/sub/new.py', 'setup.py'
+    ]
+    assert first.changed_paths(third) == third.changed_paths(first)
+
+    # the same content elsewhere has the same fingerprint
+    other_root = str(tmpdir.join('other'))
+    for rel_path in third.file_digests:
+        with open(os.path.join(root, rel_path)) as fh:
+            _write(os.path.join(other_root, rel_path), fh.read())
+    assert fingerprint.fingerprint(other_root).root_hash == third.root_hash
+    assert fingerprint.fingerprint(root, rel_paths=['docs/index.md']).root_hash != \
+        third.root_hash
+
+
+def test_racy_entries(tmpdir):
+    root = str(tmpdir.join('project'))
+    # modified just now, so it could change again without its mtime changing
+    _write(os.path.join(root, 'module.py'), 'a = 1', mtime=time.time())
+    fingerprint.fingerprint(root)
+    metrics.reset()
+    fingerprint.fingerprint(root)
+    assert metrics.get_counters()['cache_misses.fingerprint'] == 1
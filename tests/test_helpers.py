@@ -1,4 +1,8 @@
+import os
+import time
+import threading
 import pytest
+import microcache
 from hatchery import helpers
 
 
@@ -30,3 +34,66 @@ def test_value_of_named_argument_in_function():
         'version', 'setup', "v=1; setup(name='a', version=v)", resolve_varname=True
     )
     assert ret == '1'
+
+
+def test_literal_argument_in_function():
+    search_str = "DATA = {'a': ['*.json']}\nsetup(name='a', package_data=DATA, version=v)\n"
+    assert helpers.literal_argument_in_function('name', 'setup', search_str) == 'a'
+    assert helpers.literal_argument_in_function('package_data', 'setup', search_str) == \
+        {'a': ['*.json']}
+    assert helpers.literal_argument_in_function('zip_safe', 'setup', search_str, True) is True
+    with pytest.raises(ValueError):
+        helpers.literal_argument_in_function('version', 'setup', search_str)
+
+
+def test_clear_cache_except():
+    with microcache.temporarily_enabled():
+        microcache.clear()
+        helpers.string_is_url('keepme')
+        helpers.package_file_path('a.py', 'b')
+        helpers.clear_cache_except(['string_is_url'])
+        assert [k for k, v in microcache.items()] == ["string_is_url('keepme',){}"]
+        microcache.clear()
+
+
+def test_clear_cache_of():
+    with microcache.temporarily_enabled():
+        microcache.clear()
+        helpers.string_is_url('dropme')
+        helpers.package_file_path('a.py', 'b')
+        helpers.clear_cache_of(['string_is_url'])
+        assert [k for k, v in microcache.items()] == ["package_file_path('a.py', 'b'){}"]
+        microcache.clear()
+
+
+def test_file_lock(tmpdir):
+    lock_path = str(tmpdir.join('cache.lock'))
+    events = []
+
+    def locked_append(name):
+        with helpers.file_lock(lock_path):
+            events.append(name + ':start')
+            time.sleep(0.1)
+            events.append(name + ':end')
+
+    threads = [threading.Thread(target=locked_append, args=(name,)) for name in 'ab']
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [e.split(':')[1] for e in events] == ['start', 'end', 'start', 'end']
+    assert os.path.isfile(lock_path)
+
+
+def test_gitignore_patterns(tmpdir):
+    assert helpers.gitignore_patterns(str(tmpdir)) == []
+    tmpdir.join('.gitignore').write('# comment\n/build/\n*.pyc\n!keep.pyc\n\n')
+    assert helpers.gitignore_patterns(str(tmpdir)) == ['build', '*.pyc']
+
+
+def test_walk_tree(tmpdir):
+    tmpdir.join('package', '__init__.py').ensure()
+    tmpdir.join('ignored', 'file.py').ensure()
+    assert sorted(helpers.walk_tree(str(tmpdir), ['ignored'])) == [
+        ('package', True), ('package/__init__.py', False)
+    ]
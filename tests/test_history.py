@@ -0,0 +1,74 @@
+import pytest
+from hatchery import history
+from hatchery import metrics
+from hatchery import helpers
+
+
+def _save_runs(project_dir, test_seconds):
+    for seconds in test_seconds:
+        with history.recording(project_dir, ['test']):
+            metrics.record(metrics.TASK, 'test', seconds)
+            metrics.record(metrics.COMMAND, 'pytest', seconds / 2.0, 0)
+            metrics.record(metrics.COMMAND, 'pytest', seconds / 2.0, 0)
+            metrics.cache_lookup('workdir', hit=True)
+
+
+def test_get_stage_stats(tmpdir):
+    project_dir = str(tmpdir.join('project'))
+    assert history.get_stage_stats(project_dir) == []
+    _save_runs(project_dir, [1.0, 2.0, 3.0])
+    _save_runs(str(tmpdir.join('other')), [10.0])
+    stage_stats = history.get_stage_stats(project_dir)
+    assert [s.stage for s in stage_stats] == ['command:pytest', 'task:test']
+    # both pytest calls in a run add up
+    assert stage_stats[0].seconds == [1.0, 2.0, 3.0]
+    assert (stage_stats[1].p50, stage_stats[1].p95) == (2.0, 3.0)
+    assert history.get_stage_stats(project_dir, run_count=2)[1].seconds == [2.0, 3.0]
+    assert history.get_counter_totals(project_dir) == {'cache_hits.workdir': 3}
+
+
+def test_get_recent_seconds(tmpdir):
+    _save_runs(str(tmpdir.join('project')), [1.0, 2.0])
+    _save_runs(str(tmpdir.join('other')), [3.0])
+    assert history.get_recent_seconds(metrics.TASK, 'test') == [1.0, 2.0, 3.0]
+    assert history.get_recent_seconds(metrics.COMMAND, 'pytest', limit=3) == [1.0, 1.5, 1.5]
+    assert history.get_recent_seconds(metrics.HTTP, 'index:warehouse') == []
+
+
+def test_recording(tmpdir, monkeypatch):
+    with pytest.raises(SystemExit):
+        with history.recording(str(tmpdir), ['test']):
+            metrics.record(metrics.TASK, 'test', 1.0)
+            raise SystemExit(3)
+    with history.recording(str(tmpdir), ['package']) as run:
+        run['exitval'] = 1
+    with history._connect() as connection:
+        assert connection.execute('SELECT tasks, exitval FROM runs').fetchall() == [
+            ('test', 3), ('package', 1)
+        ]
+    # history which can't be saved doesn't fail the run
+    monkeypatch.setattr(helpers, 'CACHE_ROOT', str(tmpdir.join('cache', 'history.sqlite3')))
+    with history.recording(str(tmpdir), ['test']):
+        pass
+
+
+def test_get_latest_run(tmpdir):
+    project_dir = str(tmpdir.join('project'))
+    assert history.get_latest_run(project_dir) is None
+    _save_runs(project_dir, [1.0, 2.0])
+    run = history.get_latest_run(project_dir)
+    assert run['tasks'] == ['test']
+    assert [(t.kind, t.name, t.seconds) for t in run['timings']] == [
+        ('task', 'test', 2.0), ('command', 'pytest', 1.0), ('command', 'pytest', 1.0)
+    ]
+    assert run['counters'] == {'cache_hits.workdir': 1}
+    assert history.get_latest_run(project_dir, since=run['started'] + 1) is None
+
+
+def test_regression():
+    assert history.StageStats('task', 'test', [1.0] * 5).regression(25) is None
+    stage_stats = history.StageStats('task', 'test', [1.0, 1.1, 0.9, 1.5, 1.4, 1.3])
+    assert stage_stats.regression(25) == (1.0, 1.4)
+    assert stage_stats.regression(50) is None
+    # too small to be anything but noise
+    assert history.StageStats('task', 'test', [0.01] * 3 + [0.05] * 3).regression(25) is None
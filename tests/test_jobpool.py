@@ -0,0 +1,118 @@
+import os
+import logging
+import sys
+import time
+import threading
+from hatchery import jobpool
+from hatchery import executor
+
+
+def _write_cgroup_file(root, rel_path, content):
+    path = os.path.join(root, rel_path)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as fh:
+        fh.write(content + '\n')
+
+
+def test_available_cpus(tmpdir, monkeypatch):
+    root = str(tmpdir)
+    monkeypatch.setattr(jobpool, 'CGROUP_ROOT', root)
+    monkeypatch.setattr(os, 'sched_getaffinity', lambda pid: set(range(8)), raising=False)
+    assert jobpool.available_cpus() == 8
+    _write_cgroup_file(root, 'cpu/cpu.cfs_quota_us', '-1')
+    _write_cgroup_file(root, 'cpu/cpu.cfs_period_us', '100000')
+    assert jobpool.available_cpus() == 8
+    _write_cgroup_file(root, 'cpu/cpu.cfs_quota_us', '250000')
+    assert jobpool.available_cpus() == 3
+    _write_cgroup_file(root, 'cpu.max', 'max 100000')
+    assert jobpool.available_cpus() == 8
+    _write_cgroup_file(root, 'cpu.max', '50000 100000')
+    assert jobpool.available_cpus() == 1
+
+
+def test_available_memory(tmpdir, monkeypatch):
+    root = str(tmpdir)
+    monkeypatch.setattr(jobpool, 'CGROUP_ROOT', root)
+    _write_cgroup_file(root, 'memory/memory.limit_in_bytes', '9223372036854771712')
+    assert jobpool.available_memory() != 9223372036854771712
+    _write_cgroup_file(root, 'memory/memory.limit_in_bytes', '1073741824')
+    assert jobpool.available_memory() == 1073741824
+    _write_cgroup_file(root, 'memory.max', '2147483648')
+    assert jobpool.available_memory() == 2147483648
+
+
+def test_job_pool():
+    pool = jobpool.JobPool(cpu_slots=4, memory_bytes=100)
+    admitted = []
+    waiters = [
+        pool.enqueue(jobpool.Weight(cpus, memory), lambda i=i: admitted.append(i))
+        for i, (cpus, memory) in enumerate([(2, 0), (2, 60), (1, 60), (1, 0), (8, 0)])
+    ]
+    # first come, first served: 3 doesn't jump the queue ahead of 2, which doesn't fit yet
+    assert admitted == [0, 1]
+    pool.release(waiters[1])
+    assert admitted == [0, 1, 2, 3]
+    pool.release(waiters[0])
+    pool.release(waiters[2])
+    assert admitted == [0, 1, 2, 3]
+    # heavier than the whole budget, so admitted once nothing else is running
+    pool.release(waiters[3])
+    assert admitted == [0, 1, 2, 3, 4]
+
+
+def test_job_pool_cancel():
+    pool = jobpool.JobPool(cpu_slots=1)
+    admitted = []
+    first = pool.enqueue(jobpool.Weight(), lambda: admitted.append('first'))
+    second = pool.enqueue(jobpool.Weight(), lambda: admitted.append('second'))
+    pool.enqueue(jobpool.Weight(), lambda: admitted.append('third'))
+    pool.cancel(second)
+    pool.release(first)
+    assert admitted == ['first', 'third']
+    assert pool.running == 1
+
+
+def test_get_weight():
+    jobpool.configure(command_weights={
+        'tox': {'cpus': 4}, 'python setup.py': {'memory_mb': 1}
+    })
+    try:
+        assert jobpool.get_weight('tox -e py36').cpus == 4
+        assert jobpool.get_weight('python3 setup.py sdist').memory == 0
+        assert jobpool.get_weight('python setup.py sdist').memory == jobpool.MEGABYTE
+        assert jobpool.get_weight('python setup.py sdist').cpus == 1
+    finally:
+        jobpool.configure()
+
+
+def test_share_among():
+    try:
+        jobpool.share_among(4)
+        jobpool.configure(cpu_slots=8, memory_mb=100)
+        assert jobpool.get_pool().cpu_slots == 2
+        assert jobpool.get_pool().memory_bytes == 25 * jobpool.MEGABYTE
+        jobpool.configure(cpu_slots=2)
+        assert jobpool.get_pool().cpu_slots == 1
+    finally:
+        jobpool.share_among(1)
+        jobpool.configure()
+
+
+def test_call_is_admitted(caplog):
+    caplog.set_level(logging.INFO)
+    jobpool.configure(cpu_slots=1)
+    sleep_cmd = [sys.executable, '-c', 'import time; time.sleep(0.5)']
+    try:
+        threads = [
+            threading.Thread(target=executor.call, args=(sleep_cmd,)) for _ in range(2)
+        ]
+        start_time = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert time.time() - start_time >= 1
+    finally:
+        jobpool.configure()
+    assert 'in the job queue' in caplog.text
@@ -0,0 +1,46 @@
+import os
+import time
+import pytest
+from hatchery import localindex
+
+
+def _touch(path, mtime=None):
+    open(path, 'w').close()
+    # old enough for the index of the directory to be trusted
+    mtime = mtime or time.time() - 60
+    os.utime(path, (mtime, mtime))
+    os.utime(os.path.dirname(path), (mtime, mtime))
+
+
+def test_get_uploaded_versions(tmpdir, monkeypatch):
+    index_dir = str(tmpdir.mkdir('dists'))
+    for filename in ('my-project-1.0.tar.gz', 'my_project-1.1-py3-none-any.whl',
+                     'my-project-other-2.0.zip', 'index.html'):
+        _touch(os.path.join(index_dir, filename))
+    assert localindex.get_uploaded_versions('My.Project', index_dir) == ['1.0', '1.1']
+    assert localindex.get_uploaded_versions('my-project-other', index_dir) == ['2.0']
+    # unchanged directories aren't listed again
+    with monkeypatch.context() as m:
+        m.setattr(os, 'listdir', None)
+        assert localindex.get_uploaded_versions('my-project', index_dir) == ['1.0', '1.1']
+    os.remove(os.path.join(index_dir, 'my-project-1.0.tar.gz'))
+    _touch(os.path.join(index_dir, 'my-project-1.2.tar.gz'), mtime=time.time() - 30)
+    assert localindex.get_uploaded_versions('my-project', index_dir) == ['1.1', '1.2']
+    with pytest.raises(localindex.LocalIndexError):
+        localindex.get_uploaded_versions('my-project', str(tmpdir.join('notreal')))
+
+
+def test_upload(tmpdir):
+    index_dir = str(tmpdir.mkdir('dists'))
+    dist_path = str(tmpdir.join('my-project-1.0.tar.gz'))
+    with open(dist_path, 'w') as fh:
+        fh.write('dist')
+    localindex.upload([dist_path], index_dir)
+    assert os.listdir(index_dir) == ['my-project-1.0.tar.gz']
+    with open(os.path.join(index_dir, 'my-project-1.0.tar.gz')) as fh:
+        assert fh.read() == 'dist'
+    with pytest.raises(localindex.LocalIndexError):
+        localindex.upload([dist_path], index_dir)
+    assert os.listdir(index_dir) == ['my-project-1.0.tar.gz']
+    with pytest.raises(localindex.LocalIndexError):
+        localindex.upload([dist_path], str(tmpdir.join('notreal')))
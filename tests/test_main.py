@@ -2,10 +2,15 @@ from hatchery import main
 from hatchery import config
 from hatchery import project
 from hatchery import executor
+from hatchery import history
+from hatchery import metrics
 import microcache
 import pytest
 import os
 import testfixtures
+import json
+import re
+import workdir
 
 
 def test__get_package_name_or_die(tmpdir):
@@ -30,6 +35,22 @@ def test__get_config_or_die(tmpdir, monkeypatch):
                 main._get_config_or_die()
 
 
+def test__command_timeout_or_die(tmpdir):
+    with microcache.temporarily_disabled():
+        with tmpdir.as_cwd():
+            assert main._command_timeout_or_die('test') is None
+            with open('.hatchery.yml', 'w') as fh:
+                fh.write('command_timeouts: {test: 1800, upload: 2.5}\n')
+            assert main._command_timeout_or_die('test') == 1800
+            assert main._command_timeout_or_die('upload') == 2.5
+            assert main._command_timeout_or_die('package') is None
+            for bad_timeouts in ('{test: soon}', '{test: 0}', '{notastep: 10}'):
+                with open('.hatchery.yml', 'w') as fh:
+                    fh.write('command_timeouts: {}\n'.format(bad_timeouts))
+                with pytest.raises(SystemExit):
+                    main._command_timeout_or_die('test')
+
+
 def test__valid_version_or_die():
     main._valid_version_or_die('7.1')
     with pytest.raises(SystemExit):
@@ -51,6 +72,27 @@ def test__latest_version_or_die(monkeypatch):
         main._latest_version_or_die('foo', 'bar', 'baz', True)
 
 
+def test__register_metadata_or_die(monkeypatch):
+    calls = []
+    monkeypatch.setattr(config, 'from_pypirc', lambda x: {
+        'repository': 'https://pypi.example.com', 'username': 'user'
+    })
+    monkeypatch.setattr(project, 'register_metadata', lambda *args: calls.append(args))
+    monkeypatch.delenv('TWINE_USERNAME', raising=False)
+    monkeypatch.delenv('TWINE_PASSWORD', raising=False)
+    with testfixtures.LogCapture() as lc:
+        with pytest.raises(SystemExit):
+            main._register_metadata_or_die({}, 'foo', True)
+        assert _somewhere_in_messages(lc, 'TWINE_PASSWORD')
+    assert not calls
+    monkeypatch.setenv('TWINE_PASSWORD', 'pass')
+    main._register_metadata_or_die({}, 'foo', True)
+    assert calls[-1][2:4] == ('user', 'pass')
+    monkeypatch.setenv('TWINE_USERNAME', 'other')
+    main._register_metadata_or_die({}, 'foo', True)
+    assert calls[-1][2:4] == ('other', 'pass')
+
+
 def test__check_and_set_version(monkeypatch):
     monkeypatch.setattr(main, '_latest_version_or_die', lambda a, b, c, d: True)
     monkeypatch.setattr(project, 'set_version', lambda x, y: None)
@@ -83,3 +125,213 @@ def test__log_failure_and_die():
         assert _somewhere_in_messages(lc, 'error')
         assert _somewhere_in_messages(lc, 'happy_stdout')
         assert _somewhere_in_messages(lc, 'sad_stderr')
+
+
+def _step_requires(task_scheduler):
+    return dict((step.name, set(step.requires)) for step in task_scheduler.steps)
+
+
+def test__schedule_tasks():
+    args = {'--release-version': '1.0', '--stream-command-output': False}
+    assert _step_requires(main._schedule_tasks(['clean', 'test'], args)) == {
+        'clean': set(), 'test': set(['clean'])
+    }
+    requires = _step_requires(main._schedule_tasks(['clean', 'test', 'package', 'upload'], args))
+    assert requires['package:version'] == set()
+    assert requires['package:readme'] == set()
+    assert requires['package'] == set(['clean', 'package:version', 'package:readme'])
+    assert requires['package:promote'] == set(['test', 'package'])
+    assert requires['upload'] == set(requires.keys()) - set(['upload'])
+    assert 'package:promote' not in _step_requires(main._schedule_tasks(['package'], args))
+
+
+def test__run_subprojects(tmpdir, monkeypatch):
+    def _mock_run_tasks(task_list, args):
+        assert workdir.options.path == os.path.join(os.getcwd(), '.hatchery.work')
+        if os.path.basename(os.getcwd()) == 'bad':
+            raise SystemExit(2)
+        return 0
+
+    monkeypatch.setattr(main, '_run_tasks', _mock_run_tasks)
+    with tmpdir.as_cwd():
+        args = {'--jobs': '2', '--workdir': '.hatchery.work', '--metrics-file': None}
+        assert main._run_subprojects(['libs/*'], ['test'], args) == 1
+        for subproject in ('libs/good1', 'libs/good2'):
+            os.makedirs(subproject)
+            open(os.path.join(subproject, 'setup.py'), 'w').close()
+        with testfixtures.LogCapture() as lc:
+            assert main._run_subprojects(['libs/*'], ['test'], args) == 0
+            assert _somewhere_in_messages(lc, 'libs/good2: succeeded')
+        os.makedirs('libs/bad')
+        open(os.path.join('libs', 'bad', 'setup.py'), 'w').close()
+        with testfixtures.LogCapture() as lc:
+            assert main._run_subprojects(['libs/*'], ['test'], args) == 1
+            assert _somewhere_in_messages(lc, 'libs/bad: failed (exitval 2)')
+            assert _somewhere_in_messages(lc, '1 of 3 subprojects failed')
+
+
+BATCH_MANIFEST = '''
+projects:
+    - path: good
+      tasks: [clean, test]
+      release_version: '1.0'
+    - path: bad
+      tasks: [test]
+'''
+
+
+def test_run_batch(tmpdir, monkeypatch, capsys):
+    def _mock_run_tasks(task_list, args):
+        assert workdir.options.path == os.path.join(os.getcwd(), '.hatchery.work')
+        if os.path.basename(os.getcwd()) == 'bad':
+            raise SystemExit(2)
+        assert args['--release-version'] == '1.0'
+        return 0
+
+    monkeypatch.setattr(main, '_run_tasks', _mock_run_tasks)
+    with tmpdir.as_cwd():
+        os.mkdir('good')
+        os.mkdir('bad')
+        with open('manifest.yml', 'w') as fh:
+            fh.write(BATCH_MANIFEST)
+        args = {'--jobs': '2', '--workdir': '.hatchery.work', '--metrics-file': None}
+        assert main.run_batch('manifest.yml', args) == 1
+        summary = json.loads(capsys.readouterr().out)
+        assert summary['succeeded'] == 1
+        assert summary['failed'] == 1
+        assert [(p['path'], p['exitval']) for p in summary['projects']] == \
+            [('good', 0), ('bad', 2)]
+        assert summary['projects'][0]['tasks'] == ['clean', 'test']
+
+
+def test__load_batch_manifest_or_die(tmpdir):
+    with tmpdir.as_cwd():
+        with pytest.raises(SystemExit):
+            main._load_batch_manifest_or_die('notamanifest.yml')
+        for bad_manifest in ('projects: notalist', 'projects: [{path: a}]',
+                             'projects: [{path: a, tasks: [notatask]}]',
+                             'projects: [{path: a, tasks: check}]',
+                             'projects: [{path: a, tasks: [upload], release_version: 1.2}]'):
+            with open('manifest.yml', 'w') as fh:
+                fh.write(bad_manifest)
+            with pytest.raises(SystemExit):
+                main._load_batch_manifest_or_die('manifest.yml')
+        with open('manifest.yml', 'w') as fh:
+            fh.write(BATCH_MANIFEST)
+        assert len(main._load_batch_manifest_or_die('manifest.yml')['projects']) == 2
+
+
+def test__push_changed_paths(tmpdir):
+    with tmpdir.as_cwd():
+        os.makedirs(os.path.join('work', 'gone_dir'))
+        open(os.path.join('work', 'gone.py'), 'w').close()
+        os.makedirs(os.path.join('package', 'new_dir'))
+        with open(os.path.join('package', 'module.py'), 'w') as fh:
+            fh.write('changed = True')
+        main._push_changed_paths([
+            'gone.py', 'gone_dir', 'package', os.path.join('package', 'module.py'),
+            os.path.join('package', 'new_dir')
+        ], path='work')
+        assert sorted(os.listdir('work')) == ['package']
+        assert sorted(os.listdir(os.path.join('work', 'package'))) == ['module.py', 'new_dir']
+        with open(os.path.join('work', 'package', 'module.py')) as fh:
+            assert fh.read() == 'changed = True'
+
+
+def test__debounce_changes(monkeypatch):
+    class FakeWatcher(object):
+        batches = [['b'], ['a', 'c'], []]
+
+        def poll(self, timeout=0):
+            return self.batches.pop(0)
+
+    monkeypatch.setattr(main, 'WATCH_DEBOUNCE_SECONDS', 0)
+    assert main._debounce_changes(FakeWatcher(), ['c']) == ['a', 'b', 'c']
+
+
+def test__configure_workdir(tmpdir):
+    original_path = workdir.options.path
+    try:
+        with tmpdir.as_cwd():
+            main._configure_workdir('.hatchery.work')
+            assert main._snapshot_path is None
+            assert workdir.options.sync_exclude_regex_list == main.SYNC_EXCLUDE_REGEXES
+            main._configure_workdir(os.path.join('build', 'job-1'))
+            assert workdir.options.path == str(tmpdir.join('build', 'job-1'))
+            assert main._snapshot_path == str(tmpdir.join(main.SNAPSHOT_PATH))
+            assert re.match(workdir.options.sync_exclude_regex_list[-1], 'build/job-1')
+    finally:
+        main._configure_workdir(original_path)
+
+
+def test__run_test_matrix(monkeypatch):
+    def fake_run_matrix_entry(interpreter, path, test_commands, config_dict, suppress_output):
+        failed_result = executor.CallResult(1, '', 'failed') if interpreter == 'bad' else None
+        return {'interpreter': interpreter, 'failed_result': failed_result, 'seconds': 0}
+
+    monkeypatch.setattr(main, '_run_matrix_entry', fake_run_matrix_entry)
+    assert main._matrix_workdir_path('/usr/bin/python3.5').endswith(
+        '.hatchery.work.test-usr_bin_python3.5'
+    )
+    with testfixtures.LogCapture() as log_capture:
+        main._run_test_matrix(['python2.7', 'python3.5'], ['pytest'], {}, True)
+        log_capture.check_present((
+            'hatchery.main', 'INFO',
+            os.linesep.join([
+                'test matrix results:', '    python2.7: passed (0s)', '    python3.5: passed (0s)'
+            ])
+        ))
+    with pytest.raises(SystemExit):
+        main._run_test_matrix(['python2.7', 'bad'], ['pytest'], {}, True)
+
+    def broken_run_matrix_entry(interpreter, *args):
+        if interpreter == 'broken':
+            raise ValueError('broken')
+        return fake_run_matrix_entry(interpreter, *args)
+
+    monkeypatch.setattr(main, '_run_matrix_entry', broken_run_matrix_entry)
+    with testfixtures.LogCapture() as log_capture:
+        with pytest.raises(SystemExit):
+            main._run_test_matrix(['python2.7', 'broken'], ['pytest'], {}, True)
+        assert _somewhere_in_messages(log_capture, 'ValueError: broken')
+        assert _somewhere_in_messages(log_capture, 'broken: FAILED')
+
+
+def test_task_stats(tmpdir, capsys):
+    args = {'--stats-runs': '20', '--regression-threshold': '25'}
+    with tmpdir.as_cwd():
+        with testfixtures.LogCapture() as lc:
+            main.task_stats(args)
+            assert _somewhere_in_messages(lc, 'no runs of this project have been recorded yet')
+        for seconds in (1.0, 1.0, 1.0, 2.0, 2.0, 2.0):
+            with history.recording(os.getcwd(), ['test']):
+                metrics.record(metrics.TASK, 'test', seconds)
+                metrics.cache_lookup('workdir', hit=seconds > 1)
+        with testfixtures.LogCapture() as lc:
+            main.task_stats(args)
+            assert _somewhere_in_messages(lc, 'task:test regressed')
+        out = capsys.readouterr().out
+        assert re.search(r'task:test\s+6\s+1.00s\s+2.00s\s+2.00s', out)
+        assert 'workdir: 50% of 6 lookups' in out
+        with testfixtures.LogCapture() as lc:
+            main.task_stats(dict(args, **{'--regression-threshold': '150'}))
+            assert not _somewhere_in_messages(lc, 'regressed')
+
+
+def test__write_metrics_file(tmpdir):
+    metrics_path = str(tmpdir.join('hatchery.prom'))
+    args = {'--metrics-file': metrics_path}
+    with tmpdir.as_cwd():
+        main._write_metrics_file(args, [os.getcwd()], 0)
+        assert not os.path.exists(metrics_path)
+        with history.recording(os.getcwd(), ['test']):
+            metrics.record(metrics.TASK, 'test', 1.0)
+        main._write_metrics_file(args, [os.getcwd(), 'never-run'], 0)
+        with open(metrics_path) as metrics_file:
+            content = metrics_file.read()
+        assert 'hatchery_task_duration_seconds{{project="{}",task="test"}} 1.0'.format(
+            tmpdir.basename
+        ) in content
+        main._write_metrics_file(dict(args, **{'--metrics-file': None}), [os.getcwd()], 0)
+        # no temp files left behind
+        assert os.listdir(str(tmpdir)) == ['hatchery.prom']
@@ -0,0 +1,107 @@
+import os
+import time
+import git
+from hatchery import manifest
+
+SETUP_PY = '''
+from setuptools import setup
+setup(name='proj', packages=['proj'], package_data={'proj': ['data/*.json'], '': ['*.txt']})
+'''
+MANIFEST_IN = '''
+include README.md
+recursive-include docs *.rst
+graft assets
+prune assets/unused
+'''
+
+
+def _write(path, content=''):
+    if os.path.dirname(path) and not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as fh:
+        fh.write(content)
+
+
+def test_gitignore_matcher():
+    matcher = manifest.GitignoreMatcher([
+        '# comment', '', '*.pyc', 'build/', '/top.txt', 'docs/**/generated', '!keep.pyc',
+        'cache*', '!cache_me/'
+    ])
+    assert matcher.is_ignored('module.pyc')
+    assert matcher.is_ignored('package/module.pyc')
+    assert not matcher.is_ignored('package/keep.pyc')
+    assert matcher.is_ignored('build', is_dir=True)
+    assert not matcher.is_ignored('build')
+    assert matcher.is_ignored('package/build/lib/module.py')
+    assert matcher.is_ignored('top.txt')
+    assert not matcher.is_ignored('package/top.txt')
+    assert matcher.is_ignored('docs/generated/index.rst')
+    assert matcher.is_ignored('docs/api/v1/generated/index.rst')
+    assert not matcher.is_ignored('docs/index.rst')
+    assert matcher.is_ignored('cache_file')
+    assert not matcher.is_ignored('cache_me/file.py')
+    assert not manifest.GitignoreMatcher([]).is_ignored('anything')
+
+
+def test_get_sync_paths(tmpdir, monkeypatch):
+    for var in ('GIT_AUTHOR_NAME', 'GIT_COMMITTER_NAME'):
+        monkeypatch.setenv(var, 'hatchery')
+    for var in ('GIT_AUTHOR_EMAIL', 'GIT_COMMITTER_EMAIL'):
+        monkeypatch.setenv(var, 'hatchery@localhost')
+    with tmpdir.as_cwd():
+        _write('setup.py', SETUP_PY)
+        _write('MANIFEST.in', MANIFEST_IN)
+        _write('.gitignore', '*.json\n*.log\nREADME.md\nbuild/\n')
+        _write('README.md')
+        _write(os.path.join('proj', '__init__.py'))
+        _write(os.path.join('proj', 'notes.txt'))
+        _write(os.path.join('proj', 'data', 'generated.json'))
+        _write(os.path.join('docs', 'index.rst'))
+        _write(os.path.join('docs', 'conf.py'))
+        _write(os.path.join('assets', 'logo.svg'))
+        _write(os.path.join('assets', 'debug.log'))
+        _write(os.path.join('build', 'lib', 'proj', '__init__.py'))
+        _write(os.path.join('.tox', 'py3', 'bin', 'python'))
+        _write('untracked.py')
+        # outside of a git checkout, .gitignore and ALWAYS_EXCLUDED_DIRS decide
+        assert manifest.get_sync_paths() == [
+            '.gitignore', 'MANIFEST.in', 'README.md', 'assets/logo.svg', 'docs/conf.py',
+            'docs/index.rst', 'proj/__init__.py', 'proj/data/generated.json', 'proj/notes.txt',
+            'setup.py', 'untracked.py'
+        ]
+        repo = git.Repo.init('.')
+        repo.index.add(['setup.py', 'proj/__init__.py', '.gitignore'])
+        repo.index.commit('initial commit')
+        os.remove('untracked.py')
+        # ignored files packaging asks for are synced, untracked files git doesn't know about
+        # aren't
+        _write(os.path.join('tests', 'test_new.py'))
+        assert manifest.get_sync_paths() == [
+            '.gitignore', 'MANIFEST.in', 'README.md', 'assets/logo.svg', 'docs/conf.py',
+            'docs/index.rst', 'proj/__init__.py', 'proj/data/generated.json', 'proj/notes.txt',
+            'setup.py', 'tests/test_new.py'
+        ]
+        _write('setup.py', "from setuptools import setup\nsetup(package_data=DATA)\n")
+        assert manifest.get_sync_paths() is None
+
+
+def test_sync(tmpdir):
+    with tmpdir.as_cwd():
+        _write(os.path.join('project', 'a.py'), 'a')
+        _write(os.path.join('project', 'sub', 'b.py'), 'b')
+        _write(os.path.join('project', 'c.py'), 'c')
+        assert manifest.sync('project', 'work', ['a.py', 'sub/b.py']) == 2
+        assert sorted(os.listdir('work')) == ['a.py', 'sub']
+        assert manifest.sync('project', 'work', ['a.py', 'sub/b.py']) == 0
+        # files changed in the workdir (by earlier tasks) are newer, and survive
+        _write(os.path.join('work', 'a.py'), 'changed')
+        future = time.time() + 10
+        os.utime(os.path.join('project', 'sub', 'b.py'), (future, future))
+        assert manifest.sync('project', 'work', ['a.py', 'sub/b.py']) == 1
+        with open(os.path.join('work', 'a.py')) as fh:
+            assert fh.read() == 'changed'
+        if hasattr(os.stat('work'), 'st_mtime_ns'):
+            # nanoseconds apart still counts as newer, like for snapshots
+            mtime_ns = os.stat(os.path.join('work', 'a.py')).st_mtime_ns
+            os.utime(os.path.join('project', 'a.py'), ns=(mtime_ns + 1, mtime_ns + 1))
+            assert manifest.sync('project', 'work', ['a.py']) == 1
@@ -0,0 +1,90 @@
+import pytest
+from hatchery import md2rst
+
+
+def _lines(*lines):
+    return '\n'.join(lines) + '\n'
+
+
+def test_convert_headings():
+    assert md2rst.convert('# title') == _lines('title', '=====')
+    assert md2rst.convert('## sub #') == _lines('sub', '---')
+    assert md2rst.convert(_lines('title', '===', '', 'sub', '---')) == \
+        _lines('title', '=====', '', 'sub', '---')
+
+
+def test_convert_inline():
+    assert md2rst.convert('use `pip` to *install* **it**') == \
+        _lines('use ``pip`` to *install* **it**')
+    assert md2rst.convert('see [the docs](https://a.b/c) or <https://d.e>') == \
+        _lines('see `the docs <https://a.b/c>`__ or https://d.e')
+    assert md2rst.convert('**bold**text') == _lines('**bold**\\ text')
+    assert md2rst.convert('a_var_ and `__init__` and snake_case_') == \
+        _lines('a_var\\_ and ``__init__`` and snake_case\\_')
+    assert md2rst.convert('\\*not emphasized\\* | pipe') == \
+        _lines('\\*not emphasized\\* \\| pipe')
+
+
+def test_convert_badges():
+    assert md2rst.convert(_lines(
+        '[![Build Status](https://ci/badge.svg)](https://ci/project)',
+        '![logo](logo.png)'
+    )) == _lines(
+        '|Build Status|',
+        '|logo|',
+        '',
+        '.. |Build Status| image:: https://ci/badge.svg',
+        '   :target: https://ci/project',
+        '',
+        '.. |logo| image:: logo.png'
+    )
+
+
+def test_convert_lists():
+    assert md2rst.convert(_lines(
+        'intro:',
+        '* one',
+        '  * nested',
+        '  lazily continued',
+        '- two',
+        '',
+        '1. first',
+        '2. second'
+    )) == _lines(
+        'intro:',
+        '',
+        '* one',
+        '',
+        '  * nested',
+        '    lazily continued',
+        '',
+        '* two',
+        '',
+        '1. first',
+        '2. second'
+    )
+
+
+def test_convert_code_blocks():
+    assert md2rst.convert(_lines('```python', 'import os', '', 'os.getcwd()', '```')) == \
+        _lines('.. code:: python', '', '    import os', '', '    os.getcwd()')
+    assert md2rst.convert(_lines('```', '$ hatchery help', '```')) == \
+        _lines('::', '', '    $ hatchery help')
+    assert md2rst.convert(_lines('para', '', '    indented', '', '---', '', 'end')) == \
+        _lines('para', '', '::', '', '    indented', '', '----', '', 'end')
+
+
+@pytest.mark.parametrize('md_content', [
+    _lines('a | b', '--- | ---', '1 | 2'),
+    '> quoted',
+    '<div>html</div>',
+    'some <b>inline</b> html',
+    _lines('[ref][1]', '', '[1]: https://a.b'),
+    '[`code` link](https://a.b)',
+    '**bold `code`**',
+    _lines('```', 'unterminated'),
+    _lines('* item', '', '  second paragraph'),
+])
+def test_convert_unsupported(md_content):
+    with pytest.raises(md2rst.UnsupportedMarkdown):
+        md2rst.convert(md_content)
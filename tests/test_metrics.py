@@ -0,0 +1,26 @@
+import pytest
+from hatchery import metrics
+
+
+def test_timed():
+    metrics.reset()
+    with metrics.timed(metrics.TASK, 'test'):
+        pass
+    with pytest.raises(ValueError):
+        with metrics.timed(metrics.TASK, 'package'):
+            raise ValueError()
+    assert [(t.name, t.exitval) for t in metrics.get_timings()] == [('test', 0), ('package', 1)]
+    metrics.reset()
+    assert metrics.get_timings() == []
+
+
+def test_counters():
+    metrics.reset()
+    metrics.add('bytes_synced', 10)
+    metrics.add('bytes_synced', 5)
+    metrics.cache_lookup('index', hit=True)
+    metrics.cache_lookup('index', hit=False)
+    metrics.cache_lookup('index', hit=False)
+    assert metrics.get_counters() == {
+        'bytes_synced': 15, 'cache_hits.index': 1, 'cache_misses.index': 2
+    }
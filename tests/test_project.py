@@ -1,10 +1,13 @@
 import pytest
 import os
+import time
+import requests
 import funcy
 import microcache
 import requests_mock
 import pypandoc
 from hatchery import project
+from hatchery import metrics
 from hatchery import snippets
 from hatchery import helpers
 
@@ -52,6 +55,55 @@ def test_get_package_name(tmpdir):
             project.get_package_name()
 
 
+def test_find_packages(tmpdir, monkeypatch):
+    with tmpdir.as_cwd():
+        assert project.find_packages() == []
+        _make_package('package_name')
+        _make_package('package_name.subpackage')
+        for pruned_package in ('node_modules', 'build', 'ignored', 'data'):
+            _make_package(pruned_package)
+        os.mkdir('.hatchery.work')
+        open(os.path.join('.hatchery.work', '__init__.py'), 'w').close()
+        with open('.gitignore', 'w') as gitignore:
+            gitignore.write('# comment' + os.linesep + '/ignored/' + os.linesep)
+        assert project.find_packages(exclude=['data']) == \
+            ['package_name', 'package_name.subpackage']
+        assert 'data' in project.find_packages()
+        _make_package('package_name.build')
+        assert 'package_name.build' in project.find_packages(exclude=['data'])
+
+        walks = []
+        original_walk_packages = project._walk_packages
+
+        def _counting_walk_packages(root, patterns):
+            walks.append(root)
+            return original_walk_packages(root, patterns)
+
+        monkeypatch.setattr(project, '_walk_packages', _counting_walk_packages)
+        project.find_packages(exclude=['data'])
+        project.find_packages(exclude=['data'])
+        assert len(walks) == 0
+        _make_package('package_name.subpackage.another')
+        assert 'package_name.subpackage.another' in project.find_packages(exclude=['data'])
+        assert len(walks) == 1
+        os.remove('.gitignore')
+        assert 'ignored' in project.find_packages(exclude=['data'])
+        assert len(walks) == 2
+
+
+def test_find_subprojects(tmpdir):
+    with tmpdir.as_cwd():
+        assert project.find_subprojects(['libs/*']) == []
+        for subproject in ('libs/a', 'libs/b', 'libs/nosetup', 'tools/c'):
+            os.makedirs(subproject)
+            if subproject != 'libs/nosetup':
+                open(os.path.join(subproject, 'setup.py'), 'w').close()
+        assert project.find_subprojects(['libs/*']) == ['libs/a', 'libs/b']
+        assert project.find_subprojects('tools/c') == ['tools/c']
+        assert project.find_subprojects(['tools/*', 'libs/*', 'libs/a']) == \
+            ['libs/a', 'libs/b', 'tools/c']
+
+
 def test_project_has_setup_py(tmpdir):
     with tmpdir.as_cwd():
         assert project.project_has_setup_py() is False
@@ -161,6 +213,154 @@ def test__get_upload_versions_pypicloud():
             set(['0.1', '0.2'])
 
 
+def test__index_get(monkeypatch):
+    monkeypatch.setattr(project, 'INDEX_BACKOFF_SECONDS', 0)
+    api_url = '/'.join((INDEX_URL, PROJECT_NAME, 'json'))
+    with requests_mock.mock() as m:
+        m.get(api_url, [
+            {'status_code': 503},
+            {'exc': requests.exceptions.ConnectTimeout},
+            {'text': '{"releases": {"0.1": []}}'},
+        ])
+        response = project._index_get(api_url, True, 'index:warehouse')
+        assert response.json() == {'releases': {'0.1': []}}
+        assert m.call_count == 3
+        assert m.last_request.timeout == project.INDEX_TIMEOUTS
+        m.get(api_url, status_code=500)
+        with pytest.raises(project.ProjectError):
+            project._index_get(api_url, True, 'index:warehouse')
+        assert m.call_count == 3 + project.INDEX_RETRIES + 1
+        # only 5xx responses are retried
+        m.get(api_url, status_code=404)
+        assert project._index_get(api_url, True, 'index:warehouse').status_code == 404
+
+
+class _SlowSession(object):
+
+    def __init__(self, seconds, error=None):
+        self.seconds = seconds
+        self.error = error
+        self.closed = False
+
+    def get(self, url, **kwargs):
+        time.sleep(self.seconds)
+        if self.error is not None:
+            raise self.error
+        return self.seconds
+
+    def close(self):
+        self.closed = True
+
+
+def test__hedged_get(monkeypatch):
+    hedge_sessions = []
+
+    def hedge_session(seconds):
+        hedge_sessions.append(_SlowSession(seconds))
+        return hedge_sessions[-1]
+
+    monkeypatch.setattr(project, '_get_session', lambda: _SlowSession(5))
+    monkeypatch.setattr(project.requests, 'Session', lambda: hedge_session(0))
+    start_time = time.time()
+    assert project._hedged_get(INDEX_URL, True, 0.1) == 0
+    assert time.time() - start_time < 2
+    assert [s.closed for s in hedge_sessions] == [True]
+    # errors aren't hedged, they are left for _index_get to retry
+    monkeypatch.setattr(
+        project, '_get_session', lambda: _SlowSession(0, project.requests.ConnectionError())
+    )
+    with pytest.raises(project.requests.ConnectionError):
+        project._hedged_get(INDEX_URL, True, 1)
+    assert len(hedge_sessions) == 1
+    # answered before the hedge delay, so no hedged request is sent
+    monkeypatch.setattr(project, '_get_session', lambda: _SlowSession(0.01))
+    monkeypatch.setattr(project.requests, 'Session', lambda: _SlowSession(5))
+    assert project._hedged_get(INDEX_URL, True, 1) == 0.01
+
+
+def test__hedge_delay(tmpdir, monkeypatch):
+    monkeypatch.setattr(project, '_index_latencies', {})
+    assert project._hedge_delay('index:test') == project.INDEX_HEDGE_DEFAULT_DELAY
+    project._index_latency_samples('index:test').extend(range(1, 21))
+    assert project._hedge_delay('index:test') == 19
+
+
+PKG_INFO = '''Metadata-Version: 2.1
+Name: myproject
+Version: 1.0
+Summary: my project
+Home-page: https://example.com
+Classifier: Programming Language :: Python :: 2
+Classifier: Programming Language :: Python :: 3
+Requires-Dist: requests
+
+my long description
+'''
+
+
+def test_read_pkg_info(tmpdir):
+    pkg_info_path = str(tmpdir.join('PKG-INFO'))
+    with open(pkg_info_path, 'w') as pkg_info_file:
+        pkg_info_file.write(PKG_INFO)
+    metadata = project.read_pkg_info(pkg_info_path)
+    assert metadata['name'] == PROJECT_NAME
+    assert metadata['version'] == '1.0'
+    assert metadata['home_page'] == 'https://example.com'
+    assert metadata['classifiers'] == [
+        'Programming Language :: Python :: 2', 'Programming Language :: Python :: 3'
+    ]
+    assert metadata['requires_dist'] == ['requests']
+    assert metadata['description'].strip() == 'my long description'
+
+
+def test_read_pkg_info_folded_description(tmpdir):
+    pkg_info_path = str(tmpdir.join('PKG-INFO'))
+    with open(pkg_info_path, 'w') as pkg_info_file:
+        pkg_info_file.write(
+            'Metadata-Version: 1.1\nName: myproject\nDescription: my long description\n'
+            '        ==================\n        \n            indented\nVersion: 1.0\n'
+        )
+    metadata = project.read_pkg_info(pkg_info_path)
+    assert metadata['description'] == \
+        'my long description\n==================\n\n    indented'
+    assert metadata['version'] == '1.0'
+
+
+def test_register_metadata():
+    metadata = {'name': PROJECT_NAME, 'version': '1.0', 'classifiers': ['a', 'b']}
+    with requests_mock.mock() as m:
+        m.post(INDEX_URL, text='OK')
+        project.register_metadata(metadata, INDEX_URL, 'user', 'pass')
+        body = m.last_request.text
+        assert ':action=submit' in body.replace('%3A', ':')
+        assert 'name=' + PROJECT_NAME in body
+        assert 'classifiers=a&classifiers=b' in body
+        assert m.last_request.headers['Authorization'].startswith('Basic ')
+        m.post(INDEX_URL, status_code=403, reason='Forbidden')
+        with pytest.raises(project.ProjectError):
+            project.register_metadata(metadata, INDEX_URL, 'user', 'pass')
+        m.reset_mock()
+        with pytest.raises(project.ProjectError):
+            project.register_metadata(metadata, INDEX_URL, 'user', None)
+        assert not m.called
+
+
+def test__get_session(monkeypatch):
+    session = project._get_session()
+    assert project._get_session() is session
+    monkeypatch.setattr(project, '_session_pid', -1)
+    assert project._get_session() is not session
+
+
+def test__get_uploaded_versions_local_index(tmpdir):
+    index_dir = tmpdir.mkdir('dists')
+    index_dir.join(PROJECT_NAME + '-0.1.tar.gz').write('')
+    index_url = 'file://' + str(index_dir)
+    assert project._get_uploaded_versions(PROJECT_NAME, index_url) == ['0.1']
+    with pytest.raises(project.ProjectError):
+        project._get_uploaded_versions(PROJECT_NAME, 'file://' + str(tmpdir.join('notreal')))
+
+
 def test__get_uploaded_versions(monkeypatch):
     monkeypatch.setattr(project, '_get_uploaded_versions_warehouse', lambda a, b, c: None)
     monkeypatch.setattr(project, '_get_uploaded_versions_pypicloud', lambda a, b, c: None)
@@ -178,6 +378,20 @@ def test_version_already_uploaded(monkeypatch):
     assert project.version_already_uploaded(PROJECT_NAME, '0.3', INDEX_URL) is False
 
 
+def test__lookup_uploaded_versions(monkeypatch):
+    monkeypatch.setattr(project, '_get_uploaded_versions_warehouse', lambda a, b, c: ['0.1'])
+    metrics.reset()
+    with microcache.temporarily_enabled():
+        microcache.clear()
+        for _ in range(3):
+            assert project._lookup_uploaded_versions(PROJECT_NAME, INDEX_URL, True) == ['0.1']
+        microcache.clear()
+    assert metrics.get_counters() == {'cache_hits.index': 2, 'cache_misses.index': 1}
+    metrics.reset()
+    project._lookup_uploaded_versions(PROJECT_NAME, INDEX_URL, True)
+    assert metrics.get_counters() == {'cache_misses.index': 1}
+
+
 def test_get_latest_uploaded_version(monkeypatch):
     monkeypatch.setattr(project, '_get_uploaded_versions_warehouse', lambda a, b, c: None)
     monkeypatch.setattr(project, '_get_uploaded_versions_pypicloud', lambda a, b, c: None)
@@ -214,6 +428,12 @@ def _pandoc_installed():
     return True
 
 
+# tables are not handled by the built-in converter, so this requires pandoc
+PANDOC_ONLY_README_MD = os.linesep.join((
+    '# heading', '', 'a | b', '--- | ---', '1 | 2', ''
+))
+
+
 @pytest.mark.skipif(not _pandoc_installed(), reason='pandoc is not installed')
 def test_convert_readme_to_rst(tmpdir):
 
@@ -236,11 +456,50 @@ def test_convert_readme_to_rst(tmpdir):
         project.convert_readme_to_rst()
         assert helpers.regex_in_file(r'=======', 'README.rst') is True
         os.remove('README.rst')
+        with open('README.md', 'w') as readme_md:
+            readme_md.write(PANDOC_ONLY_README_MD)
         with mock.patch('pypandoc.convert', _mock_pypandoc_convert_OSError):
             with pytest.raises(project.ProjectError):
                 project.convert_readme_to_rst()
 
 
+def test_convert_readme_to_rst_cached(tmpdir, monkeypatch):
+    conversions = []
+
+    def _mock_pypandoc_convert(filename, format):
+        conversions.append(filename)
+        return 'heading' + os.linesep + '=======' + os.linesep
+
+    monkeypatch.setattr(project, '_pandoc_fingerprint', lambda: '/usr/bin/pandoc:1:1')
+    monkeypatch.setattr(pypandoc, 'convert', _mock_pypandoc_convert, raising=False)
+    with tmpdir.join('project').ensure(dir=True).as_cwd():
+        with open('README.md', 'w') as readme_md:
+            readme_md.write('# heading')
+        project.convert_readme_to_rst()
+        assert helpers.regex_in_file(r'=======', 'README.rst') is True
+        assert len(conversions) == 0
+        os.remove('README.rst')
+        with open('README.md', 'w') as readme_md:
+            readme_md.write(PANDOC_ONLY_README_MD)
+        for _ in range(2):
+            project.convert_readme_to_rst()
+            assert helpers.regex_in_file(r'=======', 'README.rst') is True
+            os.remove('README.rst')
+        assert len(conversions) == 1
+        monkeypatch.setattr(project, '_pandoc_fingerprint', lambda: '/usr/bin/pandoc:2:2')
+        project.convert_readme_to_rst()
+        assert len(conversions) == 2
+        os.remove('README.rst')
+        with open('README.md', 'a') as readme_md:
+            readme_md.write(os.linesep + 'more content')
+        project.convert_readme_to_rst()
+        assert len(conversions) == 3
+        os.remove('README.rst')
+        monkeypatch.setattr(project, '_pandoc_fingerprint', lambda: None)
+        project.convert_readme_to_rst()
+        assert len(conversions) == 4
+
+
 def test_get_packaged_files(tmpdir):
     with tmpdir.as_cwd():
         assert project.get_packaged_files('package') == []
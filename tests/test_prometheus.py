@@ -0,0 +1,50 @@
+from hatchery import metrics
+from hatchery import prometheus
+
+RUN = {
+    'project': '/path/to/proj',
+    'tasks': ['test', 'upload'],
+    'started': 1500000000.0,
+    'seconds': 4.5,
+    'exitval': 1,
+    'timings': [
+        metrics.Timing(metrics.TASK, 'test', 3.0, 0),
+        metrics.Timing(metrics.COMMAND, 'pytest', 1.0, 2),
+        metrics.Timing(metrics.COMMAND, 'pytest', 1.5, 0),
+        metrics.Timing(metrics.COMMAND, 'twine "upload"', 0.25, 0),
+    ],
+    'counters': {
+        'bytes_synced': 2048, 'cache_hits.index': 3, 'cache_misses.index': 1,
+        'cache_misses.workdir': 1
+    },
+}
+
+
+def test_format_runs():
+    lines = prometheus.format_runs([RUN, dict(RUN, project='/path/to/other')]).splitlines()
+    assert lines[:4] == [
+        '# HELP hatchery_run_timestamp_seconds When the run started',
+        '# TYPE hatchery_run_timestamp_seconds gauge',
+        'hatchery_run_timestamp_seconds{project="proj"} 1500000000.0',
+        'hatchery_run_timestamp_seconds{project="other"} 1500000000.0',
+    ]
+    # every metric is described once, before all of its samples
+    assert len([line for line in lines if line.startswith('# TYPE')]) == len(set(
+        line.split('{')[0] for line in lines if not line.startswith('#')
+    ))
+    assert 'hatchery_run_exit_code{project="proj"} 1.0' in lines
+    assert 'hatchery_task_duration_seconds{project="proj",task="test"} 3.0' in lines
+    assert 'hatchery_command_duration_seconds{command="pytest",project="proj"} 2.5' in lines
+    assert 'hatchery_command_exit_code{command="pytest",project="proj"} 2.0' in lines
+    assert 'hatchery_command_exit_code{command="twine \\"upload\\"",project="proj"} 0.0' in lines
+    assert 'hatchery_synced_bytes{project="proj"} 2048.0' in lines
+    assert 'hatchery_uploaded_bytes{project="proj"} 0.0' in lines
+    assert 'hatchery_cache_hit_ratio{cache="index",project="proj"} 0.75' in lines
+    assert 'hatchery_cache_hit_ratio{cache="workdir",project="proj"} 0.0' in lines
+
+
+def test_format_runs_root():
+    runs = [dict(RUN, project='/repo/libs/core'), dict(RUN, project='/repo/apps/core')]
+    lines = prometheus.format_runs(runs, root='/repo').splitlines()
+    assert 'hatchery_run_exit_code{project="libs/core"} 1.0' in lines
+    assert 'hatchery_run_exit_code{project="apps/core"} 1.0' in lines
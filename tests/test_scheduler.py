@@ -0,0 +1,57 @@
+import threading
+import pytest
+from hatchery import scheduler
+
+
+def test_add():
+    s = scheduler.Scheduler()
+    s.add('a', lambda: None)
+    with pytest.raises(scheduler.SchedulerError):
+        s.add('a', lambda: None)
+    with pytest.raises(scheduler.SchedulerError):
+        s.add('b', lambda: None, requires=['notastep'])
+    s.add('b', lambda: None)
+    s.add('c', lambda: None, requires=['a'])
+    s.add('d', lambda: None, barrier=True)
+    assert s.get('c').requires == ['a']
+    assert set(s.get('d').requires) == set(['a', 'b', 'c'])
+
+
+def test_run_overlaps_independent_steps():
+    started = threading.Event()
+    results = []
+
+    def _waits_for_other():
+        # would time out if the steps were run one after another
+        assert started.wait(5)
+        results.append('waiter')
+
+    def _other():
+        started.set()
+        results.append('other')
+
+    s = scheduler.Scheduler()
+    s.add('waiter', _waits_for_other)
+    s.add('other', _other)
+    s.add('commit', lambda: results.append('commit'), barrier=True)
+    assert s.run() == []
+    assert results[-1] == 'commit'
+    assert set(results) == set(['waiter', 'other', 'commit'])
+
+
+def test_run_failure():
+    results = []
+
+    def _fail():
+        raise SystemExit(1)
+
+    s = scheduler.Scheduler(max_workers=1)
+    s.add('fails', _fail)
+    s.add('requires_failure', lambda: results.append('requires_failure'), requires=['fails'])
+    s.add('independent', lambda: results.append('independent'))
+    failed = s.run()
+    assert [step.name for step in failed] == ['fails']
+    assert isinstance(failed[0].error, SystemExit)
+    assert results == []
+    assert s.get('requires_failure').state == scheduler.SKIPPED
+    assert s.get('independent').state == scheduler.SKIPPED
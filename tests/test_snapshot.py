@@ -0,0 +1,79 @@
+import os
+import time
+from hatchery import snapshot
+
+
+def _write(path, content):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as fh:
+        fh.write(content)
+
+
+def _read(path):
+    with open(path) as fh:
+        return fh.read()
+
+
+def test_sync(tmpdir):
+    with tmpdir.as_cwd():
+        _write(os.path.join('project', 'package', 'module.py'), 'version = 1')
+        _write(os.path.join('project', 'gone.py'), '')
+        _write(os.path.join('project', 'ignored', 'file.py'), '')
+        snapshot.sync('project', 'base', 'work_a', exclude_regexes=['ignored'])
+        assert sorted(os.listdir('base')) == ['gone.py', 'package']
+        work_a_module = os.path.join('work_a', 'package', 'module.py')
+        assert _read(work_a_module) == 'version = 1'
+        assert not os.path.samefile(work_a_module, os.path.join('base', 'package', 'module.py'))
+
+        # a build writing to a file in its workdir leaves the snapshot and other workdirs alone
+        snapshot.seed('base', 'work_c')
+        with open(os.path.join('work_c', 'package', 'module.py'), 'a') as fh:
+            fh.write(' + 1')
+        assert _read(os.path.join('base', 'package', 'module.py')) == 'version = 1'
+        assert _read(work_a_module) == 'version = 1'
+
+        # the project changes under a running workdir: the snapshot is refreshed by replacing
+        # files, so work_a keeps the version it was given until it is synced again
+        os.remove(os.path.join('project', 'gone.py'))
+        _write(os.path.join('project', 'package', 'module.py'), 'version = 22')
+        future = time.time() + 10
+        os.utime(os.path.join('project', 'package', 'module.py'), (future, future))
+        assert snapshot.refresh('project', 'base', exclude_regexes=['ignored']) == 2
+        assert sorted(os.listdir('base')) == ['package']
+        assert _read(work_a_module) == 'version = 1'
+        snapshot.seed('base', 'work_b')
+        assert _read(os.path.join('work_b', 'package', 'module.py')) == 'version = 22'
+        snapshot.seed('base', 'work_a')
+        assert _read(work_a_module) == 'version = 22'
+
+        # files changed by the run itself are newer than the snapshot's, and are kept
+        _write(os.path.join('run', 'module.py'), 'version = 333')
+        os.utime(os.path.join('run', 'module.py'), (future + 10, future + 10))
+        snapshot.replace_file(os.path.join('run', 'module.py'), work_a_module)
+        snapshot.seed('base', 'work_a')
+        assert _read(work_a_module) == 'version = 333'
+        assert _read(os.path.join('base', 'package', 'module.py')) == 'version = 22'
+
+
+def test_refresh_rel_paths(tmpdir):
+    with tmpdir.as_cwd():
+        _write(os.path.join('project', 'package', 'module.py'), '')
+        _write(os.path.join('project', 'venv', 'lib', 'huge.so'), '')
+        assert snapshot.refresh('project', 'base', rel_paths=['package/module.py']) == 1
+        assert os.listdir('base') == ['package']
+        _write(os.path.join('project', 'setup.py'), '')
+        assert snapshot.refresh('project', 'base', rel_paths=['setup.py']) == 2
+        assert os.listdir('base') == ['setup.py']
+
+
+def test_refresh_same_size_change(tmpdir):
+    with tmpdir.as_cwd():
+        _write(os.path.join('project', 'module.py'), 'version = 1')
+        os.utime(os.path.join('project', 'module.py'), (1000, 1000.25))
+        os.mkdir('base')
+        assert snapshot.refresh('project', 'base') == 1
+        _write(os.path.join('project', 'module.py'), 'version = 2')
+        os.utime(os.path.join('project', 'module.py'), (1000, 1000.5))
+        assert snapshot.refresh('project', 'base') == 1
+        assert _read(os.path.join('base', 'module.py')) == 'version = 2'
@@ -0,0 +1,107 @@
+import os
+import git
+import pytest
+import microcache
+from hatchery import vcs
+
+
+def _make_repo(monkeypatch):
+    for var in ('GIT_AUTHOR_NAME', 'GIT_COMMITTER_NAME'):
+        monkeypatch.setenv(var, 'hatchery')
+    for var in ('GIT_AUTHOR_EMAIL', 'GIT_COMMITTER_EMAIL'):
+        monkeypatch.setenv(var, 'hatchery@localhost')
+    repo = git.Repo.init('.')
+    with open('tracked.txt', 'w') as fh:
+        fh.write('original')
+    repo.index.add(['tracked.txt'])
+    repo.index.commit('initial commit')
+    return repo
+
+
+def test_get_repo(tmpdir, monkeypatch):
+    with microcache.temporarily_enabled():
+        with tmpdir.as_cwd():
+            _make_repo(monkeypatch)
+            repo = vcs.get_repo()
+            assert repo is vcs.get_repo(str(tmpdir))
+            assert os.path.realpath(repo.working_tree_dir) == os.path.realpath(str(tmpdir))
+
+
+def test_working_copy_is_dirty(tmpdir, monkeypatch):
+    with tmpdir.as_cwd():
+        repo = _make_repo(monkeypatch)
+        assert vcs.working_copy_is_dirty() is False
+        assert repo.is_dirty() is False
+        # untracked files (build artifacts and the like) do not count
+        open('untracked.txt', 'w').close()
+        assert vcs.working_copy_is_dirty() is False
+        with open('tracked.txt', 'w') as fh:
+            fh.write('modified')
+        assert vcs.working_copy_is_dirty() is True
+        assert repo.is_dirty() is True
+        repo.index.add(['tracked.txt'])
+        assert vcs.working_copy_is_dirty() is True
+        repo.index.commit('second commit')
+        assert vcs.working_copy_is_dirty() is False
+
+
+def test_working_copy_is_dirty_fallback(tmpdir, monkeypatch):
+    with tmpdir.as_cwd():
+        _make_repo(monkeypatch)
+        with open('tracked.txt', 'w') as fh:
+            fh.write('modified')
+
+        def _raise_vcs_error(repo_path, diff_args):
+            raise vcs.VcsError('git is broken')
+
+        monkeypatch.setattr(vcs, '_git_diff_is_quiet', _raise_vcs_error)
+        assert vcs.working_copy_is_dirty() is True
+
+
+def test_latest_release_tag(tmpdir, monkeypatch):
+    with microcache.temporarily_disabled():
+        with tmpdir.as_cwd():
+            repo = _make_repo(monkeypatch)
+            assert vcs.latest_release_tag('{version}', 'proj') is None
+            for tag_name in ('0.9', '0.10', 'proj-2.0', 'not-a-version', 'release-3.0'):
+                repo.create_tag(tag_name)
+            assert vcs.latest_release_tag('{version}', 'proj') == '0.10'
+            assert vcs.latest_release_tag('{project_name}-{version}', 'proj') == 'proj-2.0'
+            assert vcs.latest_release_tag('{project_name}-{version}', 'other') is None
+
+
+def test_changed_paths_since(tmpdir, monkeypatch):
+    with tmpdir.as_cwd():
+        repo = _make_repo(monkeypatch)
+        repo.create_tag('1.0')
+        os.mkdir('sub')
+        with open(os.path.join('sub', 'committed.txt'), 'w') as fh:
+            fh.write('committed')
+        repo.index.add([os.path.join('sub', 'committed.txt')])
+        repo.index.commit('second commit')
+        with open('tracked.txt', 'w') as fh:
+            fh.write('modified')
+        open(os.path.join('sub', 'untracked.txt'), 'w').close()
+        assert vcs.changed_paths_since('1.0') == [
+            'sub/committed.txt', 'sub/untracked.txt', 'tracked.txt'
+        ]
+        assert vcs.changed_paths_since('1.0', 'sub') == ['committed.txt', 'untracked.txt']
+        with pytest.raises(vcs.VcsError):
+            vcs.changed_paths_since('no-such-ref')
+
+
+def test_list_files(tmpdir, monkeypatch):
+    with tmpdir.as_cwd():
+        _make_repo(monkeypatch)
+        os.mkdir('sub')
+        for file_name in ('untracked.txt', 'ignored.log', os.path.join('sub', 'new file.txt')):
+            open(file_name, 'w').close()
+        with open('.gitignore', 'w') as fh:
+            fh.write('*.log\n')
+        assert vcs.list_files() == ['tracked.txt']
+        assert vcs.list_files(untracked=True) == [
+            '.gitignore', 'sub/new file.txt', 'untracked.txt'
+        ]
+        assert vcs.list_files('sub', untracked=True) == ['new file.txt']
+        os.remove('tracked.txt')
+        assert vcs.list_files() == []
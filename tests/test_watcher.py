@@ -0,0 +1,48 @@
+import os
+import pytest
+from hatchery import watcher
+
+
+def test_polling_watcher(tmpdir):
+    extra_path = str(tmpdir.join('elsewhere.yml'))
+    with tmpdir.mkdir('project').as_cwd():
+        os.makedirs('package')
+        open(os.path.join('package', 'module.py'), 'w').close()
+        os.makedirs('.hatchery.work')
+        project_watcher = watcher.PollingWatcher('.', extra_paths=[extra_path])
+        assert project_watcher.poll() == []
+        with open(os.path.join('package', 'module.py'), 'w') as fh:
+            fh.write('changed = True')
+        open(os.path.join('.hatchery.work', 'ignored.py'), 'w').close()
+        open(os.path.join('package', 'ignored.pyc'), 'w').close()
+        open('new.py', 'w').close()
+        assert project_watcher.poll() == ['new.py', os.path.join('package', 'module.py')]
+        assert project_watcher.poll() == []
+        os.remove('new.py')
+        open(extra_path, 'w').close()
+        assert project_watcher.poll() == [extra_path, 'new.py']
+
+
+def test_inotify_watcher(tmpdir):
+    try:
+        project_watcher = watcher.InotifyWatcher(str(tmpdir))
+    except OSError:
+        pytest.skip('inotify is not available')
+    try:
+        assert project_watcher.poll() == []
+        with tmpdir.as_cwd():
+            os.makedirs(os.path.join('package', 'subpackage'))
+            open(os.path.join('package', 'subpackage', 'module.py'), 'w').close()
+            os.makedirs('.hatchery.work')
+            assert project_watcher.poll(timeout=1) == [
+                'package', os.path.join('package', 'subpackage'),
+                os.path.join('package', 'subpackage', 'module.py')
+            ]
+            open(os.path.join('package', 'subpackage', 'other.py'), 'w').close()
+            open(os.path.join('.hatchery.work', 'ignored.py'), 'w').close()
+            assert project_watcher.poll(timeout=1) == [
+                os.path.join('package', 'subpackage', 'other.py')
+            ]
+            assert project_watcher.poll() == []
+    finally:
+        project_watcher.close()